@@ -1,15 +1,43 @@
 import os
+import json
+import time
 import logging
-import re
 import pymysql
 import boto3
-from flask import Flask, render_template, request, redirect, url_for, session, g
-from flask_bcrypt import Bcrypt
-from flask_session import Session
-from functools import wraps
-from werkzeug.utils import secure_filename
-import json
-import botocore
+import click
+from flask import Flask, Response, render_template, request, redirect, url_for, session, g
+from flask.cli import AppGroup
+from authz import Authz
+from comment_threads import (COMMENTS_PAGE_SIZE, COUNT_REPLY_SQL, MAX_THREAD_REPLIES, build_comment_tree,
+                             thread_replies_query, top_level_page_query)
+from db_pool import pool_from_env, PoolTimeout
+from dispatcher import LambdaDispatcher
+from exports import EXPORTS, ExportBusy, ExportError, Exporter
+from live_results import LiveResults, TooManyClients
+from metrics import InstrumentedCursor, init_metrics, metrics_response
+from migrations import LATEST_VERSION, current_version, upgrade
+from outbox import OutboxRelay, enqueue, outbox_lag
+from password_hashing import (BUSY_MESSAGE, PASSWORD_POLICY, PASSWORD_POLICY_ERROR, PasswordHasher,
+                              PasswordHasherBusy)
+from pagination import (ADMIN_PAGE_SIZE, POLLS_PAGE_SIZE, decode_page_token, fetch_page, page_result, page_size,
+                        page_url)
+from poll_versions import POLL_LIST, poll_versions_from_env
+from poll_creation import MAX_BULK_POLLS, PollValidationError, insert_polls, validate_poll
+from queries import (API_POLL_SQL, BUFFERED_VOTE_CHECK_SQL, DELETE_USER_SQL, INSERT_COMMENT_SQL, INSERT_REPLY_SQL,
+                     INSERT_USER_SQL, POLL_OPTIONS_SQL, POLL_SQL, REHASH_PASSWORD_SQL, USER_BY_EMAIL_SQL,
+                     USER_VOTE_SQL)
+from query_plans import check_query_plans, seed_plan_data
+from results_cache import LocalResultsCache, results_cache_from_env
+from route_logic import (ADMIN_POLLS_PAGE, ADMIN_USERS_PAGE, ALREADY_VOTED, COMMENT_NOT_FOUND, EMAIL_TAKEN,
+                         INVALID_LOGIN, INVALID_OPTION, POLL_NOT_FOUND, VOTE_ATTEMPTS, VOTE_BUSY, delete_poll_queries,
+                         deleted_poll_versions, lambda_destination, login_landing, poll_results,
+                         registration_side_effects)
+from results_snapshot import SnapshotReader, run_updater, with_snapshot_counts
+from session_store import init_sessions
+from uploads import UPLOAD_MAX_BYTES, UploadError, complete_upload, object_url, presign_upload, upload_stream
+from vote_buffer import VoteBuffer
+from vote_counters import OPTIONS_WITH_VOTES_SQL, VoteRollup, cast_vote, is_vote_retryable, rollup_vote_shards
+from voted_cache import VotedCache
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -18,138 +46,243 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__, template_folder="templates")
 
-# Configure session
+# Configure session (backend chosen by SESSION_BACKEND, see session_store.py)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
 app.secret_key = os.environ.get("SECRET_KEY", "default-secret-key")
-Session(app)
 
-# Initialize Bcrypt for password hashing
-bcrypt = Bcrypt(app)
+# Request, SQL, template and boto3 timings for /metrics; set up before any
+# boto3 client is created so the clients inherit the hooks
+app_metrics = init_metrics(app)
+
+# bcrypt runs on a bounded process pool, off the request threads
+password_hasher = PasswordHasher()
 
 # AWS S3 Configuration
 S3_BUCKET = os.environ.get("S3_BUCKET")
 S3_REGION = os.environ.get("AWS_DEFAULT_REGION")
+# Local S3 stand-in (moto server, MinIO) for development
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
 
 # Initialize S3 client (relying on IAM role for credentials)
-s3_client = boto3.client('s3', region_name=S3_REGION)
-
-# Allowed file extensions for uploads
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'csv'}
-
-# Admin-required decorator
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if "user_id" not in session:
-            return redirect(url_for("login"))
-        # Check if the user is an admin
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT is_admin FROM users WHERE id = %s", (session["user_id"],))
-        user = cursor.fetchone()
-        if user["is_admin"] != 1:
-            return redirect(url_for("index"))  # Redirect if not admin
-        return f(*args, **kwargs)
-    return decorated_function
+s3_client = boto3.client('s3', region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL)
+
+# Uploads normally go straight to S3; this caps the server-side fallback
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+
+# Vote ingestion mode: "sync" writes every vote to MySQL inside the request,
+# "buffered" accepts it into a durable local buffer that is flushed in batches
+VOTE_INGEST_MODE = os.environ.get("VOTE_INGEST_MODE", "sync")
+VOTE_BUFFER_PATH = os.environ.get("VOTE_BUFFER_PATH", "vote_buffer.sqlite3")
+VOTE_FLUSH_INTERVAL = float(os.environ.get("VOTE_FLUSH_INTERVAL", 0.5))
+VOTE_FLUSH_BATCH_SIZE = int(os.environ.get("VOTE_FLUSH_BATCH_SIZE", 500))
+
+# Side effects of domain writes (welcome email, registration counter):
+# "outbox" records them in the same transaction for the relay process,
+# "dispatch" hands them to the in-process Lambda dispatcher after commit
+SIDE_EFFECTS_MODE = os.environ.get("SIDE_EFFECTS_MODE", "outbox")
+
+# Background dispatcher for asynchronous Lambda invocations
+lambda_dispatcher = LambdaDispatcher()
+
+# Database connection pool, created lazily so every gunicorn worker gets its own
+db_pool = None
+
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        # Instrumented cursors feed the per-route SQL metrics
+        db_pool = pool_from_env(InstrumentedCursor) if app_metrics is not None else pool_from_env()
+    # Opens min_size connections once per worker, after the fork
+    db_pool.warm()
+    return db_pool
 
 # Database connection function
 def get_db():
     if 'db' not in g:
-        db_host = os.environ.get('DB_HOST')
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        db_name = os.environ.get('DB_NAME')
-
-        # Log the database host and other details (ensure not to log sensitive info in production)
-        logger.debug(f"Connecting to database at {db_host} with user {db_user}")
-
         try:
-            g.db = pymysql.connect(
-                host=db_host,
-                user=db_user,
-                password=db_password,
-                database=db_name,
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            g.db = get_db_pool().acquire()
         except pymysql.err.OperationalError as e:
             logger.error(f"Error connecting to the database: {e}")
             raise e
+        except PoolTimeout as e:
+            logger.error(f"Database connection pool exhausted: {e} {db_pool.stats()}")
+            raise e
     return g.db
 
-# Close the database connection after each request
+# Login and admin checks: the session says who is logged in, the admin role
+# comes from a short-lived per-worker cache stamped with users.role_version
+authz = Authz(get_db)
+login_required = authz.login_required
+admin_required = authz.admin_required
+
+# Hand the request's connection back to the pool early (see MySQLSessionStore)
+def release_db():
+    db = g.pop('db', None)
+    if db is not None:
+        db_pool.release(db)
+
+# Sessions live in MySQL by default, so any instance can serve any user
+session_interface = init_sessions(app, get_db_pool, release_db)
+
+# Return the database connection to the pool after each request
 @app.teardown_appcontext
 def close_connection(exception):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
-
-# Initialize tables before first request
-@app.before_first_request
-def initialize_tables():
-    db = get_db()
-    cursor = db.cursor()
-    # Create tables if they do not exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        email VARCHAR(255) NOT NULL UNIQUE,
-                        password VARCHAR(255) NOT NULL,
-                        is_admin TINYINT DEFAULT 0)''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS polls (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        poll TEXT NOT NULL,
-                        creator_id INT NOT NULL,
-                        FOREIGN KEY (creator_id) REFERENCES users(id))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS options (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        poll_id INT NOT NULL,
-                        option_text TEXT NOT NULL,
-                        votes INT DEFAULT 0,
-                        FOREIGN KEY (poll_id) REFERENCES polls(id))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS comments (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        poll_id INT NOT NULL,
-                        user_id INT NOT NULL,
-                        comment TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        parent_comment_id INT,
-                        FOREIGN KEY (poll_id) REFERENCES polls(id),
-                        FOREIGN KEY (user_id) REFERENCES users(id),
-                        FOREIGN KEY (parent_comment_id) REFERENCES comments(id))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS votes (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        poll_id INT NOT NULL,
-                        user_id INT NOT NULL,
-                        option_id INT NOT NULL,
-                        FOREIGN KEY (poll_id) REFERENCES polls(id),
-                        FOREIGN KEY (user_id) REFERENCES users(id),
-                        FOREIGN KEY (option_id) REFERENCES options(id),
-                        UNIQUE(poll_id, user_id))''')
-    db.commit()
+        # Connections that failed at the protocol level are not reused
+        db_pool.release(db, discard=isinstance(exception, pymysql.err.OperationalError))
+
+# Poll results cache (poll, options and comments keyed by poll id)
+results_cache = results_cache_from_env()
+
+# Cache key for a poll id taken from the URL, None if it is not a plain integer
+def results_cache_key(id):
+    return int(id) if str(id).isdigit() else None
+
+# (poll, user) pairs this worker has seen vote, so repeat clicks skip MySQL
+voted_cache = VotedCache()
+
+# Per-poll change counters behind the JSON API's ETags. Bump after the
+# change is committed; readers take the version before reading the data.
+poll_versions = poll_versions_from_env()
+
+# Keep cached results in step with votes flushed from the write-behind buffer
+def apply_flushed_votes(votes):
+    for poll_id, _, option_id in votes:
+        results_cache.apply_vote(poll_id, option_id)
+    for poll_id in {vote[0] for vote in votes}:
+        poll_versions.bump(poll_id)
+
+# Shared-memory vote counts for the hottest polls, refreshed by the
+# `flask results-snapshot` updater process
+results_snapshot = SnapshotReader()
+
+# Live vote counts pushed to open poll pages, one upstream reader per poll per worker
+live_results = LiveResults(get_db_pool, results_snapshot)
+
+# Run the single results snapshot updater for this instance
+@app.cli.command("results-snapshot")
+def results_snapshot_command():
+    run_updater(get_db_pool())
+
+# Write-behind vote buffer (only used when VOTE_INGEST_MODE is "buffered")
+vote_buffer = VoteBuffer(VOTE_BUFFER_PATH, get_db_pool,
+                         flush_interval=VOTE_FLUSH_INTERVAL,
+                         batch_size=VOTE_FLUSH_BATCH_SIZE,
+                         on_flush=apply_flushed_votes)
+
+# Background fold of sharded vote counters into options.votes
+vote_rollup = VoteRollup(get_db_pool)
+
+# Make sure this worker flushes buffered votes, including ones left behind by
+# a worker that died before flushing them, and rolls up vote shards
+@app.before_request
+def start_vote_flusher():
+    if VOTE_INGEST_MODE == "buffered":
+        vote_buffer.start()
+    vote_rollup.start()
+
+# Start this worker's password hashing pool before the first login needs it,
+# so the bcrypt cost is calibrated in the background
+@app.before_request
+def start_password_hasher():
+    password_hasher.start()
+
+# Fold sharded vote counters into options.votes once (e.g. from cron)
+@app.cli.command("rollup-votes")
+def rollup_votes_command():
+    with get_db_pool().connection() as db:
+        moved = rollup_vote_shards(db)
+    print(f"Rolled up {moved} votes")
+
+# Schema migrations: `flask db upgrade` applies them, workers only compare
+# versions so no DDL ever runs on the request path
+db_cli = AppGroup("db", help="Database schema migrations.")
+
+@db_cli.command("upgrade")
+def db_upgrade_command():
+    with get_db_pool().connection() as db:
+        applied = upgrade(db)
+    print(f"Applied migrations: {applied}" if applied else f"Schema is up to date (version {LATEST_VERSION})")
+
+@db_cli.command("current")
+def db_current_command():
+    with get_db_pool().connection() as db:
+        print(f"Schema version {current_version(db)}, latest is {LATEST_VERSION}")
+
+app.cli.add_command(db_cli)
+
+# Cheap once-per-worker schema version check (retried while behind)
+schema_checked_at = None
+
+@app.before_request
+def check_schema_version():
+    global schema_checked_at
+    # Metrics stay scrapable and the ALB health check keeps passing while
+    # the database is down
+    if request.endpoint in ("prometheus_metrics", "health"):
+        return
+    now = time.monotonic()
+    if schema_checked_at is not None and (schema_checked_at is True or now - schema_checked_at < 60):
+        return
+    version = current_version(get_db())
+    if version < LATEST_VERSION:
+        logger.error(f"Database schema is at version {version}, expected {LATEST_VERSION}: run `flask db upgrade`")
+        schema_checked_at = now
+    else:
+        schema_checked_at = True
+
+# Deliver outbox events (run one or more next to gunicorn)
+@app.cli.command("outbox-relay")
+def outbox_relay_command():
+    OutboxRelay(get_db_pool()).run()
+
+# EXPLAIN every query the app issues and fail on full table scans or
+# filesorts. Meant for a local/CI MySQL; --seed fills an empty database first.
+@app.cli.command("check-query-plans")
+@click.option("--seed", is_flag=True, help="Insert synthetic rows so the optimizer plans realistically.")
+def check_query_plans_command(seed):
+    with get_db_pool().connection() as db:
+        upgrade(db)
+        if seed:
+            seed_plan_data(db)
+        failures = check_query_plans(db)
+    for name, problem, row in failures:
+        print(f"FAIL {name}: {problem} {row}")
+    if failures:
+        raise SystemExit(1)
+    print("All query plans use indexes")
 
-# Check if file extension is allowed
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 # Routes
 
+# "Next page" links in templates
+app.add_template_global(page_url)
+
 # Home route (index)
 @app.route("/")
+@login_required
 def index():
-    if "user_id" not in session:
-        return redirect(url_for("login"))  # Redirect to login if user is not logged in
-
+    size = page_size(POLLS_PAGE_SIZE)
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM polls")
-    polls = cursor.fetchall()
+    polls, polls_next = fetch_page(cursor, "*", "polls", [], [], "after", size)
 
-    my_polls = []
+    my_polls, my_polls_next = [], None
     if "user_id" in session:
-        cursor.execute("SELECT * FROM polls WHERE creator_id = %s", (session["user_id"],))
-        my_polls = cursor.fetchall()
-
-    return render_template("index.html", polls=polls, my_polls=my_polls)
+        my_polls, my_polls_next = fetch_page(cursor, "*", "polls", ["creator_id = %s"], [session["user_id"]],
+                                             "my_after", size)
+
+    return render_template("index.html", polls=polls, my_polls=my_polls,
+                           polls_next=polls_next, my_polls_next=my_polls_next)
+
+# Start a fresh session before authenticating: server-side sessions get a
+# new id, so a session id fixed or leaked before the login is worthless
+def regenerate_session():
+    regenerate = getattr(session_interface, "regenerate", None)
+    if regenerate is not None:
+        regenerate(session)
+    else:
+        session.clear()
 
 # Registration route
 @app.route("/register", methods=["GET", "POST"])
@@ -160,45 +293,50 @@ def register():
         password = request.form["password"]
 
         # Password strength validation
-        if not re.match(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$', password):
-            error = "Password must be at least 8 characters long, include uppercase, lowercase, number, and special character."
+        if not PASSWORD_POLICY.match(password):
+            error = PASSWORD_POLICY_ERROR
         else:
-            hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
             try:
+                hashed_password = password_hasher.hash(password)
                 db = get_db()
                 cursor = db.cursor()
-                cursor.execute("INSERT INTO users (email, password) VALUES (%s, %s)", (email, hashed_password))
-                db.commit()
-
-                # Invoke Lambda Function
-                try:
-                    lambda_client = boto3.client('lambda', region_name='eu-central-1')
-
-                    payload = {'recipient_email': email}
-
-                    response = lambda_client.invoke(
-                        FunctionName='welcome_email_function',
-                        InvocationType='Event',
-                        Payload=json.dumps(payload)
-                    )
-                    
-                    response = lambda_client.invoke(
-                        FunctionName='registration_counter_function',
-                        InvocationType='Event',
-                        Payload=json.dumps({})
-                    )
-
-                    logging.info(f"Lambda function invoked successfully: {response}")
-                except botocore.exceptions.ClientError as e:
-                    logging.error(f"Error invoking Lambda function: {e}")
-                    # Handle the error as needed
-
+                cursor.execute(INSERT_USER_SQL, (email, hashed_password))
+                side_effects = registration_side_effects(cursor.lastrowid, email)
+
+                if SIDE_EFFECTS_MODE == "outbox":
+                    # Committed together with the user; the relay delivers them
+                    for function_name, dedupe_key, payload in side_effects:
+                        enqueue(cursor, 'user.registered', dedupe_key, lambda_destination(function_name), payload)
+                    db.commit()
+                else:
+                    db.commit()
+                    # Welcome email and registration counter run off the request path
+                    for function_name, dedupe_key, payload in side_effects:
+                        lambda_dispatcher.submit(function_name, payload)
+
+                regenerate_session()
                 return redirect(url_for("login"))
             except pymysql.err.IntegrityError:
-                error = "Email already exists. Please use a different one."
+                error = EMAIL_TAKEN
+            except PasswordHasherBusy:
+                return render_template("register.html", error=BUSY_MESSAGE), 503
 
     return render_template("register.html", error=error)
 
+# Upgrade a hash made with a lower bcrypt cost than the current one. The
+# login already succeeded, so failures here are only logged.
+def rehash_password(db, user, password):
+    if not password_hasher.needs_rehash(user["password"]):
+        return
+    try:
+        cursor = db.cursor()
+        # Compare-and-set: a concurrent password change wins
+        cursor.execute(REHASH_PASSWORD_SQL, (password_hasher.hash(password), user["id"], user["password"]))
+        db.commit()
+        password_hasher.count_rehash()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error upgrading password hash for user {user['id']}: {e}")
 
 # Login route
 @app.route("/login", methods=["GET", "POST"])
@@ -210,20 +348,23 @@ def login():
 
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+        cursor.execute(USER_BY_EMAIL_SQL, (email,))
         user = cursor.fetchone()
 
-        if user and bcrypt.check_password_hash(user["password"], password):
-            session["user_id"] = user["id"]
-            session["email"] = user["email"]  # Keep email in session if needed
+        try:
+            valid = user is not None and password_hasher.verify(password, user["password"])
+        except PasswordHasherBusy:
+            return render_template("login.html", error=BUSY_MESSAGE), 503
+
+        if valid:
+            rehash_password(db, user, password)
+            regenerate_session()
+            authz.login(user)
 
             # Redirect based on admin status
-            if user["is_admin"] == 1:
-                return redirect(url_for("admin_dashboard"))
-            else:
-                return redirect(url_for("index"))
+            return redirect(url_for(login_landing(user)))
         else:
-            error = "Invalid email or password."
+            error = INVALID_LOGIN
 
     return render_template("login.html", error=error)
 
@@ -236,158 +377,304 @@ def logout():
 # Poll details route
 @app.route("/polls/<id>")
 def polls(id):
-    db = get_db()
-    cursor = db.cursor()
-
-    # Fetch the poll details
-    cursor.execute("SELECT * FROM polls WHERE id = %s", (id,))
-    poll = cursor.fetchone()
-
-    # Fetch the options for the poll
-    cursor.execute("SELECT * FROM options WHERE poll_id = %s", (id,))
-    options = cursor.fetchall()
+    cache_key = results_cache_key(id)
+    results = results_cache.get(cache_key) if cache_key is not None else None
+    if results is None:
+        db = get_db()
+        cursor = db.cursor()
 
-    # Fetch all comments and replies for the poll
-    cursor.execute("""
-        SELECT comments.*, users.email
-        FROM comments
-        JOIN users ON comments.user_id = users.id
-        WHERE poll_id = %s
-        ORDER BY created_at ASC
-        """, (id,))
-    comments = cursor.fetchall()
+        # Fetch the poll details
+        cursor.execute(POLL_SQL, (id,))
+        poll = cursor.fetchone()
+
+        # Fetch the options for the poll. Hot polls take their counts from
+        # the shared snapshot; the others sum shard counts in MySQL.
+        options = None
+        counts = results_snapshot.get(poll["id"]) if poll else None
+        if counts is not None:
+            cursor.execute(POLL_OPTIONS_SQL, (id,))
+            options = with_snapshot_counts(cursor.fetchall(), counts)
+        if options is None:
+            cursor.execute(OPTIONS_WITH_VOTES_SQL, (id,))
+            options = cursor.fetchall()
+
+        # First page of top-level comments; replies load through comment_replies
+        cursor.execute(*top_level_page_query(id, None))
+        results = poll_results(poll, options, cursor.fetchall())
+        if poll and cache_key is not None:
+            results_cache.set(cache_key, results)
+
+    poll = results["poll"]
+    options = results["options"]
+    comments, comments_next = results["comments"], results["comments_next"]
+    # Older comment pages are read directly, only the first page is cached
+    comments_after = decode_page_token(request.args.get("comments_after"))
+    if poll and comments_after is not None:
+        cursor = get_db().cursor()
+        cursor.execute(*top_level_page_query(id, comments_after))
+        comments, comments_next = page_result(cursor.fetchall(), COMMENTS_PAGE_SIZE)
+
+    # Hot polls: bring cached counts up to the shared snapshot
+    if poll:
+        options = with_snapshot_counts(options, results_snapshot.get(poll["id"])) or options
 
     # Check if the user has already voted
     has_voted = False
-    if "user_id" in session:
-        cursor.execute("SELECT * FROM votes WHERE poll_id = %s AND user_id = %s", (id, session["user_id"]))
-        vote = cursor.fetchone()
-        if vote:
-            has_voted = True
+    if "user_id" in session and poll:
+        has_voted = voted_cache.has_voted(poll["id"], session["user_id"])
+        if not has_voted:
+            cursor = get_db().cursor()
+            cursor.execute(USER_VOTE_SQL, (id, session["user_id"]))
+            vote = cursor.fetchone()
+            if vote:
+                has_voted = True
+                voted_cache.add(poll["id"], session["user_id"])
+            elif VOTE_INGEST_MODE == "buffered":
+                has_voted = vote_buffer.has_pending(poll["id"], session["user_id"])
 
     if poll:
-        return render_template("show_poll.html", poll=poll, options=options, comments=comments, has_voted=has_voted)
+        return render_template("show_poll.html", poll=poll, options=options, comments=comments,
+                               comments_next=comments_next, has_voted=has_voted)
     else:
-        return "Poll not found", 404
+        return POLL_NOT_FOUND, 404
+
+# Live results: Server-Sent Events with the poll's counts, then coalesced
+# changes. Needs an async worker (gunicorn -k gevent) for many open streams.
+@app.route("/polls/<int:id>/stream")
+def poll_stream(id):
+    try:
+        events = live_results.stream(id)
+    except TooManyClients as e:
+        logger.error(f"Rejecting live results stream: {e}")
+        return "Too many live result streams, please reload later.", 503
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Voting route
 @app.route("/vote/<id>/<option_id>")
+@login_required
 def vote(id, option_id):
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
+    poll_id = results_cache_key(id)
+    if poll_id is None or not option_id.isdigit():
+        return INVALID_OPTION, 400
+    option_id = int(option_id)
+    user_id = session["user_id"]
+    # Repeat clicks are answered from this worker's memory
+    if voted_cache.has_voted(poll_id, user_id):
+        return ALREADY_VOTED
+    if VOTE_INGEST_MODE == "buffered":
+        return buffered_vote(poll_id, option_id)
+
+    # One transaction, no reads first: the affected row count tells whether
+    # the option belongs to the poll, UNIQUE(poll_id, user_id) rejects repeats.
+    # A deadlock or lock wait timeout is retried once.
     db = get_db()
     cursor = db.cursor()
-    # Check if the user has already voted in this poll
-    cursor.execute("SELECT * FROM votes WHERE poll_id = %s AND user_id = %s", (id, session["user_id"]))
-    existing_vote = cursor.fetchone()
-    if existing_vote:
-        return "You have already voted in this poll."
-
-    # Ensure the option belongs to the poll
-    cursor.execute("SELECT * FROM options WHERE id = %s AND poll_id = %s", (option_id, id))
-    option = cursor.fetchone()
-
-    if option:
-        # Record the vote
+    for attempt in range(VOTE_ATTEMPTS):
         try:
-            cursor.execute("INSERT INTO votes (poll_id, user_id, option_id) VALUES (%s, %s, %s)", (id, session["user_id"], option_id))
-            # Increment the vote count in the options table
-            cursor.execute("UPDATE options SET votes = votes + 1 WHERE id = %s", (option_id,))
-            db.commit()
-            return redirect(url_for("polls", id=id))
+            recorded = cast_vote(cursor, poll_id, user_id, option_id)
+            break
         except pymysql.err.IntegrityError:
-            return "You have already voted in this poll."
+            db.rollback()
+            voted_cache.add(poll_id, user_id)
+            return ALREADY_VOTED
+        except pymysql.err.OperationalError as e:
+            db.rollback()
+            if not is_vote_retryable(e):
+                raise
+            logger.warning(f"Vote on poll {poll_id} hit {e.args[0]}, attempt {attempt + 1}")
     else:
-        return "Invalid option.", 400
+        return VOTE_BUSY, 503
+    if not recorded:
+        db.rollback()
+        return INVALID_OPTION, 400
+    db.commit()
+    voted_cache.add(poll_id, user_id)
+    results_cache.apply_vote(poll_id, option_id)
+    poll_versions.bump(poll_id)
+    return redirect(url_for("polls", id=id))
+
+# Accept a vote into the write-behind buffer after a single validation query
+def buffered_vote(poll_id, option_id):
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(BUFFERED_VOTE_CHECK_SQL, (poll_id, session["user_id"], option_id, poll_id))
+    check = cursor.fetchone()
+    if check["has_voted"]:
+        voted_cache.add(poll_id, session["user_id"])
+        return ALREADY_VOTED
+    if check["option_id"] is None:
+        return INVALID_OPTION, 400
+
+    accepted = vote_buffer.append(check["poll_id"], session["user_id"], check["option_id"])
+    voted_cache.add(poll_id, session["user_id"])
+    if not accepted:
+        return ALREADY_VOTED
+    return redirect(url_for("polls", id=poll_id))
 
 # Create poll route
 @app.route("/polls", methods=["GET", "POST"])
+@login_required
 def create_poll():
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
     if request.method == "POST":
         poll = request.form["poll"]
         options = request.form.getlist("options[]")
         creator_id = session["user_id"]
 
+        try:
+            poll, options = validate_poll(poll, options)
+        except PollValidationError as e:
+            return render_template("new_poll.html", error=str(e)), 400
+
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("INSERT INTO polls (poll, creator_id) VALUES (%s, %s)", (poll, creator_id))
-        poll_id = cursor.lastrowid
-
-        for option in options:
-            cursor.execute("INSERT INTO options (poll_id, option_text) VALUES (%s, %s)", (poll_id, option))
-
+        insert_polls(cursor, creator_id, [(poll, options)])
         db.commit()
+        poll_versions.bump(POLL_LIST)
 
         return redirect(url_for("index"))
 
     return render_template("new_poll.html")
 
+# Bulk poll creation (seeding): JSON {"polls": [{"poll": ..., "options": [...]}, ...]}
+# All polls are validated first and created in one transaction.
+@app.route("/polls/bulk", methods=["POST"])
+@authz.api_login_required
+def create_polls_bulk():
+    data = request.get_json(silent=True) or {}
+    polls = data.get("polls")
+    if not isinstance(polls, list) or not polls:
+        return {"error": "Expected a non-empty \"polls\" list."}, 400
+    if len(polls) > MAX_BULK_POLLS:
+        return {"error": f"At most {MAX_BULK_POLLS} polls per request."}, 400
+
+    validated = []
+    for index, item in enumerate(polls):
+        try:
+            if not isinstance(item, dict):
+                raise PollValidationError("Each poll must be an object.")
+            validated.append(validate_poll(item.get("poll"), item.get("options")))
+        except PollValidationError as e:
+            return {"error": str(e), "index": index}, 400
+
+    db = get_db()
+    cursor = db.cursor()
+    poll_ids = insert_polls(cursor, session["user_id"], validated)
+    db.commit()
+    poll_versions.bump(POLL_LIST)
+
+    return {"poll_ids": poll_ids}, 201
+
 # Route for viewing a user's polls
 @app.route("/my_polls")
+@login_required
 def my_polls():
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
     creator_id = session["user_id"]
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM polls WHERE creator_id = %s", (creator_id,))
-    polls = cursor.fetchall()
+    polls, polls_next = fetch_page(cursor, "*", "polls", ["creator_id = %s"], [creator_id],
+                                   "after", page_size(POLLS_PAGE_SIZE))
 
-    return render_template("my_polls.html", polls=polls)
+    return render_template("my_polls.html", polls=polls, polls_next=polls_next)
 
 # Add comment to poll route
 @app.route("/add_comment/<int:poll_id>", methods=["POST"])
+@login_required
 def add_comment(poll_id):
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
     comment_text = request.form["comment"]
     user_id = session["user_id"]
 
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("INSERT INTO comments (poll_id, user_id, comment) VALUES (%s, %s, %s)", (poll_id, user_id, comment_text))
+    cursor.execute(INSERT_COMMENT_SQL, (poll_id, user_id, comment_text))
     db.commit()  # Ensure the commit after inserting the comment
+    results_cache.invalidate(poll_id)
 
     return redirect(url_for("polls", id=poll_id))
 
 # Add reply to comment route
 @app.route("/add_reply/<int:poll_id>/<int:parent_comment_id>", methods=["POST"])
+@login_required
 def add_reply(poll_id, parent_comment_id):
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
     reply_text = request.form["reply"]
     user_id = session["user_id"]
 
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("INSERT INTO comments (poll_id, user_id, comment, parent_comment_id) VALUES (%s, %s, %s, %s)",
-                   (poll_id, user_id, reply_text, parent_comment_id))
+    # Bumping the parent's reply_count first also checks it is a comment of this poll
+    if not cursor.execute(COUNT_REPLY_SQL, (parent_comment_id, poll_id)):
+        db.rollback()
+        return COMMENT_NOT_FOUND, 404
+    cursor.execute(INSERT_REPLY_SQL, (poll_id, user_id, reply_text, parent_comment_id))
     db.commit()  # Ensure the commit after inserting the reply
+    results_cache.invalidate(poll_id)
 
     return redirect(url_for("polls", id=poll_id))
 
+# Replies below one comment, as an HTML fragment for expanding a thread
+@app.route("/polls/<int:poll_id>/comments/<int:comment_id>/replies")
+def comment_replies(poll_id, comment_id):
+    cursor = get_db().cursor()
+    cursor.execute(*thread_replies_query(poll_id, comment_id))
+    rows = cursor.fetchall()
+    return render_template("comment_replies.html", replies=build_comment_tree(rows[:MAX_THREAD_REPLIES], comment_id),
+                           truncated=len(rows) > MAX_THREAD_REPLIES, limit=MAX_THREAD_REPLIES)
+
 # Admin dashboard
 @app.route("/admin")
 @admin_required
 def admin_dashboard():
-    # Fetch all polls
+    size = page_size(ADMIN_PAGE_SIZE)
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM polls")
-    polls = cursor.fetchall()
+    # One page of polls
+    polls, polls_next = fetch_page(cursor, *ADMIN_POLLS_PAGE, size)
+
+    # One page of users
+    users, users_next = fetch_page(cursor, *ADMIN_USERS_PAGE, size)
+
+    return render_template("admin_dashboard.html", polls=polls, users=users,
+                           polls_next=polls_next, users_next=users_next, exports=EXPORTS)
+
+# Results cache hit/miss/eviction statistics for this worker
+@app.route("/admin/cache_stats")
+@admin_required
+def admin_cache_stats():
+    return results_cache.stats()
+
+# Role cache hits and noticed role changes for this worker
+@app.route("/admin/authz_stats")
+@admin_required
+def admin_authz_stats():
+    return authz.stats()
+
+# Outbox backlog and delivery lag
+@app.route("/admin/outbox_stats")
+@admin_required
+def admin_outbox_stats():
+    return outbox_lag(get_db())
 
-    # Fetch all users
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
+# Streaming exports of whole tables for admins, on their own unbuffered
+# connection; at most EXPORT_MAX_CONCURRENT per worker
+exporter = Exporter(get_db_pool)
 
-    return render_template("admin_dashboard.html", polls=polls, users=users)
+# ?format=csv|jsonl, ?gzip=1, and ?after_id=/?until_id= to resume or split by id
+@app.route("/admin/export/<name>")
+@admin_required
+def admin_export(name):
+    if name not in EXPORTS:
+        return "Export not found", 404
+    try:
+        stream = exporter.open(name, request.args.get("format", "csv"), request.args.get("after_id"),
+                               request.args.get("until_id"), request.args.get("gzip") == "1")
+    except ExportError as e:
+        return str(e), 400
+    except (ExportBusy, PoolTimeout) as e:
+        logger.error(f"Rejecting export of {name}: {e}")
+        return "Too many exports running, please retry later.", 503
+    return Response(stream, mimetype=stream.mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={stream.filename}",
+                             "Cache-Control": "no-store", "X-Accel-Buffering": "no"})
 
 # Admin delete user route
 @app.route("/admin/delete_user/<int:user_id>", methods=["POST"])
@@ -398,7 +685,22 @@ def admin_delete_user(user_id):
 
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    cursor.execute(DELETE_USER_SQL, (user_id,))
+    db.commit()
+    authz.invalidate(user_id)
+
+    return redirect(url_for("admin_dashboard"))
+
+# Admin grant/revoke admin route; other workers notice within AUTHZ_ROLE_TTL
+@app.route("/admin/set_admin/<int:user_id>", methods=["POST"])
+@admin_required
+def admin_set_admin(user_id):
+    if user_id == session["user_id"]:
+        return redirect(url_for("admin_dashboard"))
+
+    db = get_db()
+    cursor = db.cursor()
+    authz.set_admin(cursor, user_id, request.form.get("is_admin") == "1")
     db.commit()
 
     return redirect(url_for("admin_dashboard"))
@@ -409,43 +711,172 @@ def admin_delete_user(user_id):
 def delete_poll(poll_id):
     db = get_db()
     cursor = db.cursor()
-    cursor.execute("DELETE FROM polls WHERE id = %s", (poll_id,))
-    cursor.execute("DELETE FROM options WHERE poll_id = %s", (poll_id,))
+    for query in delete_poll_queries(poll_id):
+        cursor.execute(*query)
     db.commit()
+    results_cache.invalidate(poll_id)
+    for key in deleted_poll_versions(poll_id):
+        poll_versions.bump(key)
     return redirect(url_for("admin_dashboard"))
 
 @app.route("/upload", methods=["GET", "POST"])
+@login_required
 def upload_file():
-    if "user_id" not in session:
-        return redirect(url_for("login"))
-
     if request.method == "POST":
-        if 'file' not in request.files:
-            return "No file part"
-        file = request.files['file']
-        if file.filename == '':
-            return "No selected file"
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            s3_client.upload_fileobj(
-                file,
-                S3_BUCKET,
-                filename,
-                ExtraArgs={
-                    "ACL": "public-read",
-                    "ContentType": file.content_type
-                }
-            )
-            file_url = f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{filename}"
-            return f"File uploaded successfully. Accessible at {file_url}"
-
-    return render_template("upload.html")
+        # Fallback for browsers without JavaScript; the upload page normally
+        # sends files straight to S3 through /upload/presign
+        file = request.files.get('file')
+        if file is None or file.filename == '':
+            return render_template("upload.html", error="No file selected."), 400
+        db = get_db()
+        try:
+            key = upload_stream(s3_client, S3_BUCKET, db.cursor(), session["user_id"], file)
+        except UploadError as e:
+            return render_template("upload.html", error=str(e)), 400
+        db.commit()
+        return render_template("upload.html", file_url=object_url(s3_client, S3_BUCKET, key))
+
+    return render_template("upload.html", max_bytes=UPLOAD_MAX_BYTES)
+
+# Signed POST policy for a direct browser upload: JSON {"filename", "size"}
+@app.route("/upload/presign", methods=["POST"])
+@authz.api_login_required
+def upload_presign():
+    data = request.get_json(silent=True) or {}
+    size = data.get("size")
+    db = get_db()
+    try:
+        post = presign_upload(s3_client, S3_BUCKET, db.cursor(), session["user_id"], str(data.get("filename", "")),
+                              size if isinstance(size, int) else None)
+    except UploadError as e:
+        return {"error": str(e)}, 400
+    db.commit()
+    return post, 200
+
+# Completion callback after the browser's upload to S3: JSON {"key"}
+@app.route("/upload/complete", methods=["POST"])
+@authz.api_login_required
+def upload_complete():
+    data = request.get_json(silent=True) or {}
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        key = complete_upload(s3_client, S3_BUCKET, cursor, session["user_id"], str(data.get("key", "")))
+    except UploadError as e:
+        db.commit()
+        return {"error": str(e)}, 400
+    db.commit()
+    return {"key": key, "url": object_url(s3_client, S3_BUCKET, key)}, 200
+
+# JSON API. Responses carry a strong ETag built from the poll's version
+# counter, so a matching If-None-Match is answered with 304 from the counter
+# alone, without touching MySQL. Bodies are compact: rows as arrays, with the
+# column names listed once.
+API_FORMAT = 1
+API_CACHE_MAX_AGE = int(os.environ.get("API_CACHE_MAX_AGE", 1))
+API_STALE_WHILE_REVALIDATE = int(os.environ.get("API_STALE_WHILE_REVALIDATE", 30))
+
+# Rendered bodies by ETag: the same version never needs rendering twice
+api_bodies = LocalResultsCache(ttl=300, max_entries=int(os.environ.get("API_BODY_CACHE_ENTRIES", 1024)))
+
+def api_response(etag, build):
+    cache_control = f"public, max-age={API_CACHE_MAX_AGE}, stale-while-revalidate={API_STALE_WHILE_REVALIDATE}"
+    if etag is not None and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = api_bodies.get(etag) if etag is not None else None
+        if body is None:
+            data = build()
+            if data is None:
+                return {"error": "Not found."}, 404
+            body = json.dumps(data, separators=(",", ":"), default=str)
+            if etag is not None:
+                api_bodies.set(etag, body)
+        response = app.response_class(body, mimetype="application/json")
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+# Newest polls first, keyset paginated with ?after=<token>&per_page=N
+@app.route("/api/polls")
+@app.route("/api/v1/polls")
+def api_polls():
+    size = page_size(POLLS_PAGE_SIZE)
+    version = poll_versions.version(POLL_LIST)
+    after = decode_page_token(request.args.get("after"))
+    etag = f"polls.f{API_FORMAT}.{version}.{after or 0}.{size}" if version else None
+
+    def build():
+        cursor = get_db().cursor()
+        polls, polls_next = fetch_page(cursor, "id, poll, creator_id", "polls", [], [], "after", size)
+        return {"fields": ["id", "poll", "creator_id"],
+                "polls": [[poll["id"], poll["poll"], poll["creator_id"]] for poll in polls],
+                "next": polls_next}
+    return api_response(etag, build)
+
+# Vote counts of one poll
+@app.route("/api/polls/<int:id>/results")
+@app.route("/api/v1/polls/<int:id>/results")
+def api_poll_results(id):
+    version = poll_versions.version(id)
+    etag = f"results.f{API_FORMAT}.{id}.{version}" if version else None
+
+    def build():
+        cursor = get_db().cursor()
+        cursor.execute(API_POLL_SQL, (id,))
+        poll = cursor.fetchone()
+        if poll is None:
+            return None
+        cursor.execute(OPTIONS_WITH_VOTES_SQL, (id,))
+        options = [[option["id"], option["option_text"], int(option["votes"])] for option in cursor.fetchall()]
+        return {"id": poll["id"], "poll": poll["poll"], "total": sum(option[2] for option in options),
+                "fields": ["id", "option_text", "votes"], "options": options}
+    return api_response(etag, build)
 
 # Health check route for ALB
 @app.route("/health")
 def health():
     return "OK", 200
 
+# Lambda dispatcher queue depth, retries and drops for this worker
+@app.route("/health/dispatcher")
+def dispatcher_health():
+    return lambda_dispatcher.stats(), 200
+
+# Password hashing pool: cost factor, in-flight calls and rejections for this worker
+@app.route("/health/password_hasher")
+def password_hasher_health():
+    return password_hasher.stats(), 200
+
+# Negative vote cache hits and size for this worker
+@app.route("/health/voted_cache")
+def voted_cache_health():
+    return voted_cache.stats(), 200
+
+# Session front cache hits, store writes and sweeps for this worker
+@app.route("/health/sessions")
+def sessions_health():
+    stats = getattr(session_interface, "stats", None)
+    return (stats() if stats else {"backend": type(session_interface).__name__}), 200
+
+# Open live result streams and channels for this worker
+@app.route("/health/live_results")
+def live_results_health():
+    return live_results.stats(), 200
+
+# Connection pool statistics for this worker (pool waits, timeouts, recycles)
+@app.route("/health/db_pool")
+def db_pool_health():
+    return get_db_pool().stats(), 200
+
+# Prometheus metrics, merged across all gunicorn workers
+@app.route("/metrics")
+def prometheus_metrics():
+    if app_metrics is None:
+        return "Metrics are disabled", 404
+    return metrics_response()
+
 # 404 error handler
 @app.errorhandler(404)
 def not_found_error(error):
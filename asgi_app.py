@@ -0,0 +1,674 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import wraps
+
+import aioboto3
+import aiomysql
+import pymysql
+from quart import Quart, Response, render_template, request, redirect, url_for, session
+
+from authz import ROLE_SQL, SET_ADMIN_SQL, Authz
+from comment_threads import (COMMENTS_PAGE_SIZE, COUNT_REPLY_SQL, MAX_THREAD_REPLIES, build_comment_tree,
+                             thread_replies_query, top_level_page_query)
+from live_results import AsyncLiveResults, TooManyClients
+from migrations import CURRENT_VERSION_SQL, LATEST_VERSION
+from outbox import ENQUEUE_SQL
+from pagination import (ADMIN_PAGE_SIZE, POLLS_PAGE_SIZE, decode_page_token, page_query, page_result,
+                        page_url_args, parse_page_size)
+from password_hashing import BUSY_MESSAGE, PASSWORD_POLICY, PASSWORD_POLICY_ERROR, PasswordHasher, PasswordHasherBusy
+from poll_creation import INSERT_OPTIONS_SQL, INSERT_POLL_SQL, PollValidationError, validate_poll
+from poll_versions import POLL_LIST, poll_versions_from_env
+from queries import (DELETE_USER_SQL, INSERT_COMMENT_SQL, INSERT_REPLY_SQL, INSERT_USER_SQL, POLL_OPTIONS_SQL,
+                     POLL_SQL, REHASH_PASSWORD_SQL, USER_BY_EMAIL_SQL, USER_VOTE_SQL)
+from results_cache import results_cache_from_env
+from route_logic import (ADMIN_POLLS_PAGE, ADMIN_USERS_PAGE, ALREADY_VOTED, COMMENT_NOT_FOUND, EMAIL_TAKEN,
+                         INVALID_LOGIN, INVALID_OPTION, POLL_NOT_FOUND, VOTE_ATTEMPTS, VOTE_BUSY, delete_poll_queries,
+                         deleted_poll_versions, lambda_destination, login_landing, poll_results,
+                         registration_side_effects)
+from results_snapshot import SnapshotReader, with_snapshot_counts
+from uploads import (COMPLETE_UPLOAD_SQL, INSERT_COMPLETE_SQL, INSERT_PENDING_SQL, REJECT_UPLOAD_SQL,
+                     UPLOAD_ACL, UPLOAD_BY_KEY_SQL, UPLOAD_MAX_BYTES, UploadError, check_size, head_etag,
+                     head_matches, object_key, presign_args, transfer_config)
+from vote_counters import OPTIONS_WITH_VOTES_SQL, cast_vote_queries, is_vote_retryable
+from voted_cache import VotedCache
+
+# Async variant of app.py for an ASGI server:
+#
+#     hypercorn --workers 3 --bind 0.0.0.0:80 asgi_app:app
+#
+# Same routes for the pages (index, polls, voting, poll creation, comments,
+# admin, uploads), the same SQL (queries.py and the helper modules), route
+# logic (route_logic.py) and templates, but MySQL goes through aiomysql and
+# S3/Lambda through aioboto3, so a worker keeps serving other requests while
+# one waits on the database. bcrypt still runs on the PasswordHasher process pool.
+#
+# Sessions are Quart's signed cookies, which Flask reads as well: run the
+# sync app with SESSION_BACKEND=cookie to share logins between the two.
+# Votes are always written inside the request (VOTE_INGEST_MODE=buffered is
+# not supported here), and the JSON API, bulk creation, the admin exports
+# and the stats endpoints stay on app.py.
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__, template_folder="templates")
+app.config["SESSION_PERMANENT"] = False
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+app.secret_key = os.environ.get("SECRET_KEY", "default-secret-key")
+
+password_hasher = PasswordHasher()
+
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_REGION = os.environ.get("AWS_DEFAULT_REGION")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+LAMBDA_REGION = os.environ.get("LAMBDA_REGION", "eu-central-1")
+LAMBDA_ENDPOINT_URL = os.environ.get("LAMBDA_ENDPOINT_URL")
+SIDE_EFFECTS_MODE = os.environ.get("SIDE_EFFECTS_MODE", "outbox")
+
+# Same DB_* variables as db_pool.pool_from_env
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+DB_POOL_MAX_LIFETIME = int(float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600)))
+
+# Created when the server starts, inside the worker's event loop
+db_pool = None
+s3_client = None
+lambda_client = None
+aws_clients = AsyncExitStack()
+
+# Lambda invocations in flight (dispatch mode), kept so they are not collected
+pending_invokes = set()
+
+
+@app.before_serving
+async def open_clients():
+    global db_pool, s3_client, lambda_client
+    # Calibrates the bcrypt cost in the background, off the event loop
+    password_hasher.start()
+    db_pool = await aiomysql.create_pool(
+        host=os.environ.get("DB_HOST"),
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASSWORD"),
+        db=os.environ.get("DB_NAME"),
+        minsize=DB_POOL_MIN_SIZE,
+        maxsize=DB_POOL_MAX_SIZE,
+        pool_recycle=DB_POOL_MAX_LIFETIME,
+        cursorclass=aiomysql.DictCursor,
+        autocommit=False)
+    aws = aioboto3.Session()
+    s3_client = await aws_clients.enter_async_context(
+        aws.client("s3", region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL))
+    lambda_client = await aws_clients.enter_async_context(
+        aws.client("lambda", region_name=LAMBDA_REGION, endpoint_url=LAMBDA_ENDPOINT_URL))
+
+
+@app.after_serving
+async def close_clients():
+    if pending_invokes:
+        await asyncio.wait(pending_invokes, timeout=5)
+    await aws_clients.aclose()
+    db_pool.close()
+    await db_pool.wait_closed()
+
+
+# A pooled connection and a DictCursor for the duration of a block. Open
+# transactions are rolled back when the block ends, so commit inside it.
+@asynccontextmanager
+async def get_db():
+    try:
+        db = await asyncio.wait_for(db_pool.acquire(), DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Database connection pool exhausted: {db_pool.size} open, {db_pool.freesize} idle")
+        raise
+    try:
+        async with db.cursor() as cursor:
+            yield db, cursor
+    except pymysql.err.OperationalError:
+        # Connections that failed at the protocol level are not reused
+        db.close()
+        raise
+    finally:
+        if not db.closed:
+            await db.rollback()
+        db_pool.release(db)
+
+
+# Login and admin checks, sharing the role cache logic with app.py
+authz = Authz(get_db=None)
+
+
+async def current_role(user_id):
+    found, role = authz.cached_role(user_id)
+    if found:
+        return role
+    async with get_db() as (db, cursor):
+        await cursor.execute(ROLE_SQL, (user_id,))
+        return authz.store_role(user_id, await cursor.fetchone())
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return redirect(url_for("login"))
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def api_login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return {"error": "Login required."}, 401
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def admin_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return redirect(url_for("login"))
+        denied = authz.check_admin(await current_role(session["user_id"]), session)
+        if denied:
+            return redirect(url_for(denied))
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+# Shared with the sync workers of the same instance
+results_cache = results_cache_from_env()
+voted_cache = VotedCache()
+results_snapshot = SnapshotReader()
+poll_versions = poll_versions_from_env()
+
+
+async def read_counts(poll_id):
+    counts = results_snapshot.get(poll_id)
+    if counts is not None:
+        return counts
+    async with get_db() as (db, cursor):
+        await cursor.execute(OPTIONS_WITH_VOTES_SQL, (poll_id,))
+        rows = await cursor.fetchall()
+    return {row["id"]: int(row["votes"]) for row in rows}
+
+live_results = AsyncLiveResults(read_counts)
+
+
+# Cheap once-per-worker schema version check (retried while behind)
+schema_checked_at = None
+
+@app.before_request
+async def check_schema_version():
+    global schema_checked_at
+    # The ALB health check keeps passing while the database is down
+    if request.endpoint == "health":
+        return
+    now = time.monotonic()
+    if schema_checked_at is not None and (schema_checked_at is True or now - schema_checked_at < 60):
+        return
+    async with get_db() as (db, cursor):
+        try:
+            await cursor.execute(CURRENT_VERSION_SQL)
+            version = (await cursor.fetchone())["version"] or 0
+        except pymysql.err.ProgrammingError as e:
+            # 1146: table doesn't exist yet
+            if e.args[0] != 1146:
+                raise
+            version = 0
+    if version < LATEST_VERSION:
+        logger.error(f"Database schema is at version {version}, expected {LATEST_VERSION}: run `flask db upgrade`")
+        schema_checked_at = now
+    else:
+        schema_checked_at = True
+
+
+# Keyset pages, as pagination.fetch_page does for the sync app
+async def fetch_page(cursor, columns, table, where, params, token_arg, size):
+    await cursor.execute(*page_query(columns, table, where, params,
+                                     decode_page_token(request.args.get(token_arg)), size))
+    return page_result(await cursor.fetchall(), size)
+
+
+def page_size(default):
+    return parse_page_size(request.args.get("per_page"), default)
+
+
+# "Next page" links in templates
+@app.template_global()
+def page_url(token_arg, token):
+    return url_for(request.endpoint, **page_url_args(request.args.to_dict(), request.view_args, token_arg, token))
+
+
+# Run a blocking PasswordHasher call without holding up the event loop
+async def run_hasher(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def invoke_lambda(function_name, payload):
+    async def invoke():
+        try:
+            await lambda_client.invoke(FunctionName=function_name, InvocationType="Event",
+                                       Payload=json.dumps(payload))
+        except Exception as e:
+            logger.error(f"Error invoking {function_name}: {e}")
+    task = asyncio.get_running_loop().create_task(invoke())
+    pending_invokes.add(task)
+    task.add_done_callback(pending_invokes.discard)
+
+
+# Routes
+
+@app.route("/")
+@login_required
+async def index():
+    size = page_size(POLLS_PAGE_SIZE)
+    async with get_db() as (db, cursor):
+        polls, polls_next = await fetch_page(cursor, "*", "polls", [], [], "after", size)
+        my_polls, my_polls_next = await fetch_page(cursor, "*", "polls", ["creator_id = %s"],
+                                                   [session["user_id"]], "my_after", size)
+
+    return await render_template("index.html", polls=polls, my_polls=my_polls,
+                                 polls_next=polls_next, my_polls_next=my_polls_next)
+
+
+@app.route("/register", methods=["GET", "POST"])
+async def register():
+    error = None
+    if request.method == "POST":
+        form = await request.form
+        email = form["email"]
+        password = form["password"]
+
+        if not PASSWORD_POLICY.match(password):
+            error = PASSWORD_POLICY_ERROR
+        else:
+            try:
+                hashed_password = await run_hasher(password_hasher.hash, password)
+                async with get_db() as (db, cursor):
+                    await cursor.execute(INSERT_USER_SQL, (email, hashed_password))
+                    side_effects = registration_side_effects(cursor.lastrowid, email)
+                    if SIDE_EFFECTS_MODE == "outbox":
+                        for function_name, dedupe_key, payload in side_effects:
+                            await cursor.execute(ENQUEUE_SQL, ('user.registered', dedupe_key,
+                                                               lambda_destination(function_name),
+                                                               json.dumps(payload)))
+                    await db.commit()
+                if SIDE_EFFECTS_MODE != "outbox":
+                    for function_name, dedupe_key, payload in side_effects:
+                        invoke_lambda(function_name, payload)
+
+                return redirect(url_for("login"))
+            except pymysql.err.IntegrityError:
+                error = EMAIL_TAKEN
+            except PasswordHasherBusy:
+                return await render_template("register.html", error=BUSY_MESSAGE), 503
+
+    return await render_template("register.html", error=error)
+
+
+async def rehash_password(user, password):
+    if not password_hasher.needs_rehash(user["password"]):
+        return
+    try:
+        hashed_password = await run_hasher(password_hasher.hash, password)
+        async with get_db() as (db, cursor):
+            await cursor.execute(REHASH_PASSWORD_SQL, (hashed_password, user["id"], user["password"]))
+            await db.commit()
+        password_hasher.count_rehash()
+    except Exception as e:
+        logger.error(f"Error upgrading password hash for user {user['id']}: {e}")
+
+
+@app.route("/login", methods=["GET", "POST"])
+async def login():
+    error = None
+    if request.method == "POST":
+        form = await request.form
+        email = form["email"]
+        password = form["password"]
+
+        async with get_db() as (db, cursor):
+            await cursor.execute(USER_BY_EMAIL_SQL, (email,))
+            user = await cursor.fetchone()
+
+        try:
+            valid = user is not None and await run_hasher(password_hasher.verify, password, user["password"])
+        except PasswordHasherBusy:
+            return await render_template("login.html", error=BUSY_MESSAGE), 503
+
+        if valid:
+            await rehash_password(user, password)
+            # Signed-cookie session: starting from an empty one is the rotation
+            session.clear()
+            authz.login(user, session)
+            return redirect(url_for(login_landing(user)))
+        error = INVALID_LOGIN
+
+    return await render_template("login.html", error=error)
+
+
+@app.route("/logout")
+async def logout():
+    session.clear()
+    return redirect(url_for("login"))
+
+
+@app.route("/polls/<id>")
+async def polls(id):
+    cache_key = int(id) if id.isdigit() else None
+    results = results_cache.get(cache_key) if cache_key is not None else None
+    async with get_db() as (db, cursor):
+        if results is None:
+            await cursor.execute(POLL_SQL, (id,))
+            poll = await cursor.fetchone()
+            # Hot polls take their counts from the shared snapshot
+            options = None
+            counts = results_snapshot.get(poll["id"]) if poll else None
+            if counts is not None:
+                await cursor.execute(POLL_OPTIONS_SQL, (id,))
+                options = with_snapshot_counts(await cursor.fetchall(), counts)
+            if options is None:
+                await cursor.execute(OPTIONS_WITH_VOTES_SQL, (id,))
+                options = await cursor.fetchall()
+            await cursor.execute(*top_level_page_query(id, None))
+            results = poll_results(poll, options, await cursor.fetchall())
+            if poll and cache_key is not None:
+                results_cache.set(cache_key, results)
+
+        comments, comments_next = results["comments"], results["comments_next"]
+        comments_after = decode_page_token(request.args.get("comments_after"))
+        if results["poll"] and comments_after is not None:
+            await cursor.execute(*top_level_page_query(id, comments_after))
+            comments, comments_next = page_result(await cursor.fetchall(), COMMENTS_PAGE_SIZE)
+
+        has_voted = False
+        if results["poll"] and "user_id" in session:
+            has_voted = voted_cache.has_voted(results["poll"]["id"], session["user_id"])
+            if not has_voted:
+                await cursor.execute(USER_VOTE_SQL, (id, session["user_id"]))
+                has_voted = await cursor.fetchone() is not None
+                if has_voted:
+                    voted_cache.add(results["poll"]["id"], session["user_id"])
+
+    poll = results["poll"]
+    if not poll:
+        return POLL_NOT_FOUND, 404
+    options = with_snapshot_counts(results["options"], results_snapshot.get(poll["id"])) or results["options"]
+
+    return await render_template("show_poll.html", poll=poll, options=options, comments=comments,
+                                 comments_next=comments_next, has_voted=has_voted)
+
+
+# Live results over Server-Sent Events; each open stream is a suspended
+# coroutine, one upstream read per poll per window
+@app.route("/polls/<int:id>/stream")
+async def poll_stream(id):
+    try:
+        events = live_results.stream(id)
+    except TooManyClients as e:
+        logger.error(f"Rejecting live results stream: {e}")
+        return "Too many live result streams, please reload later.", 503
+    response = Response(events, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+
+@app.route("/vote/<id>/<option_id>")
+@login_required
+async def vote(id, option_id):
+    if not id.isdigit() or not option_id.isdigit():
+        return INVALID_OPTION, 400
+    poll_id, option_id, user_id = int(id), int(option_id), session["user_id"]
+    if voted_cache.has_voted(poll_id, user_id):
+        return ALREADY_VOTED
+
+    async with get_db() as (db, cursor):
+        guard, *rest = cast_vote_queries(poll_id, user_id, option_id)
+        # A deadlock or lock wait timeout is retried once
+        for attempt in range(VOTE_ATTEMPTS):
+            try:
+                recorded = await cursor.execute(*guard)
+                if recorded:
+                    for query in rest:
+                        await cursor.execute(*query)
+                break
+            except pymysql.err.IntegrityError:
+                await db.rollback()
+                voted_cache.add(poll_id, user_id)
+                return ALREADY_VOTED
+            except pymysql.err.OperationalError as e:
+                await db.rollback()
+                if not is_vote_retryable(e):
+                    raise
+                logger.warning(f"Vote on poll {poll_id} hit {e.args[0]}, attempt {attempt + 1}")
+        else:
+            return VOTE_BUSY, 503
+        if not recorded:
+            await db.rollback()
+            return INVALID_OPTION, 400
+        await db.commit()
+
+    voted_cache.add(poll_id, user_id)
+    results_cache.apply_vote(poll_id, option_id)
+    poll_versions.bump(poll_id)
+    return redirect(url_for("polls", id=id))
+
+
+@app.route("/polls", methods=["GET", "POST"])
+@login_required
+async def create_poll():
+    if request.method == "POST":
+        form = await request.form
+        try:
+            poll, options = validate_poll(form["poll"], form.getlist("options[]"))
+        except PollValidationError as e:
+            return await render_template("new_poll.html", error=str(e)), 400
+
+        async with get_db() as (db, cursor):
+            await cursor.execute(INSERT_POLL_SQL, (poll, session["user_id"]))
+            poll_id = cursor.lastrowid
+            await cursor.executemany(INSERT_OPTIONS_SQL, [(poll_id, option) for option in options])
+            await db.commit()
+        poll_versions.bump(POLL_LIST)
+
+        return redirect(url_for("index"))
+
+    return await render_template("new_poll.html")
+
+
+@app.route("/my_polls")
+@login_required
+async def my_polls():
+    async with get_db() as (db, cursor):
+        polls, polls_next = await fetch_page(cursor, "*", "polls", ["creator_id = %s"], [session["user_id"]],
+                                             "after", page_size(POLLS_PAGE_SIZE))
+
+    return await render_template("my_polls.html", polls=polls, polls_next=polls_next)
+
+
+@app.route("/add_comment/<int:poll_id>", methods=["POST"])
+@login_required
+async def add_comment(poll_id):
+    form = await request.form
+    async with get_db() as (db, cursor):
+        await cursor.execute(INSERT_COMMENT_SQL, (poll_id, session["user_id"], form["comment"]))
+        await db.commit()
+    results_cache.invalidate(poll_id)
+
+    return redirect(url_for("polls", id=poll_id))
+
+
+@app.route("/add_reply/<int:poll_id>/<int:parent_comment_id>", methods=["POST"])
+@login_required
+async def add_reply(poll_id, parent_comment_id):
+    form = await request.form
+    async with get_db() as (db, cursor):
+        if not await cursor.execute(COUNT_REPLY_SQL, (parent_comment_id, poll_id)):
+            await db.rollback()
+            return COMMENT_NOT_FOUND, 404
+        await cursor.execute(INSERT_REPLY_SQL, (poll_id, session["user_id"], form["reply"], parent_comment_id))
+        await db.commit()
+    results_cache.invalidate(poll_id)
+
+    return redirect(url_for("polls", id=poll_id))
+
+
+@app.route("/polls/<int:poll_id>/comments/<int:comment_id>/replies")
+async def comment_replies(poll_id, comment_id):
+    async with get_db() as (db, cursor):
+        await cursor.execute(*thread_replies_query(poll_id, comment_id))
+        rows = await cursor.fetchall()
+    return await render_template("comment_replies.html",
+                                 replies=build_comment_tree(rows[:MAX_THREAD_REPLIES], comment_id),
+                                 truncated=len(rows) > MAX_THREAD_REPLIES, limit=MAX_THREAD_REPLIES)
+
+
+@app.route("/admin")
+@admin_required
+async def admin_dashboard():
+    size = page_size(ADMIN_PAGE_SIZE)
+    async with get_db() as (db, cursor):
+        polls, polls_next = await fetch_page(cursor, *ADMIN_POLLS_PAGE, size)
+        users, users_next = await fetch_page(cursor, *ADMIN_USERS_PAGE, size)
+
+    return await render_template("admin_dashboard.html", polls=polls, users=users,
+                                 polls_next=polls_next, users_next=users_next)
+
+
+@app.route("/admin/delete_user/<int:user_id>", methods=["POST"])
+@admin_required
+async def admin_delete_user(user_id):
+    if user_id != session["user_id"]:
+        async with get_db() as (db, cursor):
+            await cursor.execute(DELETE_USER_SQL, (user_id,))
+            await db.commit()
+        authz.invalidate(user_id)
+
+    return redirect(url_for("admin_dashboard"))
+
+
+@app.route("/admin/set_admin/<int:user_id>", methods=["POST"])
+@admin_required
+async def admin_set_admin(user_id):
+    if user_id != session["user_id"]:
+        form = await request.form
+        async with get_db() as (db, cursor):
+            await cursor.execute(SET_ADMIN_SQL, (1 if form.get("is_admin") == "1" else 0, user_id))
+            await db.commit()
+        authz.invalidate(user_id)
+
+    return redirect(url_for("admin_dashboard"))
+
+
+@app.route("/admin/delete_poll/<int:poll_id>", methods=["POST"])
+@admin_required
+async def delete_poll(poll_id):
+    async with get_db() as (db, cursor):
+        for query in delete_poll_queries(poll_id):
+            await cursor.execute(*query)
+        await db.commit()
+    results_cache.invalidate(poll_id)
+    for key in deleted_poll_versions(poll_id):
+        poll_versions.bump(key)
+    return redirect(url_for("admin_dashboard"))
+
+
+def object_url(key):
+    return f"{s3_client.meta.endpoint_url}/{S3_BUCKET}/{key}"
+
+
+@app.route("/upload", methods=["GET", "POST"])
+@login_required
+async def upload_file():
+    if request.method == "POST":
+        file = (await request.files).get("file")
+        if file is None or file.filename == "":
+            return await render_template("upload.html", error="No file selected."), 400
+        try:
+            key, name, content_type = object_key(session["user_id"], file.filename)
+        except UploadError as e:
+            return await render_template("upload.html", error=str(e)), 400
+        await s3_client.upload_fileobj(file.stream, S3_BUCKET, key, Config=transfer_config,
+                                       ExtraArgs={"ACL": UPLOAD_ACL, "ContentType": content_type})
+        head = await s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+        async with get_db() as (db, cursor):
+            await cursor.execute(INSERT_COMPLETE_SQL, (session["user_id"], key, name, content_type,
+                                                       head["ContentLength"], head_etag(head)))
+            await db.commit()
+        return await render_template("upload.html", file_url=object_url(key))
+
+    return await render_template("upload.html", max_bytes=UPLOAD_MAX_BYTES)
+
+
+@app.route("/upload/presign", methods=["POST"])
+@api_login_required
+async def upload_presign():
+    data = await request.get_json(silent=True) or {}
+    size = data.get("size")
+    try:
+        key, name, content_type = object_key(session["user_id"], str(data.get("filename", "")))
+        check_size(size if isinstance(size, int) else None)
+    except UploadError as e:
+        return {"error": str(e)}, 400
+    post = await s3_client.generate_presigned_post(**presign_args(S3_BUCKET, key, content_type))
+    async with get_db() as (db, cursor):
+        await cursor.execute(INSERT_PENDING_SQL, (session["user_id"], key, name, content_type))
+        await db.commit()
+    return {"key": key, "url": post["url"], "fields": post["fields"]}, 200
+
+
+@app.route("/upload/complete", methods=["POST"])
+@api_login_required
+async def upload_complete():
+    data = await request.get_json(silent=True) or {}
+    key = str(data.get("key", ""))
+    async with get_db() as (db, cursor):
+        await cursor.execute(UPLOAD_BY_KEY_SQL, (key, session["user_id"]))
+        upload = await cursor.fetchone()
+    if upload is None:
+        return {"error": "Unknown upload."}, 400
+    try:
+        head = await s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+    except s3_client.exceptions.ClientError as e:
+        logger.error(f"Error checking uploaded object {key}: {e}")
+        return {"error": "The file has not been uploaded."}, 400
+    async with get_db() as (db, cursor):
+        if not head_matches(upload, head):
+            await s3_client.delete_object(Bucket=S3_BUCKET, Key=key)
+            await cursor.execute(REJECT_UPLOAD_SQL, (upload["id"],))
+            await db.commit()
+            return {"error": "The uploaded file does not match the upload request."}, 400
+        await cursor.execute(COMPLETE_UPLOAD_SQL, (head["ContentLength"], head_etag(head), upload["id"]))
+        await db.commit()
+    return {"key": key, "url": object_url(key)}, 200
+
+
+@app.route("/health")
+async def health():
+    return "OK", 200
+
+
+# aiomysql pool, live streams, hashing pool and vote cache for this worker
+@app.route("/health/asgi")
+async def asgi_health():
+    return {"db_pool": {"size": db_pool.size, "idle": db_pool.freesize, "max_size": db_pool.maxsize},
+            "live_results": live_results.stats(),
+            "password_hasher": password_hasher.stats(),
+            "voted_cache": voted_cache.stats(),
+            "pending_invokes": len(pending_invokes)}, 200
+
+
+@app.errorhandler(404)
+async def not_found_error(error):
+    return await render_template('404.html'), 404
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", debug=True)
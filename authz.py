@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from functools import wraps
+
+from flask import session, redirect, url_for
+
+# How long a worker trusts its copy of a user's role. This bounds how long
+# a demotion (or a deleted account) can keep admin access.
+AUTHZ_ROLE_TTL = float(os.environ.get("AUTHZ_ROLE_TTL", 30))
+
+ROLE_SQL = "SELECT is_admin, role_version FROM users WHERE id = %s"
+SET_ADMIN_SQL = "UPDATE users SET is_admin = %s, role_version = role_version + 1 WHERE id = %s"
+
+
+# Login and admin checks shared by the routes.
+#
+# Who is logged in comes from the session alone, so login_required costs no
+# queries. Admin checks need the current role: it is read from the users
+# table at most once per AUTHZ_ROLE_TTL per user per worker and kept in a
+# small in-process cache. Every role change bumps users.role_version; the
+# session carries the version it last saw, so when a change is noticed the
+# session's is_admin (used by the templates) is refreshed once.
+class Authz:
+    def __init__(self, get_db, ttl=AUTHZ_ROLE_TTL):
+        self.get_db = get_db
+        self.ttl = ttl
+        self._roles = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "role_changes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # Remember the user's identity and role on login
+    def login(self, user, session=session):
+        session["user_id"] = user["id"]
+        session["email"] = user["email"]
+        session["is_admin"] = user["is_admin"] == 1
+        session["role_version"] = user["role_version"]
+
+    # Current (is_admin, role_version) of a user, None if the user is gone
+    def role(self, user_id):
+        found, role = self.cached_role(user_id)
+        if found:
+            return role
+        cursor = self.get_db().cursor()
+        cursor.execute(ROLE_SQL, (user_id,))
+        return self.store_role(user_id, cursor.fetchone())
+
+    # (True, role) from this worker's cache, (False, None) on a miss. The
+    # async app (asgi_app.py) reads the row itself and calls store_role.
+    def cached_role(self, user_id):
+        with self._lock:
+            entry = self._roles.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._count("hits")
+            return True, entry[0]
+        self._count("misses")
+        return False, None
+
+    def store_role(self, user_id, row):
+        now = time.monotonic()
+        role = (row["is_admin"] == 1, row["role_version"]) if row else None
+        with self._lock:
+            # Drop expired entries now and then instead of running a sweeper
+            if len(self._roles) > 10000:
+                self._roles = {key: value for key, value in self._roles.items() if value[1] > now}
+            self._roles[user_id] = (role, now + self.ttl)
+        return role
+
+    # Forget this worker's copy after changing a role here; other workers
+    # pick the change up when their entry expires
+    def invalidate(self, user_id):
+        with self._lock:
+            self._roles.pop(user_id, None)
+
+    # Change a user's admin flag in the caller's transaction
+    def set_admin(self, cursor, user_id, is_admin):
+        cursor.execute(SET_ADMIN_SQL, (1 if is_admin else 0, user_id))
+        self.invalidate(user_id)
+
+    def login_required(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if "user_id" not in session:
+                return redirect(url_for("login"))
+            return f(*args, **kwargs)
+        return decorated_function
+
+    # For JSON endpoints: 401 instead of a redirect to the login page
+    def api_login_required(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if "user_id" not in session:
+                return {"error": "Login required."}, 401
+            return f(*args, **kwargs)
+        return decorated_function
+
+    def admin_required(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if "user_id" not in session:
+                return redirect(url_for("login"))
+            denied = self.check_admin(self.role(session["user_id"]))
+            if denied:
+                return redirect(url_for(denied))
+            return f(*args, **kwargs)
+        return decorated_function
+
+    # Apply a user's current role to the session. Returns the endpoint to
+    # redirect to when admin access is denied, None when it is granted.
+    def check_admin(self, role, session=session):
+        if role is None:
+            # The account was deleted
+            session.clear()
+            return "login"
+        is_admin, role_version = role
+        if session.get("role_version") != role_version:
+            self._count("role_changes")
+            session["is_admin"] = is_admin
+            session["role_version"] = role_version
+        if not is_admin:
+            return "index"  # Redirect if not admin
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._roles)
+        stats["ttl"] = self.ttl
+        return stats
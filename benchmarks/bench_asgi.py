@@ -0,0 +1,148 @@
+"""Requests/sec and tail latency of the sync app (gunicorn) vs asgi_app.py (hypercorn).
+
+Start both against the same database, with cookie sessions so one login
+works for both, then point the benchmark at them:
+
+    export SESSION_BACKEND=cookie
+    gunicorn --workers 3 --worker-class gevent --worker-connections 1000 --bind 127.0.0.1:8000 app:app &
+    hypercorn --workers 3 --bind 127.0.0.1:8001 asgi_app:app &
+    python benchmarks/bench_asgi.py --sync-url http://127.0.0.1:8000 --async-url http://127.0.0.1:8001 \\
+        --path /polls/1 --path / --concurrency 1000 --duration 30
+
+Every client holds one keep-alive connection and sends GETs back to back,
+cycling through the --path list. The account is registered and logged in
+first (an existing one is fine); its session cookie is sent with every
+request. Redirects count as successes, so check the paths do not simply
+bounce to /login.
+"""
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import http.client
+import urllib.parse
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000 if timings else 0.0
+
+
+# Register (ignoring "already exists") and log in; returns the Cookie header
+def login(url, email, password):
+    parts = urllib.parse.urlsplit(url)
+    body = urllib.parse.urlencode({"email": email, "password": password})
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    cookie = None
+    for path in ("/register", "/login"):
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        connection.request("POST", path, body, headers)
+        response = connection.getresponse()
+        response.read()
+        if path == "/login":
+            if response.status != 302:
+                raise SystemExit(f"{url}: login failed with status {response.status}")
+            cookie = response.getheader("Set-Cookie", "").split(";")[0]
+        connection.close()
+    return cookie
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers.get("connection", "").lower() != "close"
+
+
+# One client: a keep-alive connection sending requests until `deadline`,
+# reconnecting after errors. Latencies before `measure_from` are dropped.
+async def client(host, port, requests, measure_from, deadline, latencies, errors):
+    index = 0
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        request = requests[index % len(requests)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+            elif started >= measure_from:
+                latencies.append(time.perf_counter() - started)
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            name = type(e).__name__
+            errors[name] = errors.get(name, 0) + 1
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+async def run(url, paths, cookie, concurrency, duration, warmup):
+    parts = urllib.parse.urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    requests = [(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: keep-alive\r\n"
+                 + (f"Cookie: {cookie}\r\n" if cookie else "") + "\r\n").encode() for path in paths]
+    latencies, errors = [], {}
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    await asyncio.gather(*(client(host, port, requests, measure_from, deadline, latencies, errors)
+                           for _ in range(concurrency)))
+    return latencies, errors
+
+
+def report(label, duration, latencies, errors):
+    print(f"{label:>6}: {len(latencies) / duration:8.1f} req/s  p50 {percentile(latencies, 0.5):8.1f} ms  "
+          f"p99 {percentile(latencies, 0.99):8.1f} ms  errors {errors or 0}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sync-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--async-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--path", action="append", help="path to request (repeatable, default /polls/1)")
+    parser.add_argument("--email", default="bench-asgi@example.com")
+    parser.add_argument("--password", default="Benchmark1!")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per server")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before each run")
+    args = parser.parse_args()
+    paths = args.path or ["/polls/1"]
+
+    # One socket per client, plus headroom
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.concurrency + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.concurrency + 64), hard))
+
+    print(f"{args.concurrency} clients, {args.duration:g}s per server, paths {paths}")
+    for label, url in (("sync", args.sync_url), ("async", args.async_url)):
+        cookie = login(url, args.email, args.password)
+        latencies, errors = asyncio.run(run(url, paths, cookie, args.concurrency, args.duration, args.warmup))
+        report(label, args.duration, latencies, errors)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Poll creation cost: one INSERT per option vs the batched insert_polls().
+
+Runs against the MySQL database configured by DB_HOST/DB_USER/DB_PASSWORD/
+DB_NAME (schema from `flask db upgrade`). Created polls are rolled back.
+
+    python benchmarks/bench_create_poll.py --repeat 200
+"""
+import os
+import sys
+import time
+import argparse
+
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from poll_creation import insert_polls  # noqa: E402
+
+
+def connect():
+    return pymysql.connect(
+        host=os.environ.get('DB_HOST', '127.0.0.1'),
+        user=os.environ.get('DB_USER', 'root'),
+        password=os.environ.get('DB_PASSWORD', ''),
+        database=os.environ.get('DB_NAME', 'mydatabase'),
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+
+
+# The create_poll() loop this replaced
+def per_option_inserts(cursor, creator_id, polls):
+    for question, options in polls:
+        cursor.execute("INSERT INTO polls (poll, creator_id) VALUES (%s, %s)", (question, creator_id))
+        poll_id = cursor.lastrowid
+        for option in options:
+            cursor.execute("INSERT INTO options (poll_id, option_text) VALUES (%s, %s)", (poll_id, option))
+
+
+def bench(db, create, creator_id, n_options, repeat):
+    cursor = db.cursor()
+    poll = ("Benchmark poll", [f"Option {i}" for i in range(n_options)])
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        create(cursor, creator_id, [poll])
+        timings.append(time.perf_counter() - started)
+        db.rollback()
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--options", type=int, nargs="+", default=[2, 20, 200])
+    args = parser.parse_args()
+
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("INSERT IGNORE INTO users (email, password) VALUES ('bench-polls@example.com', 'x')")
+    cursor.execute("SELECT id FROM users WHERE email = 'bench-polls@example.com'")
+    creator_id = cursor.fetchone()["id"]
+    db.commit()
+
+    for n_options in args.options:
+        for name, create in (("per-option", per_option_inserts), ("batched", insert_polls)):
+            p50, p99 = bench(db, create, creator_id, n_options, args.repeat)
+            print(f"{n_options:>4} options {name:>11}: p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+
+    cursor.execute("DELETE FROM users WHERE email = 'bench-polls@example.com'")
+    db.commit()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
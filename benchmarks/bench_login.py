@@ -0,0 +1,141 @@
+"""Login throughput and tail latency under a login storm.
+
+Two modes:
+
+  * --url: POSTs /login against a running app from many threads while a
+    separate thread probes /health, e.g.
+
+        python benchmarks/bench_login.py --url http://127.0.0.1:8000 --concurrency 32
+
+    The account is registered first (an existing one is fine).
+
+  * local (default): the same storm against PasswordHasher directly,
+    compared with calling bcrypt inline on the request threads. No server
+    or database needed.
+
+        python benchmarks/bench_login.py --concurrency 16 --requests 64
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from password_hashing import PasswordHasher  # noqa: E402
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000 if timings else 0.0
+
+
+# Run `call` n times from `concurrency` threads while another thread times a
+# trivial probe every 50 ms. Returns (elapsed, latencies, probe latencies, errors).
+def storm(call, probe, n, concurrency):
+    latencies, probes, errors = [], [], {}
+    done = threading.Event()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            call()
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            name = type(e).__name__
+            errors[name] = errors.get(name, 0) + 1
+
+    def probing():
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                probe()
+                probes.append(time.perf_counter() - started)
+            except Exception:
+                probes.append(float("inf"))
+            time.sleep(0.05)
+
+    prober = threading.Thread(target=probing, daemon=True)
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(n)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+    return elapsed, latencies, probes, errors
+
+
+def report(label, elapsed, latencies, probes, errors):
+    print(f"{label:>18}: {len(latencies) / elapsed:7.1f} ok/s  p50 {percentile(latencies, 0.5):8.1f} ms  "
+          f"p99 {percentile(latencies, 0.99):8.1f} ms  probe p99 {percentile(probes, 0.99):8.1f} ms  "
+          f"errors {errors or 0}")
+
+
+def run_local(args):
+    hasher = PasswordHasher(rounds=args.rounds, workers=args.workers, queue_limit=args.queue_limit)
+    hashed = hasher.hash("Benchmark1!")
+    rounds = hasher.rounds
+    print(f"bcrypt cost {rounds}, {args.workers} hashing processes, queue limit {args.queue_limit}")
+
+    def inline():
+        bcrypt.checkpw(b"Benchmark1!", hashed.encode())
+
+    def pooled():
+        hasher.verify("Benchmark1!", hashed)
+
+    # Stands in for a cheap request such as /health
+    def probe():
+        sum(range(1000))
+
+    report("inline bcrypt", *storm(inline, probe, args.requests, args.concurrency))
+    report("process pool", *storm(pooled, probe, args.requests, args.concurrency))
+    print(f"hasher stats: {hasher.stats()}")
+
+
+def run_http(args):
+    credentials = urllib.parse.urlencode({"email": args.email, "password": args.password}).encode()
+    try:
+        urllib.request.urlopen(f"{args.url}/register", data=credentials, timeout=30).read()
+    except Exception as e:
+        print(f"registration: {e}")
+
+    def login():
+        with urllib.request.urlopen(f"{args.url}/login", data=credentials, timeout=30) as response:
+            response.read()
+            # A failed login renders the form again instead of redirecting
+            if "/login" in response.geturl():
+                raise ValueError("login did not redirect")
+
+    def probe():
+        urllib.request.urlopen(f"{args.url}/health", timeout=10).read()
+
+    report("login", *storm(login, probe, args.requests, args.concurrency))
+    print(urllib.request.urlopen(f"{args.url}/health/password_hasher", timeout=10).read().decode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running app; omit for the local comparison")
+    parser.add_argument("--email", default="bench-login@example.com")
+    parser.add_argument("--password", default="Benchmark1!")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost (default: calibrate)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queue-limit", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.url:
+        run_http(args)
+    else:
+        run_local(args)
+
+
+if __name__ == "__main__":
+    main()
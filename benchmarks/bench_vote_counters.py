@@ -0,0 +1,131 @@
+"""Single-row vs sharded vote counter throughput under concurrent writers.
+
+Runs against the MySQL database configured by DB_HOST/DB_USER/DB_PASSWORD/
+DB_NAME and uses its own scratch tables, so it is safe to point at a dev
+database:
+
+    python benchmarks/bench_vote_counters.py --writers 32 --votes 200 --shards 16
+"""
+import os
+import time
+import random
+import argparse
+import threading
+
+import pymysql
+
+
+def connect():
+    return pymysql.connect(
+        host=os.environ.get('DB_HOST', '127.0.0.1'),
+        user=os.environ.get('DB_USER', 'root'),
+        password=os.environ.get('DB_PASSWORD', ''),
+        database=os.environ.get('DB_NAME', 'mydatabase'),
+        autocommit=False,
+    )
+
+
+def setup():
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("DROP TABLE IF EXISTS bench_options")
+    cursor.execute("DROP TABLE IF EXISTS bench_option_vote_shards")
+    cursor.execute("CREATE TABLE bench_options (id INT PRIMARY KEY, votes INT NOT NULL DEFAULT 0)")
+    cursor.execute('''CREATE TABLE bench_option_vote_shards (
+                        option_id INT NOT NULL,
+                        shard SMALLINT NOT NULL,
+                        votes INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (option_id, shard))''')
+    cursor.execute("INSERT INTO bench_options (id) VALUES (1)")
+    db.commit()
+    db.close()
+
+
+def teardown():
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("DROP TABLE IF EXISTS bench_options")
+    cursor.execute("DROP TABLE IF EXISTS bench_option_vote_shards")
+    db.commit()
+    db.close()
+
+
+def single_row(cursor, shards):
+    cursor.execute("UPDATE bench_options SET votes = votes + 1 WHERE id = 1")
+
+
+def sharded(cursor, shards):
+    cursor.execute(
+        """INSERT INTO bench_option_vote_shards (option_id, shard, votes) VALUES (1, %s, 1)
+           ON DUPLICATE KEY UPDATE votes = votes + 1""",
+        (random.randrange(shards),))
+
+
+def total_votes():
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("""SELECT (SELECT votes FROM bench_options WHERE id = 1)
+                           + COALESCE((SELECT SUM(votes) FROM bench_option_vote_shards WHERE option_id = 1), 0)""")
+    total = cursor.fetchone()[0]
+    db.close()
+    return total
+
+
+def run(increment, writers, votes, shards):
+    setup()
+    latencies = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(writers + 1)
+
+    def writer():
+        db = connect()
+        cursor = db.cursor()
+        local = []
+        start_barrier.wait()
+        for _ in range(votes):
+            started = time.perf_counter()
+            # Mirror vote(): the counter update commits with the vote
+            increment(cursor, shards)
+            db.commit()
+            local.append(time.perf_counter() - started)
+        db.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    counted = total_votes()
+    teardown()
+    latencies.sort()
+    return {
+        "votes_per_sec": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "counted": counted,
+        "expected": writers * votes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--votes", type=int, default=200, help="votes per writer")
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    for name, increment in (("single-row", single_row), (f"sharded x{args.shards}", sharded)):
+        result = run(increment, args.writers, args.votes, args.shards)
+        print(f"{name:>14}: {result['votes_per_sec']:8.0f} votes/s  "
+              f"p50 {result['p50_ms']:6.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+              f"counted {result['counted']}/{result['expected']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Welcome email Lambda: cold start, per-invocation client vs warm batches.
+
+Runs locally against a stubbed SES client (botocore's Stubber), so nothing
+is sent and no AWS credentials are needed. Measures:
+
+  * cold start: a fresh interpreter importing terraform/lambda_function.py
+    (boto3 import plus the module-scope SES client)
+  * the old handler: a new SES client and one email per invocation
+  * the legacy event shape against the warm module-scope client
+  * one batch invocation, with send_email per recipient and with
+    SendBulkTemplatedEmail
+
+    python benchmarks/bench_welcome_email.py --recipients 500
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import boto3
+from botocore.stub import Stubber
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "terraform")
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+import lambda_function  # noqa: E402
+
+
+def cold_start(runs):
+    code = ("import time; started = time.perf_counter(); import lambda_function; "
+            "print(time.perf_counter() - started)")
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=LAMBDA_DIR, env=os.environ,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output))
+    return sorted(timings)[len(timings) // 2]
+
+
+# The handler this replaced: client construction on every invocation
+def old_handler(event):
+    client = boto3.client("ses", region_name="eu-central-1")
+    with Stubber(client) as stubber:
+        stubber.add_response("send_email", {"MessageId": "stub"})
+        client.send_email(Source=lambda_function.SENDER_EMAIL,
+                          Destination={"ToAddresses": [event["recipient_email"]]},
+                          Message={"Subject": {"Data": lambda_function.SUBJECT, "Charset": "UTF-8"},
+                                   "Body": {"Text": {"Data": lambda_function.BODY_TEXT, "Charset": "UTF-8"}}})
+
+
+def timed(label, recipients, run):
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    print(f"{label:>34}: {elapsed * 1000:9.2f} ms total  {elapsed / recipients * 1e6:9.1f} us/recipient")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--fail-every", type=int, default=0,
+                        help="make every Nth recipient fail, to exercise partial failure reporting")
+    args = parser.parse_args()
+
+    emails = [f"user{i}@example.com" for i in range(args.recipients)]
+    failing = {i for i in range(args.recipients) if args.fail_every and i % args.fail_every == 0}
+    lambda_function.print = lambda *a, **k: None  # keep the per-recipient log lines out of the timings
+
+    print(f"{'cold start (import + client)':>34}: {cold_start(args.cold_runs) * 1000:9.2f} ms (median)")
+
+    timed("old handler, client per call", args.recipients,
+          lambda: [old_handler({"recipient_email": email}) for email in emails])
+
+    stubber = Stubber(lambda_function.ses_client)
+    stubber.activate()
+
+    def legacy():
+        for email in emails:
+            stubber.add_response("send_email", {"MessageId": "stub"})
+            lambda_function.lambda_handler({"recipient_email": email}, None)
+    lambda_function.SES_TEMPLATE_NAME = None
+    timed("warm client, legacy event", args.recipients, legacy)
+
+    def batch_each():
+        for i in range(args.recipients):
+            if i in failing:
+                stubber.add_client_error("send_email", "MessageRejected", "Email address is not verified.")
+            else:
+                stubber.add_response("send_email", {"MessageId": "stub"})
+        return lambda_function.lambda_handler({"recipients": emails}, None)
+    timed("one batch, send_email each", args.recipients, batch_each)
+
+    results = {}
+
+    def batch_bulk():
+        for start in range(0, args.recipients, lambda_function.SES_BULK_LIMIT):
+            chunk = range(start, min(start + lambda_function.SES_BULK_LIMIT, args.recipients))
+            stubber.add_response("send_bulk_templated_email", {"Status": [
+                {"Status": "MessageRejected", "Error": "stubbed failure"} if i in failing
+                else {"Status": "Success", "MessageId": "stub"} for i in chunk]})
+        results["bulk"] = lambda_function.lambda_handler({"recipients": emails}, None)
+    lambda_function.SES_TEMPLATE_NAME = "welcome_email"
+    timed("one batch, bulk templated", args.recipients, batch_bulk)
+
+    stubber.assert_no_pending_responses()
+    print(f"bulk response: {results['bulk']['body'][:200]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+"""Load tests for the poll app's hot routes, with JSON baselines.
+
+Runs app.py under gunicorn (the production command line) against a local
+MySQL, with benchmarks/stub_lambda.py standing in for Lambda and S3. Uses
+the DB_HOST/DB_USER/DB_PASSWORD/DB_NAME variables like the app.
+
+    # MySQL 8 in a container, if there is no local server
+    python benchmarks/loadtest.py mysql
+    export DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD=loadtest DB_NAME=loadtest
+
+    # Schema plus 100k users, 10k polls and skewed votes (once per database)
+    python benchmarks/loadtest.py seed
+
+    # Start the app and run every scenario; save the results as a baseline
+    python benchmarks/loadtest.py run --start --save benchmarks/baselines/main.json
+
+    # Same again on a branch, failing if anything regressed by more than 10%
+    python benchmarks/loadtest.py run --start --compare benchmarks/baselines/main.json
+    python benchmarks/loadtest.py compare benchmarks/baselines/main.json benchmarks/baselines/branch.json
+
+    # Part of every baseline run: parallel clicks must still count each
+    # voter exactly once (non-zero exit on a double count or a 5xx)
+    python benchmarks/vote_race.py --start --voters 500 --clicks 8
+
+Scenarios: vote_storm (every seeded session votes once on a fresh poll),
+browse_index, read_poll (poll ids drawn with the same skew as the votes),
+login_burst and comment_threads (comments and replies on the hottest poll,
+mixed with reads of the poll page and of expanded threads). Logged-in clients use server-side
+sessions written by `seed`, so only login_burst pays for bcrypt. Workers
+remember who voted, so restart an app started without --start before
+running vote_storm against it again.
+
+DB statements per request come from MySQL's global Questions counter, so
+they include background work in the app (snapshot updater, sweepers) and
+are only meaningful on a database nobody else is using.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import itertools
+import argparse
+import resource
+import subprocess
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+import bcrypt
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_asgi import percentile, read_response  # noqa: E402
+from comment_threads import RECOUNT_REPLIES_SQL  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from session_store import serializer  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL_DOMAIN = "loadtest.example"
+PASSWORD = "Loadtest1!"
+POLL_PREFIX = "Load test poll"
+STORM_POLL = "Load test vote storm"
+RUN_COMMENT = "Load test run comment"
+SESSION_PREFIX = "loadtest-"
+SCENARIOS = ["vote_storm", "browse_index", "read_poll", "login_burst", "comment_threads"]
+
+# Regression thresholds for compare, in percent
+COMPARE_FIELDS = {"rps": -1, "p95_ms": 1, "p99_ms": 1, "db_queries_per_request": 1}
+
+
+def connect():
+    return pymysql.connect(
+        host=os.environ.get('DB_HOST', '127.0.0.1'),
+        user=os.environ.get('DB_USER', 'root'),
+        password=os.environ.get('DB_PASSWORD', ''),
+        database=os.environ.get('DB_NAME', 'loadtest'),
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+
+
+def zipf_weights(n, skew):
+    return [1 / (rank + 1) ** skew for rank in range(n)]
+
+
+def insert_chunks(cursor, sql, rows, chunk=10000):
+    for start in range(0, len(rows), chunk):
+        cursor.executemany(sql, rows[start:start + chunk])
+
+
+# Start MySQL 8 in a throwaway container and wait until it accepts logins
+def start_mysql(args):
+    subprocess.run(["docker", "run", "-d", "--rm", "--name", args.name, "-p", f"{args.port}:3306",
+                    "-e", f"MYSQL_ROOT_PASSWORD={args.password}", "-e", f"MYSQL_DATABASE={args.database}",
+                    "mysql:8.0", "--innodb-buffer-pool-size=1G"], check=True)
+    deadline = time.monotonic() + 120
+    while True:
+        try:
+            pymysql.connect(host="127.0.0.1", port=args.port, user="root", password=args.password,
+                            database=args.database).close()
+            break
+        except pymysql.err.OperationalError:
+            if time.monotonic() > deadline:
+                raise SystemExit("MySQL did not come up within 120s")
+            time.sleep(2)
+    print(f"export DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD={args.password} DB_NAME={args.database}")
+    print(f"(stop it with: docker stop {args.name})")
+
+
+def seed(args):
+    rng = random.Random(args.random_seed)
+    db = connect()
+    upgrade(db)
+    cursor = db.cursor()
+    cursor.execute("SELECT COUNT(*) AS n FROM users WHERE email LIKE %s", (f"%@{EMAIL_DOMAIN}",))
+    if cursor.fetchone()["n"]:
+        raise SystemExit("This database is already seeded; drop and recreate it to seed again.")
+    started = time.perf_counter()
+
+    # All users share one password hash, at the cost the app is started with
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(args.bcrypt_rounds)).decode()
+    insert_chunks(cursor, "INSERT INTO users (email, password) VALUES (%s, %s)",
+                  [(f"user{n}@{EMAIL_DOMAIN}", hashed) for n in range(args.users)])
+    db.commit()
+    cursor.execute("SELECT id FROM users WHERE email LIKE %s ORDER BY id", (f"%@{EMAIL_DOMAIN}",))
+    user_ids = [row["id"] for row in cursor.fetchall()]
+    print(f"{len(user_ids)} users")
+
+    # Polls by popularity rank: rank 0 is the hottest. The storm poll starts
+    # without votes and is reset before every vote_storm run.
+    insert_chunks(cursor, "INSERT INTO polls (poll, creator_id) VALUES (%s, %s)",
+                  [(f"{POLL_PREFIX} {rank}", rng.choice(user_ids)) for rank in range(args.polls)]
+                  + [(STORM_POLL, user_ids[0])])
+    db.commit()
+    poll_ids, storm_poll_id = poll_ranks(cursor)
+    option_rows = [(poll_id, f"Option {n}") for poll_id in poll_ids + [storm_poll_id]
+                   for n in range(rng.randint(2, 6))]
+    insert_chunks(cursor, "INSERT INTO options (poll_id, option_text) VALUES (%s, %s)", option_rows)
+    db.commit()
+    cursor.execute("SELECT id, poll_id FROM options ORDER BY id")
+    options = {}
+    for row in cursor.fetchall():
+        options.setdefault(row["poll_id"], []).append(row["id"])
+    print(f"{len(poll_ids)} polls, {len(option_rows)} options")
+
+    # Votes: poll popularity follows a Zipf distribution, and within a poll
+    # earlier options are more popular than later ones
+    weights = zipf_weights(len(poll_ids), args.skew)
+    total_weight = sum(weights)
+    votes = []
+    for poll_id, weight in zip(poll_ids, weights):
+        count = min(len(user_ids), round(args.votes * weight / total_weight))
+        poll_options = options[poll_id]
+        option_weights = zipf_weights(len(poll_options), 1.0)
+        for user_id in rng.sample(user_ids, count):
+            votes.append((poll_id, user_id, rng.choices(poll_options, option_weights)[0]))
+    insert_chunks(cursor, "INSERT INTO votes (poll_id, user_id, option_id) VALUES (%s, %s, %s)", votes)
+    cursor.execute("""UPDATE options
+                      JOIN (SELECT option_id, COUNT(*) AS votes FROM votes GROUP BY option_id) AS counted
+                        ON counted.option_id = options.id
+                      SET options.votes = counted.votes""")
+    db.commit()
+    print(f"{len(votes)} votes")
+
+    # Comment threads, skewed the same way; a share of them are replies
+    comment_polls = rng.choices(poll_ids, weights, k=args.comments)
+    top_level = comment_polls[:int(len(comment_polls) * (1 - args.reply_share))]
+    insert_chunks(cursor, "INSERT INTO comments (poll_id, user_id, comment) VALUES (%s, %s, %s)",
+                  [(poll_id, rng.choice(user_ids), f"Seeded comment {n}") for n, poll_id in enumerate(top_level)])
+    db.commit()
+    cursor.execute("SELECT id, poll_id FROM comments WHERE parent_comment_id IS NULL")
+    parents = {}
+    for row in cursor.fetchall():
+        parents.setdefault(row["poll_id"], []).append(row["id"])
+    replies = [(poll_id, rng.choice(user_ids), f"Seeded reply {n}", rng.choice(parents[poll_id]))
+               for n, poll_id in enumerate(comment_polls[len(top_level):]) if poll_id in parents]
+    insert_chunks(cursor, """INSERT INTO comments (poll_id, user_id, comment, parent_comment_id)
+                             VALUES (%s, %s, %s, %s)""", replies)
+    for poll_id in {reply[0] for reply in replies}:
+        cursor.execute(RECOUNT_REPLIES_SQL, (poll_id, poll_id))
+    db.commit()
+    print(f"{len(top_level) + len(replies)} comments")
+
+    # Server-side sessions (SESSION_BACKEND=mysql) for the logged-in scenarios
+    expires_at = datetime.utcnow() + timedelta(days=30)
+    insert_chunks(cursor, "INSERT INTO sessions (id, data, expires_at) VALUES (%s, %s, %s)",
+                  [(f"{SESSION_PREFIX}{user_id}",
+                    serializer.dumps({"user_id": user_id, "email": f"user{n}@{EMAIL_DOMAIN}", "is_admin": False,
+                                      "role_version": 0}),
+                    expires_at) for n, user_id in enumerate(user_ids[:args.sessions])])
+    db.commit()
+    print(f"{min(args.sessions, len(user_ids))} sessions; seeded in {time.perf_counter() - started:.0f}s")
+
+
+# Seeded poll ids in popularity order, and the storm poll's id
+def poll_ranks(cursor):
+    cursor.execute("SELECT id, poll FROM polls WHERE poll LIKE %s OR poll = %s",
+                   (f"{POLL_PREFIX} %", STORM_POLL))
+    ranked, storm_poll_id = {}, None
+    for row in cursor.fetchall():
+        if row["poll"] == STORM_POLL:
+            storm_poll_id = row["id"]
+        else:
+            ranked[int(row["poll"].rsplit(" ", 1)[1])] = row["id"]
+    return [ranked[rank] for rank in sorted(ranked)], storm_poll_id
+
+
+# Everything the scenarios need to know about the seeded data
+def load_context(db, args):
+    cursor = db.cursor()
+    poll_ids, storm_poll_id = poll_ranks(cursor)
+    if not poll_ids or storm_poll_id is None:
+        raise SystemExit("No seeded data found; run `loadtest.py seed` first.")
+    cursor.execute("SELECT id FROM sessions WHERE id LIKE %s AND expires_at > UTC_TIMESTAMP()",
+                   (f"{SESSION_PREFIX}%",))
+    sessions = [row["id"] for row in cursor.fetchall()]
+    cursor.execute("SELECT COUNT(*) AS n FROM users WHERE email LIKE %s", (f"%@{EMAIL_DOMAIN}",))
+    users = cursor.fetchone()["n"]
+    cursor.execute("SELECT id FROM options WHERE poll_id = %s", (storm_poll_id,))
+    storm_options = [row["id"] for row in cursor.fetchall()]
+    cursor.execute("SELECT id FROM comments WHERE poll_id = %s AND parent_comment_id IS NULL", (poll_ids[0],))
+    comments = [row["id"] for row in cursor.fetchall()]
+    db.rollback()
+    weights = zipf_weights(len(poll_ids), args.skew)
+    return {"poll_ids": poll_ids, "cum_weights": list(itertools.accumulate(weights)),
+            "storm_poll_id": storm_poll_id, "storm_options": storm_options, "sessions": sessions,
+            "users": users, "comments": comments}
+
+
+# Put the data a scenario writes back to its seeded state
+def reset_scenario(db, name, context):
+    cursor = db.cursor()
+    if name == "vote_storm":
+        storm_poll_id = context["storm_poll_id"]
+        cursor.execute("DELETE FROM votes WHERE poll_id = %s", (storm_poll_id,))
+        cursor.execute("""DELETE option_vote_shards FROM option_vote_shards
+                          JOIN options ON options.id = option_vote_shards.option_id
+                          WHERE options.poll_id = %s""", (storm_poll_id,))
+        cursor.execute("UPDATE options SET votes = 0 WHERE poll_id = %s", (storm_poll_id,))
+    elif name == "comment_threads":
+        cursor.execute("DELETE FROM comments WHERE comment = %s AND parent_comment_id IS NOT NULL", (RUN_COMMENT,))
+        cursor.execute("DELETE FROM comments WHERE comment = %s", (RUN_COMMENT,))
+        cursor.execute(RECOUNT_REPLIES_SQL, (context["poll_ids"][0], context["poll_ids"][0]))
+    db.commit()
+
+
+def http_request(netloc, method, path, session_id=None, form=None):
+    body = urllib.parse.urlencode(form).encode() if form is not None else b""
+    head = f"{method} {path} HTTP/1.1\r\nHost: {netloc}\r\nConnection: keep-alive\r\n"
+    if session_id:
+        head += f"Cookie: session={session_id}\r\n"
+    if form is not None:
+        head += "Content-Type: application/x-www-form-urlencoded\r\n"
+    return (head + f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+# A scenario is a function returning the next request to send (bytes), or
+# None once it has nothing left to send
+def scenario_requests(name, netloc, context, rng):
+    sessions = context["sessions"]
+    if name == "vote_storm":
+        voters = list(sessions)
+        rng.shuffle(voters)
+
+        def next_request():
+            if not voters:
+                return None
+            return http_request(netloc, "GET", f"/vote/{context['storm_poll_id']}/"
+                                f"{rng.choice(context['storm_options'])}", voters.pop())
+        return next_request
+    if name == "browse_index":
+        return lambda: http_request(netloc, "GET", "/", rng.choice(sessions))
+    if name == "read_poll":
+        def next_request():
+            poll_id = rng.choices(context["poll_ids"], cum_weights=context["cum_weights"])[0]
+            return http_request(netloc, "GET", f"/polls/{poll_id}", rng.choice(sessions))
+        return next_request
+    if name == "login_burst":
+        return lambda: http_request(netloc, "POST", "/login", form={
+            "email": f"user{rng.randrange(context['users'])}@{EMAIL_DOMAIN}", "password": PASSWORD})
+    if name == "comment_threads":
+        poll_id = context["poll_ids"][0]
+
+        def next_request():
+            roll = rng.random()
+            if roll < 0.35 or (roll < 0.5 and not context["comments"]):
+                return http_request(netloc, "GET", f"/polls/{poll_id}", rng.choice(sessions))
+            if roll < 0.5:
+                return http_request(netloc, "GET", f"/polls/{poll_id}/comments/{rng.choice(context['comments'])}"
+                                    "/replies", rng.choice(sessions))
+            if roll < 0.75 or not context["comments"]:
+                return http_request(netloc, "POST", f"/add_comment/{poll_id}", rng.choice(sessions),
+                                    {"comment": RUN_COMMENT})
+            return http_request(netloc, "POST", f"/add_reply/{poll_id}/{rng.choice(context['comments'])}",
+                                rng.choice(sessions), {"reply": RUN_COMMENT})
+        return next_request
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+async def client(host, port, next_request, measure_from, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        request = next_request()
+        if request is None:
+            break
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+            if status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+            elif started >= measure_from:
+                latencies.append(time.perf_counter() - started)
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+async def drive(url, next_request, concurrency, duration, warmup):
+    parts = urllib.parse.urlsplit(url)
+    latencies, errors = [], {}
+    started = time.perf_counter()
+    measure_from = started + warmup
+    await asyncio.gather(*(client(parts.hostname, parts.port or 80, next_request, measure_from,
+                                  measure_from + duration, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - max(measure_from, started)
+
+
+def questions(db):
+    cursor = db.cursor()
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    return int(cursor.fetchone()["Value"])
+
+
+def run_scenario(db, name, args, context):
+    reset_scenario(db, name, context)
+    concurrency = args.concurrency or {"login_burst": 32, "vote_storm": 200}.get(name, 100)
+    # The storm is over once every session has voted, so it is measured in full
+    warmup = 0 if name == "vote_storm" else args.warmup
+    next_request = scenario_requests(name, urllib.parse.urlsplit(args.url).netloc, context,
+                                     random.Random(args.random_seed))
+    before = questions(db)
+    latencies, errors, elapsed = asyncio.run(drive(args.url, next_request, concurrency, args.duration, warmup))
+    # Requests in the warmup also ran queries; scale by the share measured
+    total_time = elapsed + warmup
+    queries = (questions(db) - before - 1) * (elapsed / total_time if total_time else 1)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "errors": errors,
+        "db_queries_per_request": round(queries / len(latencies), 2) if latencies else None,
+    }
+
+
+# gunicorn with the deployed command line, plus the Lambda/S3 stub
+def start_app(args):
+    env = dict(os.environ, SESSION_BACKEND="mysql", PASSWORD_HASH_ROUNDS=str(args.bcrypt_rounds),
+               LAMBDA_ENDPOINT_URL=f"http://127.0.0.1:{args.stub_port}",
+               S3_ENDPOINT_URL=f"http://127.0.0.1:{args.stub_port}", S3_BUCKET="loadtest")
+    env.setdefault("AWS_ACCESS_KEY_ID", "loadtest")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "loadtest")
+    env.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    port = urllib.parse.urlsplit(args.url).port
+    processes = [
+        subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "stub_lambda.py"),
+                          "--port", str(args.stub_port)], cwd=ROOT, env=env, stdout=subprocess.DEVNULL),
+        subprocess.Popen(["gunicorn", "--workers", str(args.workers), "--worker-class", "gevent",
+                          "--worker-connections", "1000", "--bind", f"127.0.0.1:{port}", "--log-level", "warning",
+                          "app:app"], cwd=ROOT, env=env),
+    ]
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            urllib.request.urlopen(f"{args.url}/health", timeout=2).read()
+            return processes
+        except OSError:
+            if time.monotonic() > deadline:
+                stop_app(processes)
+                raise SystemExit("The app did not answer /health within 60s")
+            time.sleep(0.5)
+
+
+def stop_app(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, 4096)), hard))
+    db = connect()
+    db.autocommit(True)
+    context = load_context(db, args)
+    processes = start_app(args) if args.start else []
+    results = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            results[name] = run_scenario(db, name, args, context)
+            report(name, results[name])
+    finally:
+        stop_app(processes)
+
+    baseline = {"commit": git_commit(), "date": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "settings": {"duration": args.duration, "warmup": args.warmup, "workers": args.workers,
+                             "bcrypt_rounds": args.bcrypt_rounds},
+                "scenarios": results}
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            return compare_results(json.load(f), baseline, args.threshold)
+    return 0
+
+
+def report(name, result):
+    print(f"{name:>16}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+          f"p99 {result['p99_ms']:7.1f} ms  db/req {result['db_queries_per_request']}  "
+          f"errors {result['errors'] or 0}")
+    sys.stdout.flush()
+
+
+# Print the change of every metric and return 1 if any got worse by more
+# than `threshold` percent (throughput down, latency or queries up)
+def compare_results(baseline, current, threshold):
+    print(f"baseline {baseline.get('commit')} ({baseline.get('date')}) -> "
+          f"current {current.get('commit')} ({current.get('date')})")
+    regressed = []
+    for name, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name:>16}: no baseline")
+            continue
+        changes = []
+        for field, direction in COMPARE_FIELDS.items():
+            old, new = before.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            flag = ""
+            if change * direction > threshold:
+                flag = " REGRESSION"
+                regressed.append(f"{name}.{field}")
+            changes.append(f"{field} {old:g} -> {new:g} ({change:+.1f}%){flag}")
+        print(f"{name:>16}: " + ", ".join(changes))
+    if regressed:
+        print(f"regressions beyond {threshold:g}%: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return compare_results(baseline, current, args.threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    mysql = commands.add_parser("mysql", help="start MySQL 8 in a docker container")
+    mysql.add_argument("--name", default="polls-loadtest-mysql")
+    mysql.add_argument("--port", type=int, default=3306)
+    mysql.add_argument("--password", default="loadtest")
+    mysql.add_argument("--database", default="loadtest")
+
+    seeding = commands.add_parser("seed", help="apply migrations and seed the database")
+    seeding.add_argument("--users", type=int, default=100000)
+    seeding.add_argument("--polls", type=int, default=10000)
+    seeding.add_argument("--votes", type=int, default=1000000, help="total votes across polls (approximate)")
+    seeding.add_argument("--comments", type=int, default=50000)
+    seeding.add_argument("--reply-share", type=float, default=0.4)
+    seeding.add_argument("--sessions", type=int, default=5000, help="users given a ready-made login session")
+
+    running = commands.add_parser("run", help="run the scenarios against the app")
+    running.add_argument("--url", default="http://127.0.0.1:8000")
+    running.add_argument("--start", action="store_true", help="start gunicorn and the stubs for the run")
+    running.add_argument("--workers", type=int, default=3, help="gunicorn workers with --start")
+    running.add_argument("--stub-port", type=int, default=9001)
+    running.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable; default all")
+    running.add_argument("--concurrency", type=int, help="clients per scenario (default depends on scenario)")
+    running.add_argument("--duration", type=float, default=20, help="measured seconds per scenario")
+    running.add_argument("--warmup", type=float, default=3)
+    running.add_argument("--save", help="write the results to this JSON file")
+    running.add_argument("--compare", help="baseline JSON to compare against; exit 1 on regression")
+    running.add_argument("--threshold", type=float, default=10, help="allowed regression in percent")
+
+    for command in (seeding, running):
+        command.add_argument("--bcrypt-rounds", type=int, default=12)
+        command.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of poll popularity")
+        command.add_argument("--random-seed", type=int, default=1)
+
+    comparing = commands.add_parser("compare", help="compare two saved result files")
+    comparing.add_argument("baseline")
+    comparing.add_argument("current")
+    comparing.add_argument("--threshold", type=float, default=10)
+
+    args = parser.parse_args()
+    if args.command == "mysql":
+        start_mysql(args)
+    elif args.command == "seed":
+        seed(args)
+    elif args.command == "run":
+        sys.exit(run(args))
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Local stand-in for the Lambda Invoke API.
+
+Accepts POST /2015-03-31/functions/<name>/invocations, records the payload
+and answers like Lambda does for InvocationType=Event. Point the app at it
+with LAMBDA_ENDPOINT_URL=http://127.0.0.1:9001 (any AWS credentials work).
+
+    python benchmarks/stub_lambda.py --port 9001 --fail-rate 0.1 --latency-ms 50
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INVOKE_PATH = re.compile(r"^/2015-03-31/functions/([^/]+)/invocations")
+
+
+class StubLambdaHandler(BaseHTTPRequestHandler):
+    invocations = Counter()
+    lock = threading.Lock()
+    fail_rate = 0.0
+    latency = 0.0
+
+    def do_POST(self):
+        match = INVOKE_PATH.match(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not match:
+            self._reply(404, {"Type": "User", "message": "Unknown path"}, "ResourceNotFoundException")
+            return
+        time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self._reply(429, {"Type": "User", "message": "Rate exceeded"}, "TooManyRequestsException")
+            return
+        with self.lock:
+            self.invocations[match.group(1)] += 1
+        if self.headers.get("X-Amz-Invocation-Type") == "Event":
+            self._reply(202, None)
+        else:
+            self._reply(200, {"statusCode": 200, "echo": json.loads(body or b"null")})
+
+    # Invocation counts per function, handy when checking delivery
+    def do_GET(self):
+        with self.lock:
+            self._reply(200, dict(self.invocations))
+
+    def _reply(self, status, payload, error_type=None):
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if error_type:
+            self.send_header("X-Amzn-ErrorType", error_type)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=9001, fail_rate=0.0, latency_ms=0.0):
+    StubLambdaHandler.fail_rate = fail_rate
+    StubLambdaHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubLambdaHandler)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.fail_rate, args.latency_ms)
+    print(f"Stub Lambda listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Concurrency check for voting: parallel clicks must never double count.
+
+Uses the database and login sessions seeded by loadtest.py (same DB_*
+variables), against a running app or one started with --start:
+
+    python benchmarks/loadtest.py seed
+    python benchmarks/vote_race.py --start --voters 500 --clicks 8
+
+Creates a fresh poll, opens --clicks connections per voter, then releases
+every click at once, each on a random option of the poll. Passes (exit 0)
+only if every voter got exactly one accepted vote (a redirect) and the rest
+"already voted", the poll has exactly one votes row per voter, and every
+option's counter (options.votes plus unrolled shards) matches its votes
+rows. With VOTE_INGEST_MODE=buffered the check waits up to --settle
+seconds for the buffer to flush. The poll is deleted afterwards.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import resource
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_asgi import read_response  # noqa: E402
+from loadtest import SESSION_PREFIX, connect, http_request, questions, start_app, stop_app  # noqa: E402
+from vote_counters import OPTIONS_WITH_VOTES_SQL  # noqa: E402
+
+POLL_NAME = "Vote race"
+
+
+def create_poll(db, creator_id, options):
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO polls (poll, creator_id) VALUES (%s, %s)",
+                   (f"{POLL_NAME} {time.time():.0f}", creator_id))
+    poll_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO options (poll_id, option_text) VALUES (%s, %s)",
+                       [(poll_id, f"Option {n}") for n in range(options)])
+    db.commit()
+    cursor.execute("SELECT id FROM options WHERE poll_id = %s ORDER BY id", (poll_id,))
+    return poll_id, [row["id"] for row in cursor.fetchall()]
+
+
+def delete_poll(db, poll_id):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM votes WHERE poll_id = %s", (poll_id,))
+    cursor.execute("""DELETE option_vote_shards FROM option_vote_shards
+                      JOIN options ON options.id = option_vote_shards.option_id
+                      WHERE options.poll_id = %s""", (poll_id,))
+    cursor.execute("DELETE FROM options WHERE poll_id = %s", (poll_id,))
+    cursor.execute("DELETE FROM polls WHERE id = %s", (poll_id,))
+    db.commit()
+
+
+# One click on its own connection; waits for `go` once connected
+async def click(host, port, request, ready, go, results):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as e:
+        ready()
+        results.append(type(e).__name__)
+        return
+    ready()
+    try:
+        await go.wait()
+        writer.write(request)
+        status, _ = await read_response(reader)
+        results.append(status)
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+        results.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def race(url, voters, poll_id, option_ids, clicks, rng):
+    parts = urllib.parse.urlsplit(url)
+    go = asyncio.Event()
+    pending = [len(voters) * clicks]
+
+    def ready():
+        pending[0] -= 1
+        if not pending[0]:
+            go.set()
+
+    results = {session_id: [] for session_id in voters}
+    await asyncio.gather(*(
+        click(parts.hostname, parts.port or 80,
+              http_request(parts.netloc, "GET", f"/vote/{poll_id}/{rng.choice(option_ids)}", session_id),
+              ready, go, results[session_id])
+        for session_id in voters for _ in range(clicks)))
+    return results
+
+
+# Votes rows and counters of the poll, waiting for buffered votes to land
+def counted(db, poll_id, expected, settle):
+    cursor = db.cursor()
+    deadline = time.monotonic() + settle
+    while True:
+        cursor.execute("SELECT COUNT(*) AS n, COUNT(DISTINCT user_id) AS users FROM votes WHERE poll_id = %s",
+                       (poll_id,))
+        rows = cursor.fetchone()
+        if rows["n"] >= expected or time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+    cursor.execute("SELECT option_id, COUNT(*) AS n FROM votes WHERE poll_id = %s GROUP BY option_id", (poll_id,))
+    per_option = {row["option_id"]: row["n"] for row in cursor.fetchall()}
+    cursor.execute(OPTIONS_WITH_VOTES_SQL, (poll_id,))
+    counters = {row["id"]: int(row["votes"]) for row in cursor.fetchall()}
+    return rows["n"], rows["users"], per_option, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--start", action="store_true", help="start gunicorn and the stubs for the run")
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers with --start")
+    parser.add_argument("--stub-port", type=int, default=9001)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--voters", type=int, default=200)
+    parser.add_argument("--clicks", type=int, default=5, help="simultaneous clicks per voter")
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--settle", type=float, default=10, help="seconds to wait for buffered votes")
+    parser.add_argument("--random-seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.random_seed)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.voters * args.clicks + 256)), hard))
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM sessions WHERE id LIKE %s AND expires_at > UTC_TIMESTAMP() LIMIT %s",
+                   (f"{SESSION_PREFIX}%", args.voters))
+    voters = [row["id"] for row in cursor.fetchall()]
+    if len(voters) < args.voters:
+        raise SystemExit(f"Only {len(voters)} seeded sessions; run `loadtest.py seed` first.")
+    poll_id, option_ids = create_poll(db, int(voters[0][len(SESSION_PREFIX):]), args.options)
+
+    processes = start_app(args) if args.start else []
+    try:
+        before = questions(db)
+        started = time.perf_counter()
+        results = asyncio.run(race(args.url, voters, poll_id, option_ids, args.clicks, rng))
+        elapsed = time.perf_counter() - started
+        statements = questions(db) - before - 1
+        votes, users, per_option, counters = counted(db, poll_id, len(voters), args.settle)
+    finally:
+        stop_app(processes)
+        delete_poll(db, poll_id)
+
+    failures = []
+    accepted = {session_id: statuses.count(302) for session_id, statuses in results.items()}
+    other = {}
+    for statuses in results.values():
+        for status in statuses:
+            if status not in (200, 302):
+                other[status] = other.get(status, 0) + 1
+    if other:
+        failures.append(f"unexpected responses: {other}")
+    doubled = sum(1 for n in accepted.values() if n > 1)
+    missing = sum(1 for n in accepted.values() if n == 0)
+    if doubled:
+        failures.append(f"{doubled} voters had more than one vote accepted")
+    if missing:
+        failures.append(f"{missing} voters had no vote accepted")
+    if votes != len(voters) or users != len(voters):
+        failures.append(f"{votes} votes rows from {users} users, expected {len(voters)}")
+    for option_id in option_ids:
+        if counters.get(option_id, 0) != per_option.get(option_id, 0):
+            failures.append(f"option {option_id}: counter {counters.get(option_id, 0)}, "
+                            f"votes rows {per_option.get(option_id, 0)}")
+
+    clicks = len(voters) * args.clicks
+    print(f"{len(voters)} voters x {args.clicks} clicks in {elapsed:.2f}s; {sum(accepted.values())} accepted, "
+          f"{votes} votes rows; {statements / clicks:.2f} DB statements per click")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK: no double counts")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+
+from pagination import page_query
+
+# Top-level comments per page on a poll, newest first. Replies are not part
+# of the page: a thread shows its reply_count and loads on demand.
+COMMENTS_PAGE_SIZE = int(os.environ.get("COMMENTS_PAGE_SIZE", 20))
+# Most replies the replies fragment renders for one thread
+MAX_THREAD_REPLIES = int(os.environ.get("MAX_THREAD_REPLIES", 500))
+
+COMMENT_COLUMNS = """comments.id, comments.parent_comment_id, comments.comment, comments.created_at,
+                     comments.reply_count, users.email"""
+COMMENT_JOINS = "JOIN users ON users.id = comments.user_id"
+
+# Every reply below a comment at any depth, parents before their replies
+# (ids grow with time, so ordering by id is enough)
+THREAD_REPLIES_SQL = f"""
+    WITH RECURSIVE thread (id) AS (
+        SELECT id FROM comments WHERE parent_comment_id = %s AND poll_id = %s
+        UNION ALL
+        SELECT comments.id FROM comments JOIN thread ON comments.parent_comment_id = thread.id
+    )
+    SELECT {COMMENT_COLUMNS}
+    FROM thread
+    JOIN comments ON comments.id = thread.id
+    {COMMENT_JOINS}
+    ORDER BY comments.id
+    LIMIT %s
+    """
+
+# Count a new reply on its parent. Run before inserting the reply: it
+# affects no row if the parent is not a comment of the poll.
+COUNT_REPLY_SQL = "UPDATE comments SET reply_count = reply_count + 1 WHERE id = %s AND poll_id = %s"
+
+# Recompute reply_count for the comments of one poll from the rows
+RECOUNT_REPLIES_SQL = """
+    UPDATE comments
+    LEFT JOIN (SELECT parent_comment_id, COUNT(*) AS replies
+               FROM comments
+               WHERE poll_id = %s AND parent_comment_id IS NOT NULL
+               GROUP BY parent_comment_id) AS counted
+      ON counted.parent_comment_id = comments.id
+    SET comments.reply_count = COALESCE(counted.replies, 0)
+    WHERE comments.poll_id = %s
+    """
+
+
+# The (sql, params) of one page of a poll's top-level comments
+def top_level_page_query(poll_id, after_id, size=COMMENTS_PAGE_SIZE):
+    return page_query(COMMENT_COLUMNS, "comments", ["comments.poll_id = %s", "comments.parent_comment_id IS NULL"],
+                      [poll_id], after_id, size, COMMENT_JOINS)
+
+
+# The (sql, params) of a thread's replies, one row past the limit so the
+# caller can tell the thread was cut short
+def thread_replies_query(poll_id, comment_id, limit=MAX_THREAD_REPLIES):
+    return THREAD_REPLIES_SQL, (comment_id, poll_id, limit + 1)
+
+
+# Nest comment rows under their parents in one pass. Rows must come parents
+# first; each becomes a dict with a "replies" list. Returns the nodes that
+# hang directly below root_id. Rows whose parent is not among them (cut off
+# by a limit) are dropped.
+def build_comment_tree(rows, root_id=None):
+    nodes = {}
+    roots = []
+    for row in rows:
+        node = dict(row, replies=[])
+        if node["parent_comment_id"] == root_id:
+            roots.append(node)
+        elif node["parent_comment_id"] in nodes:
+            nodes[node["parent_comment_id"]]["replies"].append(node)
+        else:
+            continue
+        nodes[node["id"]] = node
+    return roots
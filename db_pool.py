@@ -0,0 +1,313 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# A pooled connection together with its bookkeeping timestamps
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "returned_at")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.returned_at = now
+
+
+# Bounded, thread-safe pymysql connection pool.
+#
+# Connections are created lazily up to max_size and kept warm down to
+# min_size: warm() opens min_size in the background once per process, and
+# idle eviction never goes below it. Every borrow health-checks the connection (ping) once it has sat
+# idle longer than ping_interval, connections idle longer than idle_timeout
+# are evicted, and connections older than max_lifetime are recycled.
+#
+# The pool remembers the pid that created it. Gunicorn forks its workers from
+# the master, so a pool touched in the master must never hand inherited
+# sockets to a child: when the pid changes the pool drops (without closing)
+# everything it holds and starts over in the new process.
+class ConnectionPool:
+    def __init__(self, connect_kwargs, min_size=1, max_size=10, timeout=5.0,
+                 idle_timeout=300.0, max_lifetime=3600.0, ping_interval=1.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size=%r max_size=%r" % (min_size, max_size))
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._warmed = False
+        self._last_eviction = time.monotonic()
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "borrowed": 0,
+            "returned": 0,
+            "health_check_failures": 0,
+            "idle_evictions": 0,
+            "lifetime_recycles": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+        }
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Forked: the inherited sockets belong to the parent process
+            logger.debug(f"Connection pool inherited from pid {self._pid}, resetting in pid {os.getpid()}")
+            self._reset()
+
+    def _count(self, name, value=1):
+        with self._cond:
+            self._stats[name] += value
+
+    def _connect(self):
+        conn = pymysql.connect(**self.connect_kwargs)
+        self._count("created")
+        return _PooledConnection(conn)
+
+    def _close(self, pooled):
+        self._count("closed")
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    # The stats counter to bump if the connection is past its lifetime or
+    # idle timeout, None if it is still good. Callers count under the lock.
+    def _expiry(self, pooled, now):
+        if self.max_lifetime and now - pooled.created_at > self.max_lifetime:
+            return "lifetime_recycles"
+        if self.idle_timeout and now - pooled.returned_at > self.idle_timeout:
+            return "idle_evictions"
+        return None
+
+    def _is_healthy(self, pooled, now):
+        if now - pooled.returned_at <= self.ping_interval:
+            return True
+        try:
+            pooled.conn.ping(reconnect=False)
+            return True
+        except Exception:
+            self._count("health_check_failures")
+            return False
+
+    # Take a connection from the pool, waiting up to `timeout` seconds when
+    # max_size connections are already checked out
+    def acquire(self):
+        self._check_pid()
+        deadline = None
+        waited_from = None
+        while True:
+            pooled = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    now = time.monotonic()
+                    if waited_from is None:
+                        waited_from = now
+                        deadline = now + self.timeout
+                        self._stats["waits"] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a database connection "
+                            f"({self.max_size} in use)")
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                now = time.monotonic()
+                expiry = self._expiry(pooled, now)
+                if expiry:
+                    self._count(expiry)
+                if expiry or not self._is_healthy(pooled, now):
+                    self._discard(pooled)
+                    continue
+
+            with self._cond:
+                if waited_from is not None:
+                    waited = time.monotonic() - waited_from
+                    self._stats["wait_time_total"] += waited
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+                self._in_use[id(pooled.conn)] = pooled
+                self._stats["borrowed"] += 1
+            return pooled.conn
+
+    # Hand a connection back. Any open transaction is rolled back so the next
+    # borrower never sees half-finished work; broken connections are dropped.
+    def release(self, conn, discard=False):
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            return
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard or (self.max_lifetime and time.monotonic() - pooled.created_at > self.max_lifetime):
+            self._discard(pooled)
+            return
+        pooled.returned_at = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._stats["returned"] += 1
+            self._cond.notify()
+        # Sweep idle connections at most a few times per idle_timeout
+        if self.idle_timeout and pooled.returned_at - self._last_eviction > min(self.idle_timeout / 4, 30):
+            self._last_eviction = pooled.returned_at
+            self.evict_idle()
+
+    # Borrow a connection for the duration of a with-block (background jobs)
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def _discard(self, pooled):
+        self._close(pooled)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    # Close idle connections past idle_timeout/max_lifetime, keeping min_size warm
+    def evict_idle(self):
+        self._check_pid()
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = deque()
+            # Oldest returned connections sit at the left of the deque
+            while self._idle:
+                pooled = self._idle.popleft()
+                expiry = self._expiry(pooled, now) if self._size - len(expired) > self.min_size else None
+                if expiry:
+                    self._stats[expiry] += 1
+                    expired.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+        for pooled in expired:
+            self._discard(pooled)
+        return len(expired)
+
+    # Open connections until min_size are available
+    def fill(self):
+        self._check_pid()
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    # Fill the pool to min_size in a background thread, once per process.
+    # Call it after the fork (the app does on first use in each worker).
+    def warm(self):
+        if self._warmed and self._pid == os.getpid():
+            return
+        self._check_pid()
+        with self._cond:
+            if self._warmed or not self.min_size:
+                return
+            self._warmed = True
+        threading.Thread(target=self._warm, name="db-pool-warm", daemon=True).start()
+
+    def _warm(self):
+        try:
+            self.fill()
+        except Exception as e:
+            logger.error(f"Error pre-warming the database connection pool: {e}")
+
+    def close(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle), in_use=len(self._in_use),
+                         min_size=self.min_size, max_size=self.max_size)
+        return stats
+
+
+# Build a pool from the DB_* environment variables used by app.get_db
+def pool_from_env(cursorclass=pymysql.cursors.DictCursor):
+    db_host = os.environ.get('DB_HOST')
+    db_user = os.environ.get('DB_USER')
+    logger.debug(f"Creating database connection pool for {db_host} with user {db_user}")
+    return ConnectionPool(
+        dict(
+            host=db_host,
+            user=db_user,
+            password=os.environ.get('DB_PASSWORD'),
+            database=os.environ.get('DB_NAME'),
+            cursorclass=cursorclass,
+        ),
+        min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+        max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        idle_timeout=float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+        max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+        ping_interval=float(os.environ.get('DB_POOL_PING_INTERVAL', 1)),
+    )
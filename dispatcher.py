@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+
+import boto3
+import botocore.exceptions
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+LAMBDA_REGION = os.environ.get("LAMBDA_REGION", "eu-central-1")
+# Point the client at a local stub (see benchmarks/stub_lambda.py)
+LAMBDA_ENDPOINT_URL = os.environ.get("LAMBDA_ENDPOINT_URL")
+DISPATCH_QUEUE_SIZE = int(os.environ.get("DISPATCH_QUEUE_SIZE", 1000))
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", 2))
+DISPATCH_MAX_ATTEMPTS = int(os.environ.get("DISPATCH_MAX_ATTEMPTS", 5))
+DISPATCH_BACKOFF_BASE = float(os.environ.get("DISPATCH_BACKOFF_BASE", 0.2))
+DISPATCH_BACKOFF_MAX = float(os.environ.get("DISPATCH_BACKOFF_MAX", 5))
+
+# Errors worth another attempt: throttling, AWS-side failures, network
+RETRYABLE_ERROR_CODES = {"TooManyRequestsException", "ServiceException", "ThrottlingException",
+                         "EC2ThrottledException", "ResourceNotReadyException"}
+
+
+def _is_retryable(error):
+    if isinstance(error, (botocore.exceptions.EndpointConnectionError,
+                          botocore.exceptions.ConnectionClosedError,
+                          botocore.exceptions.ReadTimeoutError)):
+        return True
+    if isinstance(error, botocore.exceptions.ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in RETRYABLE_ERROR_CODES or status >= 500
+    return False
+
+
+# Asynchronous Lambda invocations off the request path.
+#
+# submit() only puts the invocation on a bounded in-memory queue; a small
+# pool of threads drains it through one long-lived boto3 client, retrying
+# transient failures with exponential backoff and jitter. When the queue is
+# full the invocation is dropped and counted rather than blocking the
+# request. Threads and client are created lazily per process, so the
+# dispatcher is safe to construct before gunicorn forks.
+class LambdaDispatcher:
+    def __init__(self, region=LAMBDA_REGION, endpoint_url=LAMBDA_ENDPOINT_URL, queue_size=DISPATCH_QUEUE_SIZE,
+                 workers=DISPATCH_WORKERS, max_attempts=DISPATCH_MAX_ATTEMPTS):
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.queue_size = queue_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "delivered": 0, "failed": 0, "retries": 0, "dropped": 0,
+                       "latency_total": 0.0, "latency_max": 0.0}
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            # Low-level clients are thread-safe; one per process is enough
+            self._client = boto3.client(
+                "lambda", region_name=self.region, endpoint_url=self.endpoint_url,
+                config=Config(retries={"max_attempts": 0}, max_pool_connections=self.workers))
+            for index in range(self.workers):
+                threading.Thread(target=self._run, name=f"lambda-dispatcher-{index}", daemon=True).start()
+            self._pid = os.getpid()
+            atexit.register(self.drain)
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    # Queue an asynchronous ('Event') invocation. Returns False if it was
+    # dropped because the queue is full.
+    def submit(self, function_name, payload):
+        self._start()
+        try:
+            self._queue.put_nowait((function_name, json.dumps(payload), time.monotonic()))
+        except queue.Full:
+            self._count("dropped")
+            logger.error(f"Lambda dispatch queue full, dropping invocation of {function_name}")
+            return False
+        self._count("submitted")
+        return True
+
+    def _run(self):
+        while True:
+            function_name, payload, queued_at = self._queue.get()
+            try:
+                self._invoke(function_name, payload)
+                latency = time.monotonic() - queued_at
+                with self._stats_lock:
+                    self._stats["delivered"] += 1
+                    self._stats["latency_total"] += latency
+                    self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"Error invoking Lambda function {function_name}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _invoke(self, function_name, payload):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = self._client.invoke(FunctionName=function_name, InvocationType="Event", Payload=payload)
+                logger.info(f"Lambda function {function_name} invoked: {response.get('StatusCode')}")
+                return response
+            except Exception as e:
+                if attempt == self.max_attempts or not _is_retryable(e):
+                    raise
+                self._count("retries")
+                delay = min(DISPATCH_BACKOFF_MAX, DISPATCH_BACKOFF_BASE * 2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+
+    # Wait (bounded) for queued invocations, e.g. on worker shutdown
+    def drain(self, timeout=5.0):
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize() if self._pid == os.getpid() else 0
+        stats["queue_size"] = self.queue_size
+        return stats
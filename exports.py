@@ -0,0 +1,167 @@
+import io
+import os
+import csv
+import json
+import zlib
+import logging
+import threading
+
+import pymysql
+
+from vote_counters import OPTION_VOTES_SQL
+
+logger = logging.getLogger(__name__)
+
+# Rows read from the server per batch, and exports one worker runs at a time
+# (each holds a pool connection for as long as the download takes)
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", 2000))
+EXPORT_MAX_CONCURRENT = int(os.environ.get("EXPORT_MAX_CONCURRENT", 2))
+# An unbuffered result keeps MySQL waiting on the client; allow slow downloads
+EXPORT_NET_WRITE_TIMEOUT = int(os.environ.get("EXPORT_NET_WRITE_TIMEOUT", 600))
+
+# name: (table, columns). Every export is ordered by, and resumable on, the
+# table's primary key.
+EXPORTS = {
+    "polls": ("polls", "polls.id, polls.poll, polls.creator_id"),
+    "options": ("options", f"options.id, options.poll_id, options.option_text, "
+                           f"CAST({OPTION_VOTES_SQL} AS SIGNED) AS votes"),
+    "votes": ("votes", "votes.id, votes.poll_id, votes.user_id, votes.option_id"),
+    "comments": ("comments", "comments.id, comments.poll_id, comments.user_id, comments.parent_comment_id, "
+                             "comments.reply_count, comments.created_at, comments.comment"),
+}
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class ExportBusy(Exception):
+    pass
+
+
+# The (sql, params) of one export over the id range (after_id, until_id]
+def export_query(name, after_id=None, until_id=None):
+    table, columns = EXPORTS[name]
+    conditions, params = [], []
+    if after_id is not None:
+        conditions.append(f"{table}.id > %s")
+        params.append(after_id)
+    if until_id is not None:
+        conditions.append(f"{table}.id <= %s")
+        params.append(until_id)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {columns} FROM {table} {where_sql} ORDER BY {table}.id", params
+
+
+def _parse_id(value, name):
+    if value in (None, ""):
+        return None
+    if not str(value).isdigit():
+        raise ExportError(f"{name} must be a non-negative integer.")
+    return int(value)
+
+
+# Streams table exports straight from an unbuffered server-side cursor, so
+# memory stays flat however many rows there are, and the first bytes go out
+# as soon as MySQL returns the first row.
+class Exporter:
+    def __init__(self, pool_getter, max_concurrent=EXPORT_MAX_CONCURRENT, batch_rows=EXPORT_BATCH_ROWS):
+        self.pool_getter = pool_getter
+        self.batch_rows = batch_rows
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    # Validate the request, claim a slot and start the query. Returns an
+    # ExportStream for a streaming response body.
+    def open(self, name, fmt="csv", after_id=None, until_id=None, compress=False):
+        if name not in EXPORTS:
+            raise ExportError(f"Unknown export: {name}")
+        if fmt not in FORMATS:
+            raise ExportError(f"Unknown format: {fmt} (use {' or '.join(FORMATS)})")
+        after_id = _parse_id(after_id, "after_id")
+        until_id = _parse_id(until_id, "until_id")
+        if not self._slots.acquire(blocking=False):
+            raise ExportBusy("Too many exports in flight")
+        try:
+            pool = self.pool_getter()
+            conn = pool.acquire()
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            conn.cursor().execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(*export_query(name, after_id, until_id))
+        except Exception:
+            pool.release(conn, discard=True)
+            self._slots.release()
+            raise
+        suffix = f"-after-{after_id}" if after_id is not None else ""
+        filename = f"{name}{suffix}.{fmt}" + (".gz" if compress else "")
+        return ExportStream(self, pool, conn, cursor, fmt, compress, filename)
+
+
+# Response body of one export. Werkzeug calls close() when the response is
+# done or the client went away; a half-read unbuffered result cannot be
+# abandoned cleanly, so the connection is then closed instead of pooled.
+class ExportStream:
+    def __init__(self, exporter, pool, conn, cursor, fmt, compress, filename):
+        self.exporter = exporter
+        self.pool = pool
+        self.conn = conn
+        self.cursor = cursor
+        self.fmt = fmt
+        self.compress = compress
+        self.filename = filename
+        self.mimetype = "application/gzip" if compress else FORMATS[fmt]
+        self.rows = 0
+        self._finished = False
+        self._closed = False
+
+    def __iter__(self):
+        names = [column[0] for column in self.cursor.description]
+        # gzip members can be concatenated, so ranges exported separately
+        # still join into one valid file
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.compress else None
+        if self.fmt == "csv":
+            yield self._encode(",".join(names) + "\n", compressor)
+        while True:
+            batch = self.cursor.fetchmany(self.exporter.batch_rows)
+            if not batch:
+                break
+            self.rows += len(batch)
+            yield self._encode(self._format(names, batch), compressor)
+        self._finished = True
+        if compressor is not None:
+            yield compressor.flush()
+
+    def _format(self, names, rows):
+        if self.fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(rows)
+            return buffer.getvalue()
+        return "".join(json.dumps(dict(zip(names, row)), default=str, ensure_ascii=False) + "\n" for row in rows)
+
+    def _encode(self, text, compressor):
+        data = text.encode()
+        if compressor is None:
+            return data
+        # Sync flush per batch so the client sees progress, not one burst at the end
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._finished:
+                self.cursor.close()
+                self.conn.cursor().execute("SET SESSION net_write_timeout = DEFAULT")
+            else:
+                logger.info(f"Export {self.filename} stopped after {self.rows} rows")
+            self.pool.release(self.conn, discard=not self._finished)
+        except Exception as e:
+            logger.error(f"Error closing export {self.filename}: {e}")
+            self.pool.release(self.conn, discard=True)
+        finally:
+            self.exporter._slots.release()
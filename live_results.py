@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+
+from vote_counters import OPTIONS_WITH_VOTES_SQL
+
+logger = logging.getLogger(__name__)
+
+# Coalescing window: vote changes are read and pushed at most this often
+LIVE_RESULTS_WINDOW = float(os.environ.get("LIVE_RESULTS_WINDOW", 1.0))
+LIVE_RESULTS_HEARTBEAT = float(os.environ.get("LIVE_RESULTS_HEARTBEAT", 15))
+LIVE_RESULTS_MAX_CLIENTS = int(os.environ.get("LIVE_RESULTS_MAX_CLIENTS", 5000))
+# Events buffered per client; a client that falls further behind is
+# disconnected and reconnects to a fresh snapshot
+LIVE_RESULTS_CLIENT_BUFFER = int(os.environ.get("LIVE_RESULTS_CLIENT_BUFFER", 16))
+
+_CLOSED = object()
+
+
+class TooManyClients(Exception):
+    pass
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# The "votes" event payload: options whose count moved since the last read
+def count_changes(old, new):
+    return {option_id: {"votes": votes, "delta": votes - old.get(option_id, 0)}
+            for option_id, votes in new.items() if old.get(option_id) != votes}
+
+
+# One upstream subscription for one poll in this worker: a single reader
+# (a thread, or a task in the async app) reads the poll's counts once per
+# window (from the shared snapshot when the poll is hot, otherwise one MySQL
+# query) and fans the changes out to every connected client's queue. Clients
+# that joined since the last read get the full counts from that same read,
+# so no change falls between their snapshot and their first update.
+class PollChannel:
+    def __init__(self, hub, poll_id):
+        self.hub = hub
+        self.poll_id = poll_id
+        self.subscribers = set()
+        self.joining = set()
+        self.counts = None
+
+    # False, and the channel removed, once every client has left
+    def active(self):
+        with self.hub.lock:
+            if not self.subscribers and not self.joining:
+                del self.hub.channels[self.poll_id]
+                return False
+            return True
+
+    # Push one read's changes to the subscribers and its full counts to the
+    # clients that joined since the previous read
+    def update(self, counts):
+        if self.counts is not None:
+            changes = count_changes(self.counts, counts)
+            if changes:
+                self.hub.count("updates")
+                self.publish(self.subscribers, sse("votes", changes))
+        self.counts = counts
+        with self.hub.lock:
+            joined, self.joining = self.joining, set()
+            self.subscribers |= joined
+        self.publish(joined, sse("snapshot", counts))
+
+    def publish(self, subscribers, message):
+        with self.hub.lock:
+            subscribers = list(subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except (queue.Full, asyncio.QueueFull):
+                self.hub.count("lagging")
+                with self.hub.lock:
+                    self.subscribers.discard(subscriber)
+                # Make room for the close marker so the stream ends
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(_CLOSED)
+
+
+# Client bookkeeping shared by the sync and async hubs. A client is only
+# counted and subscribed once its stream is first iterated, and leaves in
+# the stream's finally, so a response dropped before it started never holds
+# a slot. stream() checks the limit up front to answer 503 early.
+class _LiveResultsHub:
+    def __init__(self, window):
+        self.window = window
+        self.channels = {}
+        self.lock = threading.Lock()
+        self._stats = {"clients": 0, "connects": 0, "rejected": 0, "updates": 0, "lagging": 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self._stats[name] += value
+
+    def check_capacity(self):
+        with self.lock:
+            self._check_capacity()
+
+    def _check_capacity(self):
+        if self._stats["clients"] >= LIVE_RESULTS_MAX_CLIENTS:
+            self._stats["rejected"] += 1
+            raise TooManyClients(f"{LIVE_RESULTS_MAX_CLIENTS} live result streams already open")
+
+    # Add a client to the poll's channel; the caller starts the reader when
+    # the channel is new
+    def join(self, poll_id, subscriber):
+        with self.lock:
+            self._check_capacity()
+            channel = self.channels.get(poll_id)
+            start = channel is None
+            if start:
+                channel = self.channels[poll_id] = PollChannel(self, poll_id)
+            channel.joining.add(subscriber)
+            self._stats["clients"] += 1
+            self._stats["connects"] += 1
+        return channel, start
+
+    def leave(self, channel, subscriber):
+        with self.lock:
+            channel.subscribers.discard(subscriber)
+            channel.joining.discard(subscriber)
+            self._stats["clients"] -= 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+            stats["channels"] = len(self.channels)
+        stats["window"] = self.window
+        return stats
+
+
+# Live vote counts over Server-Sent Events, one channel per poll per worker.
+# Streams are long-lived, so the app must run on an async worker (gunicorn
+# -k gevent): each idle connection is then a parked greenlet, not a thread.
+class LiveResults(_LiveResultsHub):
+    def __init__(self, get_pool, snapshot, window=LIVE_RESULTS_WINDOW):
+        super().__init__(window)
+        self.get_pool = get_pool
+        self.snapshot = snapshot
+
+    # {option_id: votes} for a poll
+    def read_counts(self, poll_id):
+        counts = self.snapshot.get(poll_id)
+        if counts is not None:
+            return counts
+        with self.get_pool().connection() as db:
+            cursor = db.cursor()
+            cursor.execute(OPTIONS_WITH_VOTES_SQL, (poll_id,))
+            rows = cursor.fetchall()
+            db.rollback()
+        return {row["id"]: int(row["votes"]) for row in rows}
+
+    def _run(self, channel):
+        while channel.active():
+            try:
+                counts = self.read_counts(channel.poll_id)
+            except Exception as e:
+                logger.error(f"Error reading live results for poll {channel.poll_id}: {e}")
+            else:
+                channel.update(counts)
+            time.sleep(self.window)
+
+    # The event stream for one client: the current counts first, then the
+    # coalesced changes, with comment heartbeats to keep proxies from
+    # closing an idle connection
+    def stream(self, poll_id):
+        self.check_capacity()
+        return self._events(poll_id)
+
+    def _events(self, poll_id):
+        yield f"retry: {int(self.window * 2000)}\n\n"
+        subscriber = queue.Queue(maxsize=LIVE_RESULTS_CLIENT_BUFFER)
+        try:
+            channel, start = self.join(poll_id, subscriber)
+        except TooManyClients as e:
+            logger.error(f"Ending live results stream: {e}")
+            return
+        if start:
+            threading.Thread(target=self._run, args=(channel,), name=f"live-results-{poll_id}",
+                             daemon=True).start()
+        try:
+            while True:
+                try:
+                    message = subscriber.get(timeout=LIVE_RESULTS_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is _CLOSED:
+                    return
+                yield message
+        finally:
+            self.leave(channel, subscriber)
+
+
+# The same fan-out for the async app (asgi_app.py): one task per poll per
+# process instead of a thread, asyncio queues instead of queue.Queue, and
+# the counts read through an awaitable read_counts(poll_id).
+class AsyncLiveResults(_LiveResultsHub):
+    def __init__(self, read_counts, window=LIVE_RESULTS_WINDOW):
+        super().__init__(window)
+        self.read_counts = read_counts
+
+    async def _run(self, channel):
+        while channel.active():
+            try:
+                counts = await self.read_counts(channel.poll_id)
+            except Exception as e:
+                logger.error(f"Error reading live results for poll {channel.poll_id}: {e}")
+            else:
+                channel.update(counts)
+            await asyncio.sleep(self.window)
+
+    def stream(self, poll_id):
+        self.check_capacity()
+        return self._events(poll_id)
+
+    async def _events(self, poll_id):
+        yield f"retry: {int(self.window * 2000)}\n\n"
+        subscriber = asyncio.Queue(maxsize=LIVE_RESULTS_CLIENT_BUFFER)
+        try:
+            channel, start = self.join(poll_id, subscriber)
+        except TooManyClients as e:
+            logger.error(f"Ending live results stream: {e}")
+            return
+        if start:
+            asyncio.get_running_loop().create_task(self._run(channel))
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.get(), LIVE_RESULTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is _CLOSED:
+                    return
+                yield message
+        finally:
+            self.leave(channel, subscriber)
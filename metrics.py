@@ -0,0 +1,409 @@
+import os
+import re
+import json
+import hashlib
+import atexit
+import time
+import signal
+import logging
+import tempfile
+import threading
+from collections import Counter
+
+import boto3
+import pymysql
+from flask import Response, request, template_rendered, before_render_template
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# Per-worker snapshot files, merged by /metrics so a scrape sees every
+# gunicorn worker whichever one answers it
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "poll_metrics"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 2))
+# Statements slower than this are logged with their route
+METRICS_SLOW_QUERY_MS = float(os.environ.get("METRICS_SLOW_QUERY_MS", 200))
+# Sampling profiler for slow requests, off unless PROFILE_SLOW_MS is set
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "poll_profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name: (type, help, buckets)
+METRICS = {
+    "http_requests_total": ("counter", "Requests by route, method and status.", None),
+    "http_request_duration_seconds": ("histogram", "Request latency by route.", LATENCY_BUCKETS),
+    "db_queries_per_request": ("histogram", "SQL statements issued per request.", COUNT_BUCKETS),
+    "db_time_per_request_seconds": ("histogram", "Time spent in SQL per request.", LATENCY_BUCKETS),
+    "db_query_duration_seconds": ("histogram", "Latency of single SQL statements by route.", QUERY_BUCKETS),
+    "db_slowest_query_seconds": ("gauge", "Slowest SQL statement seen per route, labelled with its fingerprint.",
+                                 None),
+    "template_render_seconds": ("histogram", "Jinja template render time.", LATENCY_BUCKETS),
+    "aws_call_duration_seconds": ("histogram", "Latency of boto3 calls by service and operation.",
+                                  LATENCY_BUCKETS),
+    "aws_call_errors_total": ("counter", "Failed boto3 calls by service and operation.", None),
+}
+
+# Statements and samples of the request running on each thread (greenlet
+# under gevent, where threading.get_ident is per greenlet)
+_active = {}
+
+
+class RequestStats:
+    __slots__ = ("route", "started", "queries", "db_time", "slowest", "samples")
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = (0.0, None)
+        self.samples = []
+
+
+# Counters, gauges and histograms of one worker. Values live in memory and
+# are written to METRICS_DIR/metrics-<pid>.json by a flusher thread. The
+# counters and histograms in files of exited workers are kept so they never
+# go backwards; their gauges are dropped, as nothing updates them any more.
+class Metrics:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._values = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Values inherited from the master belong to the master
+            self._values = {}
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing metrics: {e}")
+
+    def _series(self, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = self._values.get(key)
+        if series is None:
+            buckets = METRICS[name][2]
+            series = self._values[key] = [[0] * (len(buckets) + 1), 0.0, 0] if buckets else [0]
+        return series
+
+    def inc(self, name, value=1, **labels):
+        self._start()
+        with self._lock:
+            self._series(name, labels)[0] += value
+
+    # Gauge holding the largest value seen. detail (a statement fingerprint)
+    # is reported as a "statement" label of the largest value, but is not
+    # part of the series key, so there is one series per set of labels.
+    def set_max(self, name, value, detail=None, **labels):
+        self._start()
+        with self._lock:
+            series = self._series(name, labels)
+            if value > series[0]:
+                series[:] = [value] if detail is None else [value, detail]
+
+    def observe(self, name, value, **labels):
+        self._start()
+        buckets = METRICS[name][2]
+        with self._lock:
+            series = self._series(name, labels)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def flush(self):
+        with self._lock:
+            rows = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(rows, f)
+        os.replace(f"{path}.tmp", path)
+
+    # Every worker's values merged: counters and histograms are summed,
+    # gauges take the maximum
+    def collect(self):
+        self._start()
+        self.flush()
+        merged = {}
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping metrics file {filename}: {e}")
+                continue
+            if not _pid_alive(filename):
+                rows = self._drop_gauges(path, rows)
+            for name, labels, value in rows:
+                if name not in METRICS:
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = value
+                elif METRICS[name][0] == "histogram":
+                    merged[key] = [[a + b for a, b in zip(current[0], value[0])],
+                                   current[1] + value[1], current[2] + value[2]]
+                elif METRICS[name][0] == "gauge":
+                    merged[key] = max(current, value, key=lambda gauge: gauge[0])
+                else:
+                    merged[key] = [current[0] + value[0]]
+        return merged
+
+    # Rewrite an exited worker's file without its gauges, once
+    def _drop_gauges(self, path, rows):
+        kept = [row for row in rows if row[0] in METRICS and METRICS[row[0]][0] != "gauge"]
+        if len(kept) != len(rows):
+            try:
+                with open(f"{path}.tmp", "w") as f:
+                    json.dump(kept, f)
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                logger.error(f"Error pruning metrics file {path}: {e}")
+        return kept
+
+    # Prometheus text exposition format
+    def render(self):
+        merged = self.collect()
+        lines = []
+        for name, (kind, description, buckets) in METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in merged.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind == "gauge" and len(value) > 1:
+                    lines.append(f"{name}{_labels(labels + (('statement', value[1]),))} {value[0]}")
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {value[0]}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], value[0]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {value[1]}")
+                lines.append(f"{name}_count{_labels(labels)} {value[2]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _pid_alive(filename):
+    try:
+        pid = int(filename[len("metrics-"):-len(".json")])
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Literals, placeholders and the value lists built per call (IN (%s, ...)
+# sized to the batch, executemany's multi-row VALUES) all reduce to one shape
+_SQL_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+_SQL_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+`?(\w+)", re.IGNORECASE)
+
+
+# Short, bounded-cardinality name of a statement for metric labels: its
+# verb, first table and a hash of the normalized text. The slow query log
+# line carries the same fingerprint next to the SQL.
+def statement_fingerprint(query):
+    normalized = _SQL_VALUE_LIST.sub("(?)", _SQL_LITERAL.sub("?", " ".join(query.split())))
+    words = normalized.split(" ", 1)
+    table = _SQL_TABLE.search(normalized)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:8]
+    return f"{words[0].upper()} {table.group(1) if table else '-'} {digest}"
+
+
+metrics = Metrics()
+
+
+# Cursor class for the pool: times every statement and adds it to the
+# running request's totals. executemany() goes through execute() once per
+# statement actually sent.
+class InstrumentedCursor(pymysql.cursors.DictCursor):
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+
+def record_query(query, elapsed):
+    stats = _active.get(threading.get_ident())
+    route = stats.route if stats is not None else "background"
+    metrics.observe("db_query_duration_seconds", elapsed, route=route)
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if elapsed > stats.slowest[0]:
+            stats.slowest = (elapsed, query)
+    if elapsed * 1000 >= METRICS_SLOW_QUERY_MS:
+        logger.warning(f"Slow query on {route} ({elapsed * 1000:.0f} ms) [{statement_fingerprint(query)}]: "
+                       f"{' '.join(query.split())[:500]}")
+
+
+# Samples the running stack on SIGPROF (every PROFILE_INTERVAL_MS of CPU
+# time) and, for requests slower than PROFILE_SLOW_MS, appends their
+# samples to PROFILE_DIR/slow-<pid>.folded in the collapsed-stack format
+# read by flamegraph.pl and speedscope, one "route;frame;...;frame count"
+# line per distinct stack. Signals only reach the main thread, so this
+# sees requests on gevent (or sync) workers, not on gthread ones.
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, directory=PROFILE_DIR):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._pid = None
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        try:
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            # SIGPROF's default action kills the process once the handler is gone
+            atexit.register(signal.setitimer, signal.ITIMER_PROF, 0)
+        except ValueError as e:
+            logger.error(f"Cannot start the sampling profiler outside the main thread: {e}")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _sample(self, signum, frame):
+        stats = _active.get(threading.get_ident())
+        if stats is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append((frame.f_code.co_name, frame.f_code.co_filename, frame.f_lineno))
+            frame = frame.f_back
+        stats.samples.append(stack)
+
+    def finish(self, stats, elapsed):
+        if elapsed < self.threshold or not stats.samples:
+            return
+        folded = Counter(";".join([stats.route] + [f"{name} ({os.path.basename(filename)}:{line})"
+                                                   for name, filename, line in reversed(stack)])
+                         for stack in stats.samples)
+        try:
+            with open(os.path.join(self.directory, f"slow-{os.getpid()}.folded"), "a") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in folded.items())
+        except OSError as e:
+            logger.error(f"Error writing profile samples: {e}")
+
+
+# Time boto3 calls. Handlers must be registered on the default session
+# before clients are created: each client copies the session's handlers.
+def instrument_boto3():
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    events = boto3.DEFAULT_SESSION.events
+
+    def before_call(model, context, **kwargs):
+        context["metrics_started"] = time.perf_counter()
+
+    def after_call(model, context, http_response=None, **kwargs):
+        started = context.pop("metrics_started", None)
+        if started is None:
+            return
+        labels = {"service": model.service_model.service_name, "operation": model.name}
+        metrics.observe("aws_call_duration_seconds", time.perf_counter() - started, **labels)
+        if http_response is None or http_response.status_code >= 400:
+            metrics.inc("aws_call_errors_total", **labels)
+
+    events.register("before-call", before_call, unique_id="metrics-before-call")
+    events.register("after-call", after_call, unique_id="metrics-after-call")
+    events.register("after-call-error", after_call, unique_id="metrics-after-call-error")
+
+
+# Wire request, SQL, template and boto3 instrumentation into the app.
+# Returns the Metrics (None when METRICS_ENABLED=0); the pool must be built
+# with cursorclass=InstrumentedCursor for the SQL part.
+def init_metrics(app):
+    if not METRICS_ENABLED:
+        return None
+    instrument_boto3()
+    profiler = SlowRequestProfiler() if PROFILE_SLOW_MS > 0 else None
+
+    @app.before_request
+    def start_request_metrics():
+        if profiler is not None:
+            profiler.start()
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        _active[threading.get_ident()] = RequestStats(route)
+
+    @app.teardown_request
+    def finish_request_metrics(exception):
+        stats = _active.pop(threading.get_ident(), None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        metrics.observe("http_request_duration_seconds", elapsed, route=stats.route)
+        metrics.observe("db_queries_per_request", stats.queries, route=stats.route)
+        metrics.observe("db_time_per_request_seconds", stats.db_time, route=stats.route)
+        if stats.slowest[1] is not None:
+            metrics.set_max("db_slowest_query_seconds", stats.slowest[0],
+                            detail=statement_fingerprint(stats.slowest[1]), route=stats.route)
+        if profiler is not None:
+            profiler.finish(stats, elapsed)
+
+    @app.after_request
+    def count_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.inc("http_requests_total", route=route, method=request.method, status=str(response.status_code))
+        return response
+
+    def template_started(sender, template, context, **extra):
+        context["_metrics_render_started"] = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        started = context.get("_metrics_render_started")
+        if started is not None:
+            metrics.observe("template_render_seconds", time.perf_counter() - started, template=template.name)
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+    return metrics
+
+
+def metrics_response():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
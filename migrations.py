@@ -0,0 +1,221 @@
+import logging
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_DDL = '''CREATE TABLE IF NOT EXISTS schema_version (
+                            version INT PRIMARY KEY,
+                            description VARCHAR(255) NOT NULL,
+                            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+
+
+# Add an index unless a previous (partial) run already did
+def add_index(table, name, columns):
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+            """, (table, name))
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns})")
+    return step
+
+
+# Drop an index if it is still there
+def drop_index(table, name):
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+            """, (table, name))
+        if cursor.fetchone() is not None:
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+    return step
+
+
+# Add a column unless a previous (partial) run already did
+def add_column(table, name, definition):
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            LIMIT 1
+            """, (table, name))
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    return step
+
+
+# Forward migrations as (version, description, steps). A step is an SQL
+# string or a callable taking a cursor, and every step must be safe to run
+# again: MySQL DDL commits implicitly, so a migration that dies halfway is
+# simply re-run from its first step. Never edit a released migration, add a
+# new one instead.
+MIGRATIONS = [
+    (1, "initial schema", [
+        '''CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                email VARCHAR(255) NOT NULL UNIQUE,
+                password VARCHAR(255) NOT NULL,
+                is_admin TINYINT DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS polls (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                poll TEXT NOT NULL,
+                creator_id INT NOT NULL,
+                FOREIGN KEY (creator_id) REFERENCES users(id))''',
+        '''CREATE TABLE IF NOT EXISTS options (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                poll_id INT NOT NULL,
+                option_text TEXT NOT NULL,
+                votes INT DEFAULT 0,
+                FOREIGN KEY (poll_id) REFERENCES polls(id))''',
+        '''CREATE TABLE IF NOT EXISTS comments (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                poll_id INT NOT NULL,
+                user_id INT NOT NULL,
+                comment TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                parent_comment_id INT,
+                FOREIGN KEY (poll_id) REFERENCES polls(id),
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (parent_comment_id) REFERENCES comments(id))''',
+        '''CREATE TABLE IF NOT EXISTS votes (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                poll_id INT NOT NULL,
+                user_id INT NOT NULL,
+                option_id INT NOT NULL,
+                FOREIGN KEY (poll_id) REFERENCES polls(id),
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (option_id) REFERENCES options(id),
+                UNIQUE(poll_id, user_id))''',
+    ]),
+    (2, "sharded vote counters", [
+        '''CREATE TABLE IF NOT EXISTS option_vote_shards (
+                option_id INT NOT NULL,
+                shard SMALLINT NOT NULL,
+                votes INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (option_id, shard))''',
+    ]),
+    (3, "secondary indexes for route access patterns", [
+        # Comments of a poll in display order, no filesort
+        add_index("comments", "idx_comments_poll_created", "poll_id, created_at"),
+        # A user's polls, newest first (keyset pagination on id)
+        add_index("polls", "idx_polls_creator_id", "creator_id, id"),
+        # Options of a poll in id order
+        add_index("options", "idx_options_poll_id", "poll_id, id"),
+        # Admin listings by role; covering for id/email
+        add_index("users", "idx_users_is_admin", "is_admin, email"),
+    ]),
+    (4, "transactional outbox", [
+        '''CREATE TABLE IF NOT EXISTS outbox (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                event_type VARCHAR(64) NOT NULL,
+                dedupe_key VARCHAR(191) NOT NULL UNIQUE,
+                destination VARCHAR(255) NOT NULL,
+                payload TEXT NOT NULL,
+                created_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+                attempts INT NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+                delivered_at DATETIME(3) NULL,
+                last_error TEXT,
+                INDEX idx_outbox_pending (delivered_at, next_attempt_at, id))''',
+    ]),
+    (5, "server-side sessions", [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+                id VARCHAR(64) PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at DATETIME NOT NULL,
+                INDEX idx_sessions_expires_at (expires_at))''',
+    ]),
+    (6, "role version stamp for cached authorization", [
+        add_column("users", "role_version", "INT NOT NULL DEFAULT 0"),
+    ]),
+    (7, "uploaded files", [
+        '''CREATE TABLE IF NOT EXISTS uploads (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                object_key VARCHAR(512) NOT NULL,
+                filename VARCHAR(255) NOT NULL,
+                content_type VARCHAR(100) NOT NULL,
+                status ENUM('pending', 'complete', 'rejected') NOT NULL DEFAULT 'pending',
+                size BIGINT NULL,
+                etag VARCHAR(100) NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP NULL,
+                UNIQUE KEY idx_uploads_object_key (object_key),
+                INDEX idx_uploads_user_id (user_id, id))''',
+    ]),
+    (8, "threaded comments", [
+        # Replies per comment, so a collapsed thread needs no child query
+        add_column("comments", "reply_count", "INT NOT NULL DEFAULT 0"),
+        '''UPDATE comments
+           JOIN (SELECT parent_comment_id, COUNT(*) AS replies
+                 FROM comments
+                 WHERE parent_comment_id IS NOT NULL
+                 GROUP BY parent_comment_id) AS counted
+             ON counted.parent_comment_id = comments.id
+           SET comments.reply_count = counted.replies''',
+        # A poll's top-level comments, newest first (keyset pagination on id)
+        add_index("comments", "idx_comments_poll_thread", "poll_id, parent_comment_id, id"),
+    ]),
+    (9, "outbox dead letters", [
+        add_column("outbox", "dead_at", "DATETIME(3) NULL"),
+        # Events dead-lettered before this column existed were parked about
+        # three years ahead
+        '''UPDATE outbox SET dead_at = NOW(3)
+           WHERE delivered_at IS NULL AND dead_at IS NULL AND next_attempt_at > NOW(3) + INTERVAL 1 YEAR''',
+        # The relay's claim: due events that are neither delivered nor dead
+        add_index("outbox", "idx_outbox_due", "delivered_at, dead_at, next_attempt_at, id"),
+        drop_index("outbox", "idx_outbox_pending"),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+CURRENT_VERSION_SQL = "SELECT MAX(version) AS version FROM schema_version"
+
+
+# Highest applied version, 0 for an empty database
+def current_version(db):
+    cursor = db.cursor()
+    try:
+        cursor.execute(CURRENT_VERSION_SQL)
+    except pymysql.err.ProgrammingError as e:
+        # 1146: table doesn't exist yet
+        if e.args[0] == 1146:
+            return 0
+        raise
+    version = cursor.fetchone()["version"]
+    return version or 0
+
+
+# Apply every pending migration in order. A MySQL named lock keeps two
+# instances booting at the same time from migrating concurrently.
+def upgrade(db, target=LATEST_VERSION):
+    cursor = db.cursor()
+    cursor.execute("SELECT GET_LOCK('schema_migrations', 300) AS locked")
+    if not cursor.fetchone()["locked"]:
+        raise RuntimeError("Timed out waiting for the schema migration lock")
+    applied = []
+    try:
+        cursor.execute(SCHEMA_VERSION_DDL)
+        version = current_version(db)
+        for number, description, steps in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+            logger.info(f"Applying migration {number}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (number, description))
+            db.commit()
+            applied.append(number)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('schema_migrations')")
+    return applied
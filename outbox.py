@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import logging
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 0.5))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_RETENTION_HOURS = int(os.environ.get("OUTBOX_RETENTION_HOURS", 72))
+# How long a claimed batch is reserved for its relay. Must outlast delivery
+# (webhooks time out after 10s); rows of a relay that dies mid-batch are
+# picked up again once the lease runs out.
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", 120))
+OUTBOX_SES_SENDER = os.environ.get("OUTBOX_SES_SENDER", "rego@regomeszaros.awsapps.com")
+LAMBDA_REGION = os.environ.get("LAMBDA_REGION", "eu-central-1")
+LAMBDA_ENDPOINT_URL = os.environ.get("LAMBDA_ENDPOINT_URL")
+# Functions that take {"recipients": [...]} batches and report failures per
+# recipient; everything else gets one asynchronous invoke per event
+OUTBOX_LAMBDA_BATCH_TARGETS = set(filter(None, os.environ.get(
+    "OUTBOX_LAMBDA_BATCH_TARGETS", "welcome_email_function").split(",")))
+OUTBOX_LAMBDA_BATCH_SIZE = int(os.environ.get("OUTBOX_LAMBDA_BATCH_SIZE", 50))
+
+
+# Record a side effect in the caller's transaction. The destination is
+# "lambda:<function>", "ses:email" or "webhook:<url>"; the dedupe key makes
+# the write idempotent and travels with the event so receivers can drop
+# redeliveries.
+ENQUEUE_SQL = """INSERT IGNORE INTO outbox (event_type, dedupe_key, destination, payload)
+                 VALUES (%s, %s, %s, %s)"""
+
+
+def enqueue(cursor, event_type, dedupe_key, destination, payload):
+    cursor.execute(ENQUEUE_SQL, (event_type, dedupe_key, destination, json.dumps(payload)))
+
+
+# Backlog size and age of the oldest event still to be delivered, and the
+# number of dead-lettered events that will not be retried
+OUTBOX_LAG_SQL = """
+    SELECT COALESCE(SUM(dead_at IS NULL), 0) AS pending,
+           COALESCE(SUM(dead_at IS NOT NULL), 0) AS dead,
+           COALESCE(TIMESTAMPDIFF(MICROSECOND, MIN(CASE WHEN dead_at IS NULL THEN created_at END), NOW(3))
+                    / 1000000, 0) AS lag_seconds
+    FROM outbox
+    WHERE delivered_at IS NULL
+    """
+
+
+def outbox_lag(db):
+    cursor = db.cursor()
+    cursor.execute(OUTBOX_LAG_SQL)
+    row = cursor.fetchone()
+    return {"pending": int(row["pending"]), "dead": int(row["dead"]), "lag_seconds": float(row["lag_seconds"])}
+
+
+# Due events, oldest first; rows locked by another relay are skipped
+CLAIM_SQL = """
+    SELECT id, event_type, dedupe_key, destination, payload, attempts
+    FROM outbox
+    WHERE delivered_at IS NULL AND dead_at IS NULL AND next_attempt_at <= NOW(3)
+    ORDER BY next_attempt_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+    """
+# Move claimed rows out of the due set for the lease (params: seconds, ids)
+LEASE_SQL = "UPDATE outbox SET next_attempt_at = NOW(3) + INTERVAL %s SECOND WHERE id IN ({})"
+MARK_DELIVERED_SQL = "UPDATE outbox SET delivered_at = NOW(3), attempts = attempts + 1 WHERE id IN ({})"
+RETRY_SQL = """UPDATE outbox SET attempts = %s, last_error = %s, next_attempt_at = NOW(3) + INTERVAL %s SECOND
+               WHERE id = %s"""
+DEAD_LETTER_SQL = "UPDATE outbox SET attempts = %s, last_error = %s, dead_at = NOW(3) WHERE id = %s"
+
+
+class LambdaSink:
+    def __init__(self):
+        self.client = boto3.client("lambda", region_name=LAMBDA_REGION, endpoint_url=LAMBDA_ENDPOINT_URL,
+                                   config=Config(max_pool_connections=16))
+        self.executor = ThreadPoolExecutor(max_workers=16)
+
+    # Lambda has no batch invoke: fan the batch out over a thread pool
+    def deliver(self, target, events):
+        if target in OUTBOX_LAMBDA_BATCH_TARGETS:
+            return self.deliver_batches(target, events)
+
+        def invoke(event):
+            self.client.invoke(FunctionName=target, InvocationType="Event",
+                               Payload=json.dumps(dict(event["payload"], dedupe_key=event["dedupe_key"])))
+            return event["id"]
+        return _collect(self.executor.map(_safe(invoke), events))
+
+    # Batch-aware functions are invoked synchronously with many events at
+    # once; the ones the function reports as failed stay in the outbox and
+    # are retried on their own
+    def deliver_batches(self, target, events):
+        def invoke(batch):
+            try:
+                response = self.client.invoke(
+                    FunctionName=target, InvocationType="RequestResponse",
+                    Payload=json.dumps({"recipients": [dict(event["payload"], dedupe_key=event["dedupe_key"])
+                                                       for event in batch]}))
+                result = json.loads(response["Payload"].read() or "{}")
+                if response.get("FunctionError"):
+                    raise Exception(result.get("errorMessage", response["FunctionError"]))
+                failed = {entry.get("dedupe_key"): entry.get("error", "")
+                          for entry in json.loads(result.get("body", "{}")).get("failed", [])}
+            except Exception as e:
+                failed = {event["dedupe_key"]: str(e) for event in batch}
+            for event in batch:
+                if event["dedupe_key"] in failed:
+                    event["error"] = failed[event["dedupe_key"]]
+            return {event["id"] for event in batch if event["dedupe_key"] not in failed}
+
+        batches = [events[start:start + OUTBOX_LAMBDA_BATCH_SIZE]
+                   for start in range(0, len(events), OUTBOX_LAMBDA_BATCH_SIZE)]
+        delivered = set()
+        for ids in self.executor.map(invoke, batches):
+            delivered |= ids
+        return delivered
+
+
+class SesSink:
+    def __init__(self):
+        self.client = boto3.client("ses", region_name=LAMBDA_REGION)
+
+    def deliver(self, target, events):
+        delivered = set()
+        for event in events:
+            payload = event["payload"]
+            try:
+                self.client.send_email(
+                    Source=OUTBOX_SES_SENDER,
+                    Destination={"ToAddresses": [payload["to"]]},
+                    Message={"Subject": {"Data": payload["subject"], "Charset": "UTF-8"},
+                             "Body": {"Text": {"Data": payload["body"], "Charset": "UTF-8"}}})
+                delivered.add(event["id"])
+            except Exception as e:
+                event["error"] = str(e)
+        return delivered
+
+
+class WebhookSink:
+    # One POST per batch; a 2xx acknowledges every event in it
+    def deliver(self, target, events):
+        body = json.dumps([{"dedupe_key": event["dedupe_key"], "event_type": event["event_type"],
+                            "payload": event["payload"]} for event in events]).encode()
+        request = urllib.request.Request(target, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                if 200 <= response.status < 300:
+                    return {event["id"] for event in events}
+        except Exception as e:
+            for event in events:
+                event["error"] = str(e)
+        return set()
+
+
+def _safe(deliver_one):
+    def wrapper(event):
+        try:
+            return deliver_one(event)
+        except Exception as e:
+            event["error"] = str(e)
+            return None
+    return wrapper
+
+
+def _collect(results):
+    return {result for result in results if result is not None}
+
+
+# Relay process: claims due outbox rows with SELECT ... FOR UPDATE SKIP
+# LOCKED (so several relays can run side by side without double-claiming)
+# and commits the claim as a lease by pushing next_attempt_at past the
+# delivery, so no transaction stays open while events go over the network.
+# The rows are then marked delivered, rescheduled or dead-lettered.
+# Delivery is at-least-once: a relay that dies after delivering but before
+# marking leaves the rows to be delivered again when the lease runs out,
+# with the same dedupe key.
+class OutboxRelay:
+    def __init__(self, pool, batch_size=OUTBOX_BATCH_SIZE, sinks=None, lease_seconds=OUTBOX_LEASE_SECONDS):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.sinks = sinks or {"lambda": LambdaSink(), "ses": SesSink(), "webhook": WebhookSink()}
+        self.stats = {"delivered": 0, "failed": 0, "dead": 0, "batches": 0}
+
+    def claim(self):
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            cursor.execute(CLAIM_SQL, (self.batch_size,))
+            events = cursor.fetchall()
+            if events:
+                cursor.execute(LEASE_SQL.format(", ".join(["%s"] * len(events))),
+                               [self.lease_seconds] + [event["id"] for event in events])
+            db.commit()
+        return events
+
+    def run_once(self):
+        events = self.claim()
+        if not events:
+            return 0
+
+        groups = defaultdict(list)
+        for event in events:
+            event["payload"] = json.loads(event["payload"])
+            groups[event["destination"]].append(event)
+
+        delivered = set()
+        for destination, group in groups.items():
+            kind, _, target = destination.partition(":")
+            sink = self.sinks.get(kind)
+            if sink is None:
+                for event in group:
+                    event["error"] = f"Unknown destination {destination}"
+                continue
+            delivered |= sink.deliver(target, group)
+
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            if delivered:
+                cursor.execute(MARK_DELIVERED_SQL.format(", ".join(["%s"] * len(delivered))), list(delivered))
+            for event in events:
+                if event["id"] in delivered:
+                    continue
+                attempts = event["attempts"] + 1
+                error = event.get("error", "")[:1000]
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    # Give up, but keep the row for inspection
+                    cursor.execute(DEAD_LETTER_SQL, (attempts, error, event["id"]))
+                    self.stats["dead"] += 1
+                else:
+                    # Exponential backoff, capped at 10 minutes
+                    cursor.execute(RETRY_SQL, (attempts, error, min(600, 2 ** attempts), event["id"]))
+                    self.stats["failed"] += 1
+            db.commit()
+
+        self.stats["delivered"] += len(delivered)
+        self.stats["batches"] += 1
+        return len(events)
+
+    # Drop delivered rows past the retention window, a bounded chunk at a time
+    def purge(self):
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""DELETE FROM outbox
+                              WHERE delivered_at IS NOT NULL AND delivered_at < NOW(3) - INTERVAL %s HOUR
+                              LIMIT 10000""", (OUTBOX_RETENTION_HOURS,))
+            db.commit()
+            return cursor.rowcount
+
+    def run(self, interval=OUTBOX_POLL_INTERVAL):
+        logger.info(f"Outbox relay started (batch size {self.batch_size})")
+        last_report = last_purge = time.monotonic()
+        while True:
+            try:
+                handled = self.run_once()
+            except Exception as e:
+                logger.error(f"Error relaying outbox events: {e}")
+                handled = 0
+            now = time.monotonic()
+            if now - last_report >= 60:
+                try:
+                    with self.pool.connection() as db:
+                        lag = outbox_lag(db)
+                    logger.info(f"Outbox relay stats: {self.stats} backlog={lag['pending']} "
+                                f"dead={lag['dead']} lag={lag['lag_seconds']:.1f}s")
+                except Exception as e:
+                    logger.error(f"Error measuring outbox lag: {e}")
+                last_report = now
+            if now - last_purge >= 3600:
+                try:
+                    self.purge()
+                except Exception as e:
+                    logger.error(f"Error purging outbox: {e}")
+                last_purge = now
+            # Keep going without sleeping while there is a backlog
+            if handled < self.batch_size:
+                time.sleep(interval)
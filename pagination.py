@@ -0,0 +1,83 @@
+import os
+import base64
+import binascii
+
+from flask import request, url_for
+
+# Page sizes for the poll lists and the admin tables; ?per_page= can ask for
+# a different size up to MAX_PAGE_SIZE
+POLLS_PAGE_SIZE = int(os.environ.get("POLLS_PAGE_SIZE", 24))
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+
+
+# Page tokens are the last id of the previous page, kept opaque so clients
+# do not start building them by hand
+def encode_page_token(last_id):
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_page_token(token):
+    if not token:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    if not value.startswith("id:") or not value[3:].isdigit():
+        return None
+    return int(value[3:])
+
+
+def page_size(default):
+    return parse_page_size(request.args.get("per_page"), default)
+
+
+def parse_page_size(value, default):
+    try:
+        size = int(value if value is not None else default)
+    except ValueError:
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+# Fetch one keyset page, newest first. `where` is a list of SQL conditions
+# with their parameters; the page position comes from request.args[token_arg].
+# Returns the rows and the token for the next page (None on the last page).
+def fetch_page(cursor, columns, table, where, params, token_arg, size, joins=""):
+    cursor.execute(*page_query(columns, table, where, params, decode_page_token(request.args.get(token_arg)), size,
+                               joins))
+    return page_result(cursor.fetchall(), size)
+
+
+# The (sql, params) of one keyset page; asgi_app.py runs it on aiomysql.
+# `joins` is appended to the FROM clause (e.g. to fetch the author's email).
+def page_query(columns, table, where, params, after_id, size, joins=""):
+    conditions = list(where)
+    params = list(params)
+    if after_id is not None:
+        conditions.append(f"{table}.id < %s")
+        params.append(after_id)
+    from_sql = f"{table} {joins}" if joins else table
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # One extra row tells us whether there is a next page
+    return f"SELECT {columns} FROM {from_sql} {where_sql} ORDER BY {table}.id DESC LIMIT %s", params + [size + 1]
+
+
+def page_result(rows, size):
+    if len(rows) > size:
+        return rows[:size], encode_page_token(rows[size - 1]["id"])
+    return rows, None
+
+
+# url_for arguments of the current page with one page token replaced. Query
+# keys that collide with the route's own arguments are dropped: the path
+# wins, and a crafted query string cannot break the link.
+def page_url_args(query_args, view_args, token_arg, token):
+    args = {key: value for key, value in query_args.items() if key not in view_args}
+    return {**args, **view_args, token_arg: token}
+
+
+# URL of the current page with one page token replaced, for "next" links
+def page_url(token_arg, token):
+    return url_for(request.endpoint, **page_url_args(request.args.to_dict(), request.view_args, token_arg, token))
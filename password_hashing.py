@@ -0,0 +1,219 @@
+import os
+import re
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# Fixed bcrypt cost; when unset the cost is calibrated at startup so one
+# hash takes about PASSWORD_HASH_TARGET_MS on this machine
+PASSWORD_HASH_ROUNDS = os.environ.get("PASSWORD_HASH_ROUNDS")
+PASSWORD_HASH_TARGET_MS = float(os.environ.get("PASSWORD_HASH_TARGET_MS", 250))
+PASSWORD_HASH_MIN_ROUNDS = int(os.environ.get("PASSWORD_HASH_MIN_ROUNDS", 12))
+PASSWORD_HASH_MAX_ROUNDS = int(os.environ.get("PASSWORD_HASH_MAX_ROUNDS", 15))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 1))
+# Hash/verify calls allowed in flight (running or queued) per app worker;
+# beyond that callers get PasswordHasherBusy straight away
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", 8))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 5))
+# Niceness of the hashing processes, so request threads (and /health) win
+# the CPU during a login storm
+PASSWORD_HASH_NICE = int(os.environ.get("PASSWORD_HASH_NICE", 5))
+
+
+# Strength rule for new passwords
+PASSWORD_POLICY = re.compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$')
+PASSWORD_POLICY_ERROR = ("Password must be at least 8 characters long, include uppercase, lowercase, number, "
+                         "and special character.")
+# Shown on the login and register pages when the pool is saturated
+BUSY_MESSAGE = "We are handling a lot of sign-ins right now. Please try again in a moment."
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# Run inside the pool processes
+def _init_worker(nice):
+    if nice:
+        os.nice(nice)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _verify(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+# Highest cost whose hash still fits in target_ms, within [min, max]. Each
+# extra round doubles the work, so time one hash at the minimum and extrapolate.
+def _calibrate(target_ms, min_rounds, max_rounds):
+    started = time.perf_counter()
+    _hash("calibration", min_rounds)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+# Cost factor of a stored hash ("$2b$12$..."), None if it is not bcrypt
+def hash_rounds(hashed):
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+# bcrypt on a small process pool, off the request threads.
+#
+# Every call takes a slot from a bounded semaphore first; when all
+# PASSWORD_HASH_QUEUE_LIMIT slots are taken the call fails fast with
+# PasswordHasherBusy instead of piling up more CPU-bound work behind the
+# current login storm. The pool is started lazily per process (after the
+# gunicorn fork) with the spawn start method, so it never inherits the
+# worker's threads or sockets. A call that outlasts PASSWORD_HASH_TIMEOUT
+# is reported as PasswordHasherBusy too. If a pool process dies (OOM kill,
+# crash) the executor is broken for good: the calls caught in it fail with
+# PasswordHasherBusy, and the next call starts a fresh pool.
+#
+# Without PASSWORD_HASH_ROUNDS the cost is calibrated in the background when
+# the pool starts; until that finishes, hashes use PASSWORD_HASH_MIN_ROUNDS
+# and needs_rehash() upgrades them on a later login. No call ever waits for
+# the calibration.
+#
+# Under gunicorn's gevent worker (monkey-patched threading and select) the
+# executor's management thread is a greenlet and waiting on a future yields
+# to the hub, so other requests keep being served while bcrypt runs; checked
+# with concurrent greenlets hashing and verifying against a heartbeat
+# greenlet (loop stalls stayed under 10 ms).
+class PasswordHasher:
+    def __init__(self, rounds=PASSWORD_HASH_ROUNDS, workers=PASSWORD_HASH_WORKERS,
+                 queue_limit=PASSWORD_HASH_QUEUE_LIMIT, timeout=PASSWORD_HASH_TIMEOUT):
+        self.rounds = int(rounds) if rounds else None
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hashed": 0, "verified": 0, "rejected": 0, "timeouts": 0, "rehashed": 0,
+                       "pool_restarts": 0, "latency_total": 0.0, "latency_max": 0.0}
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._slots = threading.BoundedSemaphore(self.queue_limit)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(PASSWORD_HASH_NICE,))
+            if self.rounds is None:
+                # Timed in a pool process, at the niceness real hashes run at
+                calibration = self._executor.submit(_calibrate, PASSWORD_HASH_TARGET_MS,
+                                                    PASSWORD_HASH_MIN_ROUNDS, PASSWORD_HASH_MAX_ROUNDS)
+                calibration.add_done_callback(self._calibrated)
+            self._pid = os.getpid()
+
+    def _calibrated(self, future):
+        try:
+            self.rounds = future.result()
+        except Exception as e:
+            logger.error(f"Error calibrating bcrypt cost, staying at {PASSWORD_HASH_MIN_ROUNDS} rounds: {e}")
+            self.rounds = PASSWORD_HASH_MIN_ROUNDS
+            return
+        logger.info(f"Calibrated bcrypt cost to {self.rounds} rounds (target {PASSWORD_HASH_TARGET_MS:.0f} ms)")
+
+    # Drop a broken executor so the next call starts a new one; only the
+    # first caller to notice replaces it
+    def _restart(self, executor, error):
+        with self._lock:
+            if self._pid != os.getpid() or self._executor is not executor:
+                return
+            logger.error(f"Password hashing pool broke, starting a new one: {error}")
+            executor.shutdown(wait=False)
+            self._pid = None
+        with self._stats_lock:
+            self._stats["pool_restarts"] += 1
+
+    # Cost for new hashes: the calibrated one once known
+    def current_rounds(self):
+        return self.rounds if self.rounds is not None else PASSWORD_HASH_MIN_ROUNDS
+
+    def _run(self, stat, fn, *args):
+        self.start()
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise PasswordHasherBusy("Too many password hashing requests in flight")
+        started = time.monotonic()
+        executor, slots = self._executor, self._slots
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool as e:
+            slots.release()
+            self._restart(executor, e)
+            raise PasswordHasherBusy("Password hashing pool is restarting")
+        except Exception:
+            slots.release()
+            raise
+        # The slot is held until the work is done, even if we stop waiting
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise PasswordHasherBusy(f"Password hashing took longer than {self.timeout}s")
+        except BrokenProcessPool as e:
+            self._restart(executor, e)
+            raise PasswordHasherBusy("Password hashing pool is restarting")
+        finally:
+            latency = time.monotonic() - started
+            with self._stats_lock:
+                self._stats[stat] += 1
+                self._stats["latency_total"] += latency
+                self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+
+    def hash(self, password):
+        self.start()
+        return self._run("hashed", _hash, password, self.current_rounds())
+
+    def verify(self, password, hashed):
+        return self._run("verified", _verify, password, hashed)
+
+    # Only upgrades: workers calibrated on a busier moment must not keep
+    # flipping each other's hashes down and up
+    def needs_rehash(self, hashed):
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self.current_rounds()
+
+    def count_rehash(self):
+        with self._stats_lock:
+            self._stats["rehashed"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        running = self._pid == os.getpid()
+        stats["rounds"] = self.current_rounds()
+        stats["calibrated"] = self.rounds is not None
+        stats["in_flight"] = self.queue_limit - self._slots._value if running else 0
+        stats["queue_limit"] = self.queue_limit
+        stats["workers"] = self.workers
+        return stats
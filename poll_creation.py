@@ -0,0 +1,58 @@
+import os
+
+# Limits for a single poll and for one bulk request
+MIN_POLL_OPTIONS = int(os.environ.get("MIN_POLL_OPTIONS", 2))
+MAX_POLL_OPTIONS = int(os.environ.get("MAX_POLL_OPTIONS", 200))
+MAX_POLL_LENGTH = int(os.environ.get("MAX_POLL_LENGTH", 1000))
+MAX_OPTION_LENGTH = int(os.environ.get("MAX_OPTION_LENGTH", 255))
+MAX_BULK_POLLS = int(os.environ.get("MAX_BULK_POLLS", 500))
+
+INSERT_POLL_SQL = "INSERT INTO polls (poll, creator_id) VALUES (%s, %s)"
+INSERT_OPTIONS_SQL = "INSERT INTO options (poll_id, option_text) VALUES (%s, %s)"
+
+
+class PollValidationError(ValueError):
+    pass
+
+
+# Normalise and check a poll before anything touches the database. Returns
+# the cleaned (question, options).
+def validate_poll(question, options):
+    if not isinstance(question, str) or not isinstance(options, (list, tuple)):
+        raise PollValidationError("A poll needs a question and a list of options.")
+    question = question.strip()
+    options = [option.strip() for option in options if isinstance(option, str) and option.strip()]
+    if not question:
+        raise PollValidationError("The poll question cannot be empty.")
+    if len(question) > MAX_POLL_LENGTH:
+        raise PollValidationError(f"The poll question must be at most {MAX_POLL_LENGTH} characters.")
+    if len(options) < MIN_POLL_OPTIONS:
+        raise PollValidationError(f"A poll needs at least {MIN_POLL_OPTIONS} options.")
+    if len(options) > MAX_POLL_OPTIONS:
+        raise PollValidationError(f"A poll can have at most {MAX_POLL_OPTIONS} options.")
+    for option in options:
+        if len(option) > MAX_OPTION_LENGTH:
+            raise PollValidationError(f"Options must be at most {MAX_OPTION_LENGTH} characters.")
+    return question, options
+
+
+# Insert already validated polls, given as [(question, options), ...], in
+# the caller's transaction. Each poll costs one INSERT for its row; all the
+# options of all the polls go in a single multi-row INSERT. Returns the new
+# poll ids in input order.
+#
+# Poll ids are taken from lastrowid one poll at a time: with
+# innodb_autoinc_lock_mode=2 (the MySQL 8 default) a multi-row INSERT is
+# not guaranteed consecutive ids, so they cannot be inferred.
+def insert_polls(cursor, creator_id, polls):
+    poll_ids = []
+    option_rows = []
+    for question, options in polls:
+        cursor.execute(INSERT_POLL_SQL, (question, creator_id))
+        poll_id = cursor.lastrowid
+        poll_ids.append(poll_id)
+        option_rows.extend((poll_id, option) for option in options)
+    if option_rows:
+        # pymysql rewrites executemany on INSERT ... VALUES into one statement
+        cursor.executemany(INSERT_OPTIONS_SQL, option_rows)
+    return poll_ids
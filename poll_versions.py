@@ -0,0 +1,148 @@
+import os
+import mmap
+import fcntl
+import struct
+import secrets
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+POLL_VERSIONS_BACKEND = os.environ.get("POLL_VERSIONS_BACKEND", "local")
+POLL_VERSIONS_PATH = os.environ.get(
+    "POLL_VERSIONS_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "poll_versions"))
+POLL_VERSIONS_SLOTS = int(os.environ.get("POLL_VERSIONS_SLOTS", 65536))
+
+# Version key for the poll list itself (created/deleted polls); poll ids start at 1
+POLL_LIST = 0
+
+COUNTER = struct.Struct("<Q")
+
+
+# Per-poll change counters shared by the gunicorn workers of one instance:
+# a fixed array of uint64 in a file under /dev/shm, indexed by poll id
+# modulo the slot count. Two polls sharing a slot only cost each other an
+# extra 200; a change is never missed. Increments hold an flock so
+# concurrent bumps from different workers cannot collapse into one.
+#
+# version() returns "<epoch>.<counter>". The epoch is random and changes
+# whenever the file is recreated, so counters restarting at 0 after a
+# reboot never revive an old ETag.
+#
+# The counters only see writes made on this instance. With several app
+# instances behind the ALB use the redis backend.
+class LocalPollVersions:
+    def __init__(self, path=POLL_VERSIONS_PATH, slots=POLL_VERSIONS_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+
+    # Opened per process: flock locks belong to the open file, so a
+    # descriptor inherited across the gunicorn fork would not exclude the
+    # other workers
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        size = (self.slots + 1) * COUNTER.size
+        fd = self._open_sized(size)
+        if fd is None:
+            self._create(size)
+            fd = self._open_sized(size)
+        self._fd = fd
+        self._mm = mmap.mmap(self._fd, size)
+        self.epoch = COUNTER.unpack_from(self._mm, 0)[0]
+        self._pid = os.getpid()
+
+    # The counters file if it exists with the expected size, else None
+    def _open_sized(self, size):
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        if os.fstat(fd).st_size != size:
+            os.close(fd)
+            return None
+        return fd
+
+    # The file is never resized in place: other workers may have it mapped,
+    # and touching a page past the end of a truncated file raises SIGBUS. A
+    # missing file, or one sized for another slot count, is replaced by a
+    # complete new one (with a fresh epoch) renamed into place; processes
+    # still mapping the old one keep a valid, if orphaned, mapping.
+    def _create(self, size):
+        lock_fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            fd = self._open_sized(size)
+            if fd is not None:
+                # Another worker created it while this one waited
+                os.close(fd)
+                return
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                             prefix=f"{os.path.basename(self.path)}.")
+            try:
+                os.fchmod(fd, 0o644)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, COUNTER.pack(secrets.randbits(63) + 1), 0)
+            finally:
+                os.close(fd)
+            os.replace(temp_path, self.path)
+            logger.info(f"Created poll versions file {self.path} with {self.slots} slots")
+        finally:
+            os.close(lock_fd)
+
+    def _offset(self, key):
+        return (1 + key % self.slots) * COUNTER.size
+
+    def version(self, key):
+        self._open()
+        return f"{self.epoch:x}.{COUNTER.unpack_from(self._mm, self._offset(key))[0]}"
+
+    def bump(self, key):
+        self._open()
+        offset = self._offset(key)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            version = COUNTER.unpack_from(self._mm, offset)[0] + 1
+            COUNTER.pack_into(self._mm, offset, version)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return version
+
+
+# Shared counters for several instances: one Redis key per poll
+class RedisPollVersions:
+    def __init__(self, url, prefix="poll_version:"):
+        # Optional dependency, only needed for the shared backend
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    # Read together with a random epoch key, so a flushed Redis (counters
+    # back at 0) does not revive old ETags
+    def version(self, key):
+        try:
+            epoch, value = self.client.mget(f"{self.prefix}epoch", f"{self.prefix}{key}")
+            if epoch is None:
+                self.client.set(f"{self.prefix}epoch", f"{secrets.randbits(63) + 1:x}", nx=True)
+                return None
+        except Exception as e:
+            logger.error(f"Error reading poll version: {e}")
+            return None
+        return f"{epoch.decode()}.{int(value or 0)}"
+
+    def bump(self, key):
+        try:
+            return self.client.incr(f"{self.prefix}{key}")
+        except Exception as e:
+            logger.error(f"Error bumping poll version: {e}")
+            return None
+
+
+def poll_versions_from_env():
+    if POLL_VERSIONS_BACKEND == "local":
+        return LocalPollVersions()
+    if POLL_VERSIONS_BACKEND == "redis":
+        return RedisPollVersions(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown POLL_VERSIONS_BACKEND: {POLL_VERSIONS_BACKEND}")
@@ -203,6 +203,13 @@ key_pair = aws.ec2.KeyPair("deployer_key",
 app_bucket = aws.s3.Bucket("app_bucket",
     bucket=s3_bucket_name,
     tags={"Name": "AppBucket"},
+    # Browsers upload straight to the bucket with presigned POSTs
+    cors_rules=[aws.s3.BucketCorsRuleArgs(
+        allowed_methods=["POST"],
+        allowed_origins=["*"],
+        allowed_headers=["*"],
+        max_age_seconds=3000,
+    )],
     opts=pulumi.ResourceOptions(provider=aws_provider)
 )
 
@@ -267,7 +274,7 @@ if ! command -v pip3 &> /dev/null; then
   python3 get-pip.py
 fi
 pip3 install --upgrade pip
-pip3 install flask pymysql bcrypt gunicorn boto3 flask-session flask-bcrypt python-dotenv
+pip3 install flask pymysql bcrypt gunicorn gevent boto3 flask-session flask-bcrypt python-dotenv
 
 # Install AWS CLI
 if ! command -v aws &> /dev/null; then
@@ -292,8 +299,26 @@ export SECRET_KEY=your_secret_key
 export S3_BUCKET={s3_bucket_name}
 export AWS_DEFAULT_REGION={aws_region}
 
-# Start the application using Gunicorn
-gunicorn --workers 3 --bind 0.0.0.0:80 app:app &
+# Apply pending database schema migrations
+FLASK_APP=app flask db upgrade
+
+# Start the results snapshot updater shared by the Gunicorn workers
+FLASK_APP=app flask results-snapshot &
+
+# Start the outbox relay that delivers registration side effects
+FLASK_APP=app flask outbox-relay &
+
+# Start the application: Gunicorn with gevent workers (open live result
+# streams wait as greenlets instead of holding a thread each), or the async
+# variant on Hypercorn with APP_SERVER=asgi
+export APP_SERVER=sync
+if [ "$APP_SERVER" = "asgi" ]; then
+  # The async stack is only installed where the async variant runs
+  pip3 install quart aiomysql aioboto3 hypercorn
+  hypercorn --workers 3 --bind 0.0.0.0:80 asgi_app:app &
+else
+  gunicorn --workers 3 --worker-class gevent --worker-connections 1000 --bind 0.0.0.0:80 app:app &
+fi
 
 echo "Application started successfully."
 """
@@ -385,7 +410,8 @@ lambda_ses_policy = aws.iam.Policy("lambda_ses_policy",
             "Effect": "Allow",
             "Action": [
                 "ses:SendEmail",
-                "ses:SendRawEmail"
+                "ses:SendRawEmail",
+                "ses:SendBulkTemplatedEmail"
             ],
             "Resource": "*"
         }]
@@ -428,6 +454,14 @@ lambda_basic_execution = aws.iam.RolePolicyAttachment("lambda_basic_execution",
     policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
 )
 
+# Template for batched welcome emails (SendBulkTemplatedEmail)
+welcome_email_template = aws.ses.Template("welcome_email",
+    name="welcome_email",
+    subject="Welcome to Our Service!",
+    text="Hello,\n\nWelcome to our service. We are glad to have you!",
+    html="<html><head></head><body><h1>Hello!</h1><p>Welcome to our service. We are glad to have you!</p></body></html>"
+)
+
 # Lambda Functions
 welcome_email_function = aws.lambda_.Function("welcome_email_function",
     function_name="welcome_email_function",
@@ -436,7 +470,7 @@ welcome_email_function = aws.lambda_.Function("welcome_email_function",
     runtime="python3.9",
     code=pulumi.FileArchive("lambda_function.zip"),
     environment=aws.lambda_.FunctionEnvironmentArgs(
-        variables={"SENDER_EMAIL": sender_email}
+        variables={"SENDER_EMAIL": sender_email, "SES_TEMPLATE_NAME": welcome_email_template.name}
     ),
     opts=pulumi.ResourceOptions(
         depends_on=[lambda_ses_policy_attachment, lambda_basic_execution]
@@ -457,6 +491,26 @@ csv_handler_function = aws.lambda_.Function("csv_handler_function",
     )
 )
 
+# Nightly compaction of registration counter deltas into registration_data.csv
+registration_compaction_rule = aws.cloudwatch.EventRule("registration_compaction",
+    name="registration_compaction",
+    schedule_expression="cron(15 0 * * ? *)"
+)
+
+registration_compaction_target = aws.cloudwatch.EventTarget("registration_compaction",
+    rule=registration_compaction_rule.name,
+    arn=csv_handler_function.arn,
+    input=json.dumps({"action": "compact"})
+)
+
+registration_compaction_permission = aws.lambda_.Permission("registration_compaction",
+    statement_id="AllowRegistrationCompaction",
+    action="lambda:InvokeFunction",
+    function=csv_handler_function.name,
+    principal="events.amazonaws.com",
+    source_arn=registration_compaction_rule.arn
+)
+
 # IAM Policy for EC2 to Invoke Lambda
 ec2_lambda_invoke_policy = pulumi.Output.all(
     welcome_email_function.arn, csv_handler_function.arn
@@ -0,0 +1,33 @@
+# SQL issued by the routes, shared by the Flask app (app.py) and its async
+# variant (asgi_app.py) so the two cannot drift apart. query_plans.py
+# EXPLAINs these as well.
+
+USER_BY_EMAIL_SQL = "SELECT * FROM users WHERE email = %s"
+INSERT_USER_SQL = "INSERT INTO users (email, password) VALUES (%s, %s)"
+REHASH_PASSWORD_SQL = "UPDATE users SET password = %s WHERE id = %s AND password = %s"
+DELETE_USER_SQL = "DELETE FROM users WHERE id = %s"
+
+POLL_SQL = "SELECT * FROM polls WHERE id = %s"
+API_POLL_SQL = "SELECT id, poll FROM polls WHERE id = %s"
+DELETE_POLL_SQL = "DELETE FROM polls WHERE id = %s"
+DELETE_POLL_OPTIONS_SQL = "DELETE FROM options WHERE poll_id = %s"
+# Options without counts, for polls whose counts come from the results snapshot
+POLL_OPTIONS_SQL = "SELECT id, poll_id, option_text FROM options WHERE poll_id = %s"
+
+USER_VOTE_SQL = "SELECT * FROM votes WHERE poll_id = %s AND user_id = %s"
+INSERT_VOTE_SQL = "INSERT INTO votes (poll_id, user_id, option_id) VALUES (%s, %s, %s)"
+# Vote only if the option belongs to the poll: no row is inserted otherwise
+CAST_VOTE_SQL = """
+    INSERT INTO votes (poll_id, user_id, option_id)
+    SELECT options.poll_id, %s, options.id FROM options WHERE options.id = %s AND options.poll_id = %s
+    """
+# Buffered votes: has the user voted, and does the option belong to the poll
+BUFFERED_VOTE_CHECK_SQL = """
+    SELECT EXISTS(SELECT 1 FROM votes WHERE poll_id = %s AND user_id = %s) AS has_voted,
+           options.id AS option_id, options.poll_id
+    FROM (SELECT 1) AS probe
+    LEFT JOIN options ON options.id = %s AND options.poll_id = %s
+    """
+
+INSERT_COMMENT_SQL = "INSERT INTO comments (poll_id, user_id, comment) VALUES (%s, %s, %s)"
+INSERT_REPLY_SQL = "INSERT INTO comments (poll_id, user_id, comment, parent_comment_id) VALUES (%s, %s, %s, %s)"
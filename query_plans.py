@@ -0,0 +1,125 @@
+import random
+import logging
+
+from authz import ROLE_SQL, SET_ADMIN_SQL
+from comment_threads import COUNT_REPLY_SQL, thread_replies_query, top_level_page_query
+from exports import EXPORTS, export_query
+from outbox import CLAIM_SQL, DEAD_LETTER_SQL, LEASE_SQL, MARK_DELIVERED_SQL, OUTBOX_LAG_SQL, RETRY_SQL
+from pagination import page_query
+from queries import (API_POLL_SQL, BUFFERED_VOTE_CHECK_SQL, CAST_VOTE_SQL, DELETE_POLL_OPTIONS_SQL, DELETE_POLL_SQL,
+                     DELETE_USER_SQL, POLL_OPTIONS_SQL, POLL_SQL, REHASH_PASSWORD_SQL, USER_BY_EMAIL_SQL,
+                     USER_VOTE_SQL)
+from results_snapshot import RECENT_VOTES_SQL, hot_options_query
+from session_store import SESSION_DELETE_SQL, SESSION_LOAD_SQL, SESSION_SWEEP_SQL
+from uploads import COMPLETE_UPLOAD_SQL, REJECT_UPLOAD_SQL, UPLOAD_BY_KEY_SQL
+from vote_counters import (GUARDED_INCREMENT_SQL, INCREMENT_VOTES_SQL, OPTIONS_WITH_VOTES_SQL, ROLLUP_OPTIONS_SQL,
+                           ROLLUP_SHARDS_SQL)
+
+logger = logging.getLogger(__name__)
+
+# Every query the app issues, with representative parameters, built from the
+# same constants and query builders the app runs: `flask check-query-plans`
+# EXPLAINs each entry and fails on full table scans and filesorts unless the
+# entry explicitly allows them.
+#
+# (name, sql, params, allowed) where allowed is a subset of
+# {"full_scan", "filesort"}.
+QUERIES = [
+    ("authz.role", ROLE_SQL, (1,), set()),
+    ("authz.set_admin", SET_ADMIN_SQL, (0, 0), set()),
+    ("login", USER_BY_EMAIL_SQL, ("user1@example.com",), set()),
+    ("login.rehash", REHASH_PASSWORD_SQL, ("x", 1, "x"), set()),
+    ("index.polls", *page_query("*", "polls", [], [], None, 24), set()),
+    ("index.polls.next_page", *page_query("*", "polls", [], [], 500, 24), set()),
+    ("index.my_polls", *page_query("*", "polls", ["creator_id = %s"], [1], None, 24), set()),
+    ("index.my_polls.next_page", *page_query("*", "polls", ["creator_id = %s"], [1], 500, 24), set()),
+    ("admin.users", *page_query("id, email, is_admin", "users", [], [], None, 50), set()),
+    ("admin.users.next_page", *page_query("id, email, is_admin", "users", [], [], 500, 50), set()),
+    ("polls.poll", POLL_SQL, (1,), set()),
+    ("api.results.poll", API_POLL_SQL, (1,), set()),
+    ("api.polls", *page_query("id, poll, creator_id", "polls", [], [], None, 25), set()),
+    ("polls.options", OPTIONS_WITH_VOTES_SQL, (1,), set()),
+    ("polls.option_texts", POLL_OPTIONS_SQL, (1,), set()),
+    ("polls.comments", *top_level_page_query(1, None), set()),
+    ("polls.comments.next_page", *top_level_page_query(1, 500), set()),
+    # The recursive CTE scans and sorts its own (one thread's) rows; every
+    # step down the thread reaches comments by the parent_comment_id index
+    ("comment_replies", *thread_replies_query(1, 1), {"full_scan", "filesort"}),
+    ("add_reply.count", COUNT_REPLY_SQL, (1, 1), set()),
+    ("polls.has_voted", USER_VOTE_SQL, (1, 1), set()),
+    ("vote.cast", CAST_VOTE_SQL, (1, 1, 1), set()),
+    ("vote.guarded_increment", GUARDED_INCREMENT_SQL, (1, 1), set()),
+    ("vote.increment", INCREMENT_VOTES_SQL, (1, 1), set()),
+    ("vote.buffered_check", BUFFERED_VOTE_CHECK_SQL, (1, 1, 1, 1), set()),
+    ("delete_poll.polls", DELETE_POLL_SQL, (0,), set()),
+    ("delete_poll.options", DELETE_POLL_OPTIONS_SQL, (0,), set()),
+    ("delete_user", DELETE_USER_SQL, (0,), set()),
+    # The shard table only holds recent, not yet rolled up increments
+    ("rollup.options", ROLLUP_OPTIONS_SQL, (1000,), {"full_scan"}),
+    ("rollup.shards", ROLLUP_SHARDS_SQL, (1,), set()),
+    ("outbox.claim", CLAIM_SQL, (100,), set()),
+    ("outbox.lease", LEASE_SQL.format("%s, %s"), (120, 1, 2), set()),
+    ("outbox.delivered", MARK_DELIVERED_SQL.format("%s, %s"), (1, 2), set()),
+    ("outbox.retry", RETRY_SQL, (1, "x", 2, 1), set()),
+    ("outbox.dead_letter", DEAD_LETTER_SQL, (1, "x", 1), set()),
+    ("outbox.lag", OUTBOX_LAG_SQL, (), set()),
+    ("sessions.load", SESSION_LOAD_SQL, ("x",), set()),
+    ("sessions.delete", SESSION_DELETE_SQL, ("x",), set()),
+    ("sessions.sweep", SESSION_SWEEP_SQL, (1000,), set()),
+    ("uploads.complete", UPLOAD_BY_KEY_SQL, ("uploads/1/x/a.png", 1), set()),
+    ("uploads.mark_complete", COMPLETE_UPLOAD_SQL, (1, "x", 1), set()),
+    ("uploads.reject", REJECT_UPLOAD_SQL, (1,), set()),
+    ("snapshot.recent_votes", RECENT_VOTES_SQL, (0, 50000), set()),
+    ("snapshot.options", *hot_options_query([1, 2, 3]), set()),
+]
+# Admin exports: a whole table reads it in primary key order, a resumed
+# export is a primary key range
+QUERIES += [(f"export.{name}", *export_query(name), {"full_scan"}) for name in EXPORTS]
+QUERIES += [(f"export.{name}.resume", *export_query(name, 500, 1000), set()) for name in EXPORTS]
+
+
+# EXPLAIN every catalogued query. Returns a list of (name, problem, plan row).
+# MySQL 8 reports the target table of an INSERT as a row of its own with
+# type ALL although nothing is scanned, so that row is not checked.
+def check_query_plans(db, queries=QUERIES):
+    cursor = db.cursor()
+    failures = []
+    for name, sql, params, allowed in queries:
+        cursor.execute("EXPLAIN " + sql, params)
+        for row in cursor.fetchall():
+            extra = row.get("Extra") or ""
+            if row.get("type") == "ALL" and row.get("select_type") != "INSERT" and "full_scan" not in allowed:
+                failures.append((name, f"full table scan on {row.get('table')}", row))
+            if "Using filesort" in extra and "filesort" not in allowed:
+                failures.append((name, f"filesort on {row.get('table')}", row))
+    db.rollback()
+    return failures
+
+
+# Fill an empty scratch database with enough rows that the optimizer plans
+# as it would in production (on tiny tables it happily scans everything)
+def seed_plan_data(db, users=2000, polls=500, options_per_poll=4, comments_per_poll=5):
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO users (email, password, is_admin) VALUES (%s, %s, %s)",
+                       [(f"user{i}@example.com", "x", 1 if i % 100 == 0 else 0) for i in range(1, users + 1)])
+    cursor.execute("SELECT MIN(id) AS first_id FROM users")
+    first_user = cursor.fetchone()["first_id"]
+    cursor.executemany("INSERT INTO polls (poll, creator_id) VALUES (%s, %s)",
+                       [(f"Poll {i}", first_user + random.randrange(users)) for i in range(polls)])
+    cursor.execute("SELECT id FROM polls")
+    poll_ids = [row["id"] for row in cursor.fetchall()]
+    cursor.executemany("INSERT INTO options (poll_id, option_text) VALUES (%s, %s)",
+                       [(poll_id, f"Option {n}") for poll_id in poll_ids for n in range(options_per_poll)])
+    cursor.executemany("INSERT INTO comments (poll_id, user_id, comment) VALUES (%s, %s, %s)",
+                       [(poll_id, first_user + random.randrange(users), "Comment")
+                        for poll_id in poll_ids for _ in range(comments_per_poll)])
+    cursor.execute("""
+        INSERT IGNORE INTO votes (poll_id, user_id, option_id)
+        SELECT options.poll_id, users.id, options.id
+        FROM options JOIN users ON users.id % 7 = options.id % 7
+        LIMIT 20000
+        """)
+    db.commit()
+    for table in ("users", "polls", "options", "comments", "votes", "option_vote_shards", "sessions"):
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
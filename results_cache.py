@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import logging
+import threading
+from decimal import Decimal
+from datetime import datetime
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# In-process results cache: TTL on every entry plus LRU eviction once
+# max_entries is reached. Each gunicorn worker holds its own copy, so an
+# invalidation in one worker only reaches the others through the TTL.
+# get() hands out the stored dict itself, so entries are never changed in
+# place: apply_vote swaps in a patched copy while other requests may still
+# be rendering the old one.
+class LocalResultsCache:
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                       "invalidations": 0, "deltas": 0}
+
+    def get(self, poll_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(poll_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, results = entry
+            if expires_at <= now:
+                del self._entries[poll_id]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(poll_id)
+            self._stats["hits"] += 1
+            return results
+
+    def set(self, poll_id, results):
+        with self._lock:
+            self._entries[poll_id] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(poll_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, poll_id):
+        with self._lock:
+            if self._entries.pop(poll_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    # Apply a vote to a cached entry (copy-on-write) instead of dropping it
+    def apply_vote(self, poll_id, option_id, n=1):
+        with self._lock:
+            entry = self._entries.get(poll_id)
+            if entry is None:
+                return
+            expires_at, results = entry
+            options = results["options"]
+            for index, option in enumerate(options):
+                if option["id"] == option_id:
+                    options = options[:index] + [dict(option, votes=option["votes"] + n)] + options[index + 1:]
+                    self._entries[poll_id] = (expires_at, dict(results, options=options))
+                    self._stats["deltas"] += 1
+                    return
+            # Unknown option: the cached entry is out of date
+            del self._entries[poll_id]
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(backend="local", entries=len(self._entries), max_entries=self.max_entries, ttl=self.ttl)
+        return stats
+
+
+# Entries are stored in Redis as JSON, never pickled: whoever can write to
+# the Redis must not be able to run code in the app. Rows only hold
+# strings, numbers, datetimes (comment times) and Decimals (summed counts).
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Cannot cache {type(value).__name__}")
+
+
+def _json_object(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+# Shared results cache in Redis. Every worker (and every instance pointed at
+# the same Redis) sees an invalidation as soon as it happens. Redis handles
+# TTL expiry and, with maxmemory-policy allkeys-lru, LRU eviction. The
+# prefix carries a version: change it whenever the cached dict changes shape.
+class RedisResultsCache:
+    def __init__(self, url, ttl=30.0, prefix="poll_results:v3:"):
+        # Optional dependency, only needed for the shared backend
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, poll_id):
+        try:
+            data = self.client.get(f"{self.prefix}{poll_id}")
+        except Exception as e:
+            logger.error(f"Error reading results cache: {e}")
+            self._count("errors")
+            return None
+        if data is None:
+            self._count("misses")
+            return None
+        try:
+            results = json.loads(data, object_hook=_json_object)
+        except ValueError as e:
+            logger.error(f"Dropping unreadable results cache entry for poll {poll_id}: {e}")
+            self._count("errors")
+            return None
+        self._count("hits")
+        return results
+
+    def set(self, poll_id, results):
+        try:
+            self.client.set(f"{self.prefix}{poll_id}", json.dumps(results, default=_json_default),
+                            px=int(self.ttl * 1000))
+        except Exception as e:
+            logger.error(f"Error writing results cache: {e}")
+            self._count("errors")
+
+    def invalidate(self, poll_id):
+        try:
+            self.client.delete(f"{self.prefix}{poll_id}")
+            self._count("invalidations")
+        except Exception as e:
+            logger.error(f"Error invalidating results cache: {e}")
+            self._count("errors")
+
+    # Patching a stored entry would need a read-modify-write round trip,
+    # dropping it is cheaper and just as correct
+    def apply_vote(self, poll_id, option_id, n=1):
+        self.invalidate(poll_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(backend="redis", ttl=self.ttl)
+        try:
+            info = self.client.info("stats")
+            stats.update(evictions=info.get("evicted_keys", 0), expirations=info.get("expired_keys", 0))
+        except Exception:
+            pass
+        return stats
+
+
+# Cache that never stores anything, for RESULTS_CACHE_BACKEND=none
+class NullResultsCache:
+    def get(self, poll_id):
+        return None
+
+    def set(self, poll_id, results):
+        pass
+
+    def invalidate(self, poll_id):
+        pass
+
+    def apply_vote(self, poll_id, option_id, n=1):
+        pass
+
+    def stats(self):
+        return {"backend": "none"}
+
+
+# Shared Redis cache when REDIS_URL is set, otherwise no cache: a per-worker
+# cache only sees its own worker's writes, so the redirect after a vote,
+# comment or poll deletion would often land on a worker still showing the
+# old page. RESULTS_CACHE_BACKEND=local opts into that staleness (up to
+# RESULTS_CACHE_TTL) explicitly.
+def results_cache_from_env():
+    backend = os.environ.get("RESULTS_CACHE_BACKEND", "redis" if os.environ.get("REDIS_URL") else "none")
+    ttl = float(os.environ.get("RESULTS_CACHE_TTL", 30))
+    if backend == "local":
+        return LocalResultsCache(ttl=ttl, max_entries=int(os.environ.get("RESULTS_CACHE_MAX_ENTRIES", 1024)))
+    if backend == "redis":
+        return RedisResultsCache(os.environ.get("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl)
+    if backend == "none":
+        return NullResultsCache()
+    raise ValueError(f"Unknown RESULTS_CACHE_BACKEND: {backend}")
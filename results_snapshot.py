@@ -0,0 +1,283 @@
+import os
+import mmap
+import time
+import struct
+import logging
+import tempfile
+
+from vote_counters import OPTION_VOTES_SQL
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.environ.get(
+    "RESULTS_SNAPSHOT_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "poll_results.snapshot"))
+SNAPSHOT_POLLS = int(os.environ.get("RESULTS_SNAPSHOT_POLLS", 256))
+SNAPSHOT_OPTIONS = int(os.environ.get("RESULTS_SNAPSHOT_OPTIONS", 16))
+SNAPSHOT_INTERVAL = float(os.environ.get("RESULTS_SNAPSHOT_INTERVAL", 1))
+# Readers ignore a snapshot the updater has not refreshed for this long
+SNAPSHOT_MAX_AGE = float(os.environ.get("RESULTS_SNAPSHOT_MAX_AGE", 10))
+# Hotness: votes read at startup, the half-life of a vote's weight in
+# seconds, and the most vote ids read per refresh
+SNAPSHOT_RECENT_VOTES = int(os.environ.get("RESULTS_SNAPSHOT_RECENT_VOTES", 10000))
+SNAPSHOT_HALF_LIFE = float(os.environ.get("RESULTS_SNAPSHOT_HALF_LIFE", 60))
+SNAPSHOT_MAX_SCAN = int(os.environ.get("RESULTS_SNAPSHOT_MAX_SCAN", 50000))
+
+# File layout (little endian, fixed size for a given polls/options setting):
+#
+#   header: magic, layout version, slot count, options per slot, used slots,
+#           sequence number (seqlock), generation time
+#   slots:  poll_id, option count, then (option_id, votes) pairs
+#
+# Slots are written sorted by poll_id so readers can binary search them. The
+# updater bumps the sequence number to an odd value before writing and to
+# the next even value afterwards; readers retry if it changed under them.
+MAGIC = b"POLLSNAP"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<8sIIIIQd")
+SLOT_HEAD = struct.Struct("<qI4x")
+OPTION = struct.Struct("<qq")
+SEQ_OFFSET = 24
+
+
+def _slot_size(max_options):
+    return SLOT_HEAD.size + OPTION.size * max_options
+
+
+def _file_size(slots, max_options):
+    return HEADER.size + slots * _slot_size(max_options)
+
+
+# Writer side, used by the single snapshot updater process. Each updater
+# writes a new file at its final size and renames it into place: workers
+# may still map the previous one, and resizing that in place would make
+# their reads past the new end raise SIGBUS. Readers move to the new file
+# once the old one goes stale.
+class SnapshotWriter:
+    def __init__(self, path=SNAPSHOT_PATH, slots=SNAPSHOT_POLLS, max_options=SNAPSHOT_OPTIONS):
+        self.path = path
+        self.slots = slots
+        self.max_options = max_options
+        size = _file_size(slots, max_options)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.")
+        try:
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT_VERSION, slots, max_options, 0, 0, 0.0)
+        os.replace(temp_path, path)
+
+    # Replace the snapshot with {poll_id: [(option_id, votes), ...]}, hottest
+    # first. Polls beyond the slot count or with too many options are left out.
+    def write(self, results):
+        entries = [(poll_id, options) for poll_id, options in results.items()
+                   if len(options) <= self.max_options][:self.slots]
+        entries.sort(key=lambda entry: entry[0])
+        seq = struct.unpack_from("<Q", self._mm, SEQ_OFFSET)[0]
+        struct.pack_into("<Q", self._mm, SEQ_OFFSET, seq + 1)
+
+        slot_size = _slot_size(self.max_options)
+        for index, (poll_id, options) in enumerate(entries):
+            offset = HEADER.size + index * slot_size
+            SLOT_HEAD.pack_into(self._mm, offset, poll_id, len(options))
+            offset += SLOT_HEAD.size
+            for option_id, votes in options:
+                OPTION.pack_into(self._mm, offset, option_id, votes)
+                offset += OPTION.size
+
+        HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT_VERSION, self.slots, self.max_options,
+                         len(entries), seq + 1, time.time())
+        struct.pack_into("<Q", self._mm, SEQ_OFFSET, seq + 2)
+        return len(entries)
+
+    def close(self):
+        self._mm.close()
+
+
+# Reader side, one read-only mapping per gunicorn worker
+class SnapshotReader:
+    def __init__(self, path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._mm = None
+        self._inode = None
+        self._pid = None
+
+    def _map(self):
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+        try:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._inode = os.fstat(f.fileno()).st_ino
+        except (FileNotFoundError, ValueError):
+            return None
+        self._pid = os.getpid()
+        return self._mm
+
+    # Drop the mapping if a restarted updater has renamed a new file into
+    # place; the old mapping stays valid, it just stops being updated
+    def _replaced(self):
+        try:
+            replaced = os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return False
+        if replaced:
+            self._mm = None
+        return replaced
+
+    # Option vote counts for a poll as {option_id: votes}, or None when the
+    # poll is not in a fresh snapshot
+    def get(self, poll_id):
+        mm = self._map()
+        if mm is None:
+            return None
+        for _ in range(10):
+            magic, layout, slots, max_options, used, seq, generated_at = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION or len(mm) != _file_size(slots, max_options):
+                self._mm = None
+                return None
+            if seq & 1:
+                continue
+            if time.time() - generated_at > self.max_age:
+                if self._replaced():
+                    mm = self._map()
+                    if mm is None:
+                        return None
+                    continue
+                return None
+
+            counts = self._find(mm, poll_id, used, _slot_size(max_options))
+            if struct.unpack_from("<Q", mm, SEQ_OFFSET)[0] == seq:
+                return counts
+        return None
+
+    def _find(self, mm, poll_id, used, slot_size):
+        low, high = 0, used - 1
+        while low <= high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * slot_size
+            slot_poll_id, n_options = SLOT_HEAD.unpack_from(mm, offset)
+            if slot_poll_id == poll_id:
+                offset += SLOT_HEAD.size
+                counts = {}
+                for index in range(n_options):
+                    option_id, votes = OPTION.unpack_from(mm, offset + index * OPTION.size)
+                    counts[option_id] = votes
+                return counts
+            if slot_poll_id < poll_id:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+
+# Votes per poll in a range of vote ids (params: after id, up to id)
+RECENT_VOTES_SQL = """
+    SELECT poll_id, COUNT(*) AS recent, MAX(id) AS max_id
+    FROM votes
+    WHERE id > %s AND id <= %s
+    GROUP BY poll_id
+    """
+
+
+# The (sql, params) of the current counts of some polls' options
+def hot_options_query(poll_ids):
+    placeholders = ", ".join(["%s"] * len(poll_ids))
+    return f"""
+        SELECT options.id, options.poll_id, {OPTION_VOTES_SQL} AS votes
+        FROM options
+        WHERE options.poll_id IN ({placeholders})
+        ORDER BY options.poll_id, options.id
+        """, list(poll_ids)
+
+
+# Options (rows with an "id") with the snapshot's counts filled in, or None
+# if the snapshot is missing one of them. Counts never go down, so the higher
+# of the two wins: the snapshot can be fresher than a cached entry, and a
+# cached entry can already hold this worker's latest vote.
+def with_snapshot_counts(options, counts):
+    if counts is None or not all(option["id"] in counts for option in options):
+        return None
+    return [dict(option, votes=max(option.get("votes", 0), counts[option["id"]])) for option in options]
+
+
+# Hottest polls by recent votes. Each refresh reads only the votes added
+# since the previous one (a primary key range scan) and adds them to per-poll
+# scores that halve every SNAPSHOT_HALF_LIFE seconds, so the cost of a
+# refresh follows the vote rate instead of a fixed window of votes. Votes
+# committed out of id order can be missed, which only nudges the ranking.
+class HotPolls:
+    def __init__(self, polls=SNAPSHOT_POLLS, half_life=SNAPSHOT_HALF_LIFE, max_scan=SNAPSHOT_MAX_SCAN):
+        self.polls = polls
+        self.half_life = half_life
+        self.max_scan = max_scan
+        self.last_id = None
+        self.scores = {}
+        self._updated_at = None
+
+    # Poll ids, hottest first
+    def refresh(self, cursor):
+        now = time.monotonic()
+        if self.last_id is None:
+            # Warm up from the most recent votes once
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM votes")
+            self.last_id = max(0, cursor.fetchone()["max_id"] - SNAPSHOT_RECENT_VOTES)
+        elif self.half_life > 0:
+            decay = 0.5 ** ((now - self._updated_at) / self.half_life)
+            self.scores = {poll_id: score * decay for poll_id, score in self.scores.items() if score * decay >= 0.01}
+        self._updated_at = now
+
+        cursor.execute(RECENT_VOTES_SQL, (self.last_id, self.last_id + self.max_scan))
+        rows = cursor.fetchall()
+        if rows:
+            for row in rows:
+                self.scores[row["poll_id"]] = self.scores.get(row["poll_id"], 0) + row["recent"]
+            self.last_id = max(row["max_id"] for row in rows)
+        else:
+            # Skip a run of ids that never committed (rolled back inserts)
+            cursor.execute("SELECT MIN(id) AS next_id FROM votes WHERE id > %s", (self.last_id,))
+            next_id = cursor.fetchone()["next_id"]
+            if next_id is not None:
+                self.last_id = next_id - 1
+
+        hottest = sorted(self.scores, key=self.scores.get, reverse=True)
+        # Remember a few more than fit, so polls near the cut keep their score
+        self.scores = {poll_id: self.scores[poll_id] for poll_id in hottest[:self.polls * 4]}
+        return hottest[:self.polls]
+
+
+# Collect counts for the hottest polls
+def load_hot_results(db, hot_polls):
+    cursor = db.cursor()
+    poll_ids = hot_polls.refresh(cursor)
+    if not poll_ids:
+        return {}
+
+    cursor.execute(*hot_options_query(poll_ids))
+    results = {}
+    for row in cursor.fetchall():
+        results.setdefault(row["poll_id"], []).append((row["id"], int(row["votes"])))
+    return results
+
+
+# Updater loop: refresh the snapshot every `interval` seconds
+def run_updater(pool, interval=SNAPSHOT_INTERVAL):
+    writer = SnapshotWriter()
+    hot_polls = HotPolls()
+    logger.info(f"Results snapshot updater writing {writer.path} every {interval}s")
+    while True:
+        started = time.monotonic()
+        try:
+            with pool.connection() as db:
+                results = load_hot_results(db, hot_polls)
+            written = writer.write(results)
+            logger.debug(f"Results snapshot refreshed with {written} polls")
+        except Exception as e:
+            logger.error(f"Error refreshing results snapshot: {e}")
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,61 @@
+import time
+
+from comment_threads import COMMENTS_PAGE_SIZE
+from pagination import page_result
+from poll_versions import POLL_LIST
+from queries import DELETE_POLL_OPTIONS_SQL, DELETE_POLL_SQL
+
+# Route logic shared by the Flask app (app.py) and its async variant
+# (asgi_app.py): what each route reads, writes and answers. The apps only
+# run the statements on their own driver (pymysql or aiomysql) and send the
+# side effects through their own clients, so the two cannot drift apart.
+
+ALREADY_VOTED = "You have already voted in this poll."
+INVALID_OPTION = "Invalid option."
+VOTE_BUSY = "Voting is busy, please try again."
+# Attempts of one vote: a deadlock or lock wait timeout is retried once
+VOTE_ATTEMPTS = 2
+EMAIL_TAKEN = "Email already exists. Please use a different one."
+INVALID_LOGIN = "Invalid email or password."
+COMMENT_NOT_FOUND = "Comment not found."
+POLL_NOT_FOUND = "Poll not found"
+
+# (columns, table, where, params, token_arg) of the admin dashboard's pages
+ADMIN_POLLS_PAGE = ("*", "polls", [], [], "polls_after")
+ADMIN_USERS_PAGE = ("id, email, is_admin", "users", [], [], "users_after")
+
+
+# Side effects of a new account as (function_name, dedupe_key, payload):
+# written to the outbox with the user, or invoked directly after the commit.
+# The counter files the registration under this day, however late it is
+# delivered.
+def registration_side_effects(user_id, email):
+    registration = {"registered_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())}
+    return [("welcome_email_function", f"user.registered:{user_id}:welcome_email", {"recipient_email": email}),
+            ("registration_counter_function", f"user.registered:{user_id}:registration_counter", registration)]
+
+
+# Outbox destination of a side effect
+def lambda_destination(function_name):
+    return f"lambda:{function_name}"
+
+
+# Where a successful login lands
+def login_landing(user):
+    return "admin_dashboard" if user["is_admin"] == 1 else "index"
+
+
+# The cached part of a poll page: the poll, its options with counts and the
+# first page of top-level comments
+def poll_results(poll, options, comment_rows):
+    comments, comments_next = page_result(comment_rows, COMMENTS_PAGE_SIZE)
+    return {"poll": poll, "options": options, "comments": comments, "comments_next": comments_next}
+
+
+# The statements of an admin poll deletion, and the version keys to bump
+def delete_poll_queries(poll_id):
+    return [(DELETE_POLL_SQL, (poll_id,)), (DELETE_POLL_OPTIONS_SQL, (poll_id,))]
+
+
+def deleted_poll_versions(poll_id):
+    return [poll_id, POLL_LIST]
@@ -0,0 +1,302 @@
+import os
+import time
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "mysql")
+# Front cache: how long a worker trusts its copy of a session, and how many it keeps
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 5))
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", 10000))
+SESSION_LIFETIME = int(os.environ.get("SESSION_LIFETIME", 7 * 24 * 3600))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 300))
+SESSION_SWEEP_BATCH_SIZE = int(os.environ.get("SESSION_SWEEP_BATCH_SIZE", 1000))
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Id given up by regenerate(), deleted from the store on save
+        self.replaced_sid = None
+
+
+SESSION_LOAD_SQL = "SELECT data, expires_at FROM sessions WHERE id = %s AND expires_at > UTC_TIMESTAMP()"
+SESSION_SAVE_SQL = """INSERT INTO sessions (id, data, expires_at) VALUES (%s, %s, %s)
+                      ON DUPLICATE KEY UPDATE data = VALUES(data), expires_at = VALUES(expires_at)"""
+SESSION_DELETE_SQL = "DELETE FROM sessions WHERE id = %s"
+SESSION_SWEEP_SQL = "DELETE FROM sessions WHERE expires_at < UTC_TIMESTAMP() LIMIT %s"
+
+
+# Sessions in a MySQL table (migration 5). Expired rows are deleted by
+# sweep(), a bounded batch at a time.
+#
+# Sessions are saved after the view has run but before teardown, so the
+# request may still hold its own pool connection. release_request_db hands
+# it back first: taking a second connection while holding one would let a
+# few concurrent logins exhaust the pool and wait on each other.
+class MySQLSessionStore:
+    def __init__(self, get_pool, release_request_db=None):
+        self.get_pool = get_pool
+        self.release_request_db = release_request_db
+
+    def _connection(self):
+        if self.release_request_db is not None:
+            self.release_request_db()
+        return self.get_pool().connection()
+
+    def load(self, sid):
+        with self.get_pool().connection() as db:
+            cursor = db.cursor()
+            cursor.execute(SESSION_LOAD_SQL, (sid,))
+            row = cursor.fetchone()
+            db.rollback()
+        if row is None:
+            return None
+        return serializer.loads(row["data"]), row["expires_at"]
+
+    def save(self, sid, data, expires_at):
+        with self._connection() as db:
+            cursor = db.cursor()
+            cursor.execute(SESSION_SAVE_SQL, (sid, serializer.dumps(data), expires_at))
+            db.commit()
+
+    def delete(self, sid):
+        with self._connection() as db:
+            cursor = db.cursor()
+            cursor.execute(SESSION_DELETE_SQL, (sid,))
+            db.commit()
+
+    def sweep(self):
+        deleted = 0
+        with self.get_pool().connection() as db:
+            cursor = db.cursor()
+            while True:
+                cursor.execute(SESSION_SWEEP_SQL, (SESSION_SWEEP_BATCH_SIZE,))
+                db.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < SESSION_SWEEP_BATCH_SIZE:
+                    return deleted
+
+
+# Sessions in Redis; keys expire on their own, so there is nothing to sweep
+class RedisSessionStore:
+    def __init__(self, url, prefix="session:"):
+        # Optional dependency, only needed for the redis backend
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def load(self, sid):
+        data = self.client.get(f"{self.prefix}{sid}")
+        if data is None:
+            return None
+        ttl = self.client.pttl(f"{self.prefix}{sid}")
+        return serializer.loads(data), datetime.utcnow() + timedelta(milliseconds=max(ttl, 0))
+
+    def save(self, sid, data, expires_at):
+        ttl = max(1, int((expires_at - datetime.utcnow()).total_seconds() * 1000))
+        self.client.set(f"{self.prefix}{sid}", serializer.dumps(data), px=ttl)
+
+    def delete(self, sid):
+        self.client.delete(f"{self.prefix}{sid}")
+
+    def sweep(self):
+        return 0
+
+
+# Server-side sessions over a shared store, so any instance behind the ALB
+# can serve any user.
+#
+# * A per-worker LRU front cache answers repeat requests without touching
+#   the store. An entry is trusted for SESSION_CACHE_TTL seconds, which
+#   bounds how long a logout elsewhere can go unnoticed by this worker.
+# * The store is only written when the session changed, or when less than
+#   half of its lifetime is left (a sliding expiry without a write per
+#   request).
+# * Expired rows are swept by a background thread in each worker, at most
+#   once per SESSION_SWEEP_INTERVAL.
+# * regenerate() swaps the session id on login, so an id planted or seen
+#   before authentication never becomes a logged-in session.
+class CachedSessionInterface(SessionInterface):
+    def __init__(self, store, lifetime=SESSION_LIFETIME, cache_ttl=SESSION_CACHE_TTL,
+                 max_entries=SESSION_CACHE_MAX_ENTRIES):
+        self.store = store
+        self.lifetime = timedelta(seconds=lifetime)
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "refreshes": 0, "deletes": 0,
+                       "swept": 0, "errors": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _start_sweeper(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._cache = OrderedDict()
+            threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                self._count("swept", self.store.sweep())
+            except Exception as e:
+                logger.error(f"Error sweeping expired sessions: {e}")
+
+    def _cache_get(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None or entry[2] < time.monotonic():
+                return None
+            self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_set(self, sid, data, expires_at):
+        with self._lock:
+            self._cache[sid] = (data, expires_at, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _cache_delete(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _delete(self, sid):
+        try:
+            self.store.delete(sid)
+            self._count("deletes")
+        except Exception as e:
+            logger.error(f"Error deleting session: {e}")
+            self._count("errors")
+        self._cache_delete(sid)
+
+    # Empty the session and move it to a new id. The old id is deleted from
+    # the store when the session is saved, after the view has released its
+    # connection.
+    def regenerate(self, session):
+        if not session.new and session.replaced_sid is None:
+            session.replaced_sid = session.sid
+        session.clear()
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+    def open_session(self, app, request):
+        self._start_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+        entry = self._cache_get(sid)
+        if entry is not None:
+            self._count("hits")
+        else:
+            self._count("misses")
+            try:
+                loaded = self.store.load(sid)
+            except Exception as e:
+                logger.error(f"Error loading session: {e}")
+                self._count("errors")
+                loaded = None
+            if loaded is None:
+                return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+            self._cache_set(sid, *loaded)
+            entry = self._cache_get(sid)
+        data, expires_at, _ = entry
+        session = ServerSideSession(dict(data), sid=sid)
+        session.expires_at = expires_at
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid is not None:
+            self._delete(session.replaced_sid)
+        if not session:
+            if session.modified and not session.new:
+                self._delete(session.sid)
+            if session.modified and (not session.new or session.replaced_sid is not None):
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.utcnow()
+        expires_at = getattr(session, "expires_at", None)
+        stale = expires_at is not None and expires_at - now < self.lifetime / 2
+        if not (session.modified or stale):
+            return
+
+        expires_at = now + self.lifetime
+        try:
+            self.store.save(session.sid, dict(session), expires_at)
+            self._count("writes" if session.modified else "refreshes")
+        except Exception as e:
+            logger.error(f"Error saving session: {e}")
+            self._count("errors")
+            if session.modified:
+                # A login (or other change) that was not stored must not
+                # look like it succeeded
+                response.status_code = 503
+                response.headers.pop("Location", None)
+                response.mimetype = "text/plain"
+                response.set_data("Session storage is unavailable, please try again.")
+            return
+        self._cache_set(session.sid, dict(session), expires_at)
+        if session.modified:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._cache)
+        return stats
+
+
+# Pick the session implementation from SESSION_BACKEND:
+#   mysql/redis - server-side sessions behind the LRU front cache
+#   cookie      - Flask's signed cookie; the session is just user_id and email,
+#                 so it fits easily and needs no store at all
+#   filesystem  - the previous Flask-Session files, local to each instance
+def init_sessions(app, get_pool, release_request_db=None):
+    if SESSION_BACKEND == "mysql":
+        app.session_interface = CachedSessionInterface(MySQLSessionStore(get_pool, release_request_db))
+    elif SESSION_BACKEND == "redis":
+        app.session_interface = CachedSessionInterface(
+            RedisSessionStore(os.environ.get("REDIS_URL", "redis://localhost:6379/0")))
+    elif SESSION_BACKEND == "cookie":
+        pass
+    elif SESSION_BACKEND == "filesystem":
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
+    return app.session_interface
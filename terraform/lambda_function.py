@@ -2,56 +2,134 @@
 #smtp_port = 465  # SSL port
 #sender_email = 'rego@regomeszaros.awsapps.com'
 
-import boto3
 import os
+import json
 
-def lambda_handler(event, context):
-    # Initialize the SES client
-    ses_client = boto3.client('ses', region_name='eu-central-1')  # Replace with your AWS region
-
-    # Sender and recipient
-    sender_email = 'rego@regomeszaros.awsapps.com'  # Your verified email
-    recipient_email = event['recipient_email']  # Recipient's email from the event data
-
-    # Email subject and body
-    subject = 'Welcome to Our Service!'
-    body_text = 'Hello,\n\nWelcome to our service. We are glad to have you!'
-    body_html = """
-    <html>
-    <head></head>
-    <body>
-      <h1>Hello!</h1>
-      <p>Welcome to our service. We are glad to have you!</p>
-    </body>
-    </html>
-    """
-
-    try:
-        response = ses_client.send_email(
-            Source=sender_email,
-            Destination={
-                'ToAddresses': [
-                    recipient_email,
-                ],
+import boto3
+
+# Sender, region and (optional) SES template come from the environment
+SES_REGION = os.environ.get('SES_REGION', 'eu-central-1')  # Replace with your AWS region
+SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'rego@regomeszaros.awsapps.com')  # Your verified email
+# Name of the SES template used for bulk sends; without it every recipient
+# gets a plain send_email call
+SES_TEMPLATE_NAME = os.environ.get('SES_TEMPLATE_NAME')
+# SES accepts at most 50 destinations per SendBulkTemplatedEmail call
+SES_BULK_LIMIT = 50
+
+# Created once per execution environment, so warm invocations reuse the
+# client and its connection pool instead of building a new one every time
+ses_client = boto3.client('ses', region_name=SES_REGION)
+
+# Email subject and body
+SUBJECT = 'Welcome to Our Service!'
+BODY_TEXT = 'Hello,\n\nWelcome to our service. We are glad to have you!'
+BODY_HTML = """
+<html>
+<head></head>
+<body>
+  <h1>Hello!</h1>
+  <p>Welcome to our service. We are glad to have you!</p>
+</body>
+</html>
+"""
+
+
+# Accepts the legacy {"recipient_email": "..."} event as well as the batch
+# shape {"recipients": [...]}, where each entry is either an address or a
+# {"recipient_email": ..., "dedupe_key": ...} object
+def parse_recipients(event):
+    if 'recipients' in event:
+        recipients = []
+        for entry in event['recipients']:
+            if isinstance(entry, str):
+                entry = {'recipient_email': entry}
+            recipients.append(entry)
+        return recipients
+    return [{'recipient_email': event['recipient_email'], 'dedupe_key': event.get('dedupe_key')}]
+
+
+def send_one(recipient):
+    response = ses_client.send_email(
+        Source=SENDER_EMAIL,
+        Destination={
+            'ToAddresses': [
+                recipient['recipient_email'],
+            ],
+        },
+        Message={
+            'Subject': {
+                'Data': SUBJECT,
+                'Charset': 'UTF-8'
             },
-            Message={
-                'Subject': {
-                    'Data': subject,
+            'Body': {
+                'Text': {
+                    'Data': BODY_TEXT,
                     'Charset': 'UTF-8'
                 },
-                'Body': {
-                    'Text': {
-                        'Data': body_text,
-                        'Charset': 'UTF-8'
-                    },
-                    'Html': {
-                        'Data': body_html,
-                        'Charset': 'UTF-8'
-                    }
+                'Html': {
+                    'Data': BODY_HTML,
+                    'Charset': 'UTF-8'
                 }
             }
-        )
-        print(f"Email sent! Message ID: {response['MessageId']}")
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        raise e
+        }
+    )
+    return response['MessageId']
+
+
+# One SendBulkTemplatedEmail call per 50 recipients. SES reports a status
+# per destination, in order, so failures map back to their recipient.
+def send_bulk(recipients):
+    sent, failed = [], []
+    for start in range(0, len(recipients), SES_BULK_LIMIT):
+        chunk = recipients[start:start + SES_BULK_LIMIT]
+        try:
+            response = ses_client.send_bulk_templated_email(
+                Source=SENDER_EMAIL,
+                Template=SES_TEMPLATE_NAME,
+                DefaultTemplateData='{}',
+                Destinations=[{'Destination': {'ToAddresses': [recipient['recipient_email']]}}
+                              for recipient in chunk]
+            )
+        except Exception as e:
+            failed.extend(dict(recipient, error=str(e)) for recipient in chunk)
+            continue
+        for recipient, status in zip(chunk, response['Status']):
+            if status['Status'] == 'Success':
+                sent.append(dict(recipient, message_id=status['MessageId']))
+            else:
+                failed.append(dict(recipient, error=f"{status['Status']}: {status.get('Error', '')}"))
+    return sent, failed
+
+
+def send_each(recipients):
+    sent, failed = [], []
+    for recipient in recipients:
+        try:
+            sent.append(dict(recipient, message_id=send_one(recipient)))
+        except Exception as e:
+            failed.append(dict(recipient, error=str(e)))
+    return sent, failed
+
+
+def lambda_handler(event, context):
+    recipients = parse_recipients(event)
+    if SES_TEMPLATE_NAME:
+        sent, failed = send_bulk(recipients)
+    else:
+        sent, failed = send_each(recipients)
+
+    for recipient in sent:
+        print(f"Email sent to {recipient['recipient_email']}! Message ID: {recipient['message_id']}")
+    for recipient in failed:
+        print(f"Error sending email to {recipient['recipient_email']}: {recipient['error']}")
+
+    # A single legacy recipient keeps failing the invocation, so asynchronous
+    # invokes are retried as before. Batches report failures per recipient
+    # instead: retrying the whole batch would resend the emails that went out.
+    if 'recipients' not in event and failed:
+        raise Exception(f"Error sending email: {failed[0]['error']}")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'sent': len(sent), 'failed': failed})
+    }
@@ -1,95 +1,188 @@
 import os
-import boto3
+import re
+import csv
 import json
+import uuid
+from io import StringIO
+from datetime import datetime, timedelta
+
+import boto3
+
+# S3 bucket neve és régiója a környezeti változókból
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_REGION = os.environ.get('AWS_DEFAULT_REGION')
+# Helyi S3 helyettesítő (pl. moto server vagy MinIO) címe teszteléshez
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+# Az összesített napi CSV és a delta objektumok helye
+CSV_KEY = 'registration_data.csv'
+DELTA_PREFIX = 'registrations/deltas/'
+SUMMARY_PREFIX = 'registrations/days/'
+# Ennyi nap után tekintünk egy napot lezártnak (késve érkező hívások miatt)
+COMPACTION_GRACE_DAYS = int(os.environ.get('COMPACTION_GRACE_DAYS', 1))
+
+# A kliens modul szinten jön létre, így a meleg indítások újrahasznosítják
+s3_client = boto3.client('s3', region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL)
+
+
+def delta_prefix(day):
+    return f'{DELTA_PREFIX}date={day}/'
+
+
+# A regisztráció napja (UTC) az esemény registered_at mezőjéből; régi,
+# időbélyeg nélküli eseményeknél a feldolgozás napja
+def event_day(event, now=None):
+    registered_at = event.get('registered_at')
+    if registered_at:
+        return datetime.fromisoformat(registered_at[:19]).strftime('%Y-%m-%d')
+    return (now or datetime.utcnow()).strftime('%Y-%m-%d')
+
+
+# Minden regisztráció egy saját, új delta objektumot ír: nincs olvasás-módosítás-
+# írás, így párhuzamos hívások sem veszíthetnek el számlálást, és a költség nem
+# függ az eddigi napok számától. A nap a regisztráció idejéből (registered_at)
+# jön, nem a kézbesítésből, az objektum neve pedig csak a dedupe kulcsból (outbox
+# relay), így egy később újrakézbesített esemény ugyanazt az objektumot írja felül.
+def record_registration(event, now=None):
+    day = event_day(event, now)
+    count = int(event.get('count', 1))
+    if event.get('dedupe_key'):
+        name = re.sub(r'[^A-Za-z0-9._-]', '_', event['dedupe_key'])
+    else:
+        name = uuid.uuid4().hex
+    key = f"{delta_prefix(day)}{name}"
+    s3_client.put_object(Bucket=S3_BUCKET, Key=key, Body=str(count).encode('utf-8'), ContentType='text/plain')
+    return key
 
-def lambda_handler(event, context):
-    # S3 bucket neve és régiója a környezeti változókból
-    S3_BUCKET = os.environ.get('S3_BUCKET')
-    S3_REGION = os.environ.get('AWS_DEFAULT_REGION')
 
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+def list_deltas(day):
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=delta_prefix(day)):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    return keys
 
-    # A CSV fájl kulcsa az S3-ban
-    s3_key = 'registration_data.csv'
 
-    # Aktuális dátum (év-hónap-nap formátumban)
-    from datetime import datetime
-    today = datetime.utcnow().strftime('%Y-%m-%d')
+def summary_key(day):
+    return f'{SUMMARY_PREFIX}date={day}.json'
 
-    # Inicializáljuk a regisztrációk számát 1-re
-    registrations = 1
 
-    # Ellenőrizzük, hogy a fájl létezik-e
+# Egy lezárt nap összesítője: a végösszeg és a beleszámolt delták neve, egyetlen
+# objektumban, így a kettő mindig egyszerre változik
+def read_summary(day):
     try:
-        s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
-        file_exists = True
-    except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == "404":
-            file_exists = False
-        else:
-            raise e
-
-    # Ha a fájl nem létezik, létrehozzuk
-    if not file_exists:
-        initial_content = 'date,registrations\n'
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=s3_key,
-            Body=initial_content.encode('utf-8'),
-            ContentType='text/csv'
-        )
-
-    # Letöltjük a fájlt az S3-ból
-    s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-    existing_content = s3_object['Body'].read().decode('utf-8')
-    version_id = s3_object.get('VersionId')
-
-    # Beolvasás CSV-ként
-    import csv
-    from io import StringIO
-
-    csv_file = StringIO(existing_content)
-    reader = csv.reader(csv_file)
-    rows = list(reader)
-
-    # Ellenőrizzük, hogy a mai dátum már szerepel-e
-    date_found = False
-    for row in rows:
-        if row[0] == 'date':
-            continue  # Fejléc sor
-        if row[0] == today:
-            # Ha megtaláltuk a mai dátumot, növeljük a számot
-            registrations = int(row[1]) + 1
-            row[1] = str(registrations)
-            date_found = True
-            break
-
-    if not date_found:
-        # Ha a mai dátum még nincs benne, hozzáadjuk
-        rows.append([today, '1'])
-
-    # Újra létrehozzuk a CSV tartalmat
+        s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=summary_key(day))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(s3_object['Body'].read().decode('utf-8'))
+
+
+def write_summary(day, summary):
+    s3_client.put_object(Bucket=S3_BUCKET, Key=summary_key(day), Body=json.dumps(summary).encode('utf-8'),
+                         ContentType='application/json')
+
+
+def sum_deltas(keys):
+    total = 0
+    for key in keys:
+        total += int(s3_client.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read().decode('utf-8') or 0)
+    return total
+
+
+def read_csv():
+    try:
+        s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=CSV_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return {}
+    reader = csv.reader(StringIO(s3_object['Body'].read().decode('utf-8')))
+    return {row[0]: int(row[1]) for row in reader if row and row[0] != 'date'}
+
+
+def write_csv(days):
     output = StringIO()
     writer = csv.writer(output)
-    writer.writerows(rows)
-    updated_content = output.getvalue()
-
-    # Feltöltjük az új tartalmat az S3-ba
-    s3_client.put_object(
-        Bucket=S3_BUCKET,
-        Key=s3_key,
-        Body=updated_content.encode('utf-8'),
-        ContentType='text/csv'
-    )
-
-    # Töröljük a régi verziót, ha van
-    if version_id:
-        try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key, VersionId=version_id)
-        except Exception as e:
-            print(f"Hiba a régi verzió törlésekor: {e}")
+    writer.writerow(['date', 'registrations'])
+    for day in sorted(days):
+        writer.writerow([day, days[day]])
+    s3_client.put_object(Bucket=S3_BUCKET, Key=CSV_KEY, Body=output.getvalue().encode('utf-8'),
+                         ContentType='text/csv')
+
+
+def delete_keys(keys):
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(Bucket=S3_BUCKET,
+                                 Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+                                         'Quiet': True})
+
+
+# Tömörítés: a lezárt napok deltáit hozzáadjuk a nap összesítőjéhez, abból
+# frissítjük a napi CSV-t, végül töröljük a deltákat. Az összesítő név szerint
+# tartja nyilván a már beszámolt deltákat: egy megszakadt futás maradékát és a
+# lezárás után újrakézbesített eseményt csak töröljük, a késve érkező új deltát
+# viszont hozzáadjuk, így a szám sosem duplázódik és nem is fogy. Mivel a
+# törlés az utolsó lépés, bármelyik ponton megszakadt futást a következő befejez.
+def compact(now=None):
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=COMPACTION_GRACE_DAYS)).strftime('%Y-%m-%d')
+    days = read_csv()
+
+    # A deltákat tartalmazó napok a date=YYYY-MM-DD/ előtagokból
+    pending = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=DELTA_PREFIX, Delimiter='/'):
+        for prefix in page.get('CommonPrefixes', []):
+            day = prefix['Prefix'][len(DELTA_PREFIX) + len('date='):-1]
+            if day < cutoff:
+                pending.append(day)
+
+    folded = {}
+    processed = []
+    for day in pending:
+        keys = list_deltas(day)
+        # A régi (összesítő előtti) CSV sorok kiinduló értékként szolgálnak
+        summary = read_summary(day) or {'total': days.get(day, 0), 'deltas': []}
+        counted = set(summary['deltas'])
+        new = [key for key in keys if key[len(delta_prefix(day)):] not in counted]
+        if new:
+            added = sum_deltas(new)
+            summary = {'total': summary['total'] + added,
+                       'deltas': summary['deltas'] + [key[len(delta_prefix(day)):] for key in new]}
+            write_summary(day, summary)
+            folded[day] = added
+        days[day] = summary['total']
+        processed.extend(keys)
+
+    if pending:
+        write_csv(days)
+    delete_keys(processed)
+    return folded
+
+
+# Egy nap regisztrációinak száma: az összesítő (vagy régi CSV sor) és a még be
+# nem számolt delták összege
+def count_for_day(day):
+    summary = read_summary(day)
+    if summary is None:
+        summary = {'total': read_csv().get(day, 0), 'deltas': []}
+    counted = set(summary['deltas'])
+    return summary['total'] + sum_deltas([key for key in list_deltas(day)
+                                          if key[len(delta_prefix(day)):] not in counted])
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    action = event.get('action', 'record')
+
+    if action == 'compact':
+        folded = compact()
+        body = {'compacted': folded}
+    elif action == 'count':
+        day = event.get('date') or datetime.utcnow().strftime('%Y-%m-%d')
+        body = {'date': day, 'registrations': count_for_day(day)}
+    else:
+        body = {'delta': record_registration(event)}
 
     return {
         'statusCode': 200,
-        'body': json.dumps('A regisztrációk száma sikeresen frissítve')
+        'body': json.dumps(body)
     }
@@ -205,6 +205,18 @@ resource "aws_s3_bucket" "app_bucket" {
   }
 }
 
+## Browsers upload straight to the bucket with presigned POSTs
+resource "aws_s3_bucket_cors_configuration" "app_bucket" {
+  bucket = aws_s3_bucket.app_bucket.id
+
+  cors_rule {
+    allowed_methods = ["POST"]
+    allowed_origins = ["*"]
+    allowed_headers = ["*"]
+    max_age_seconds = 3000
+  }
+}
+
 # IAM Roles and Policies
 ## IAM Role for EC2 Instance
 resource "aws_iam_role" "ec2_role" {
@@ -302,7 +314,7 @@ resource "aws_instance" "app_server" {
       python3 get-pip.py
     fi
     pip3 install --upgrade pip
-    pip3 install flask pymysql bcrypt gunicorn boto3 flask-session flask-bcrypt python-dotenv
+    pip3 install flask pymysql bcrypt gunicorn gevent boto3 flask-session flask-bcrypt python-dotenv
 
     # Install AWS CLI
     if ! command -v aws &> /dev/null; then
@@ -327,8 +339,26 @@ resource "aws_instance" "app_server" {
     export S3_BUCKET=${aws_s3_bucket.app_bucket.bucket}
     export AWS_DEFAULT_REGION=${var.aws_region}
 
-    # Start the application using Gunicorn
-    gunicorn --workers 3 --bind 0.0.0.0:80 app:app &
+    # Apply pending database schema migrations
+    FLASK_APP=app flask db upgrade
+
+    # Start the results snapshot updater shared by the Gunicorn workers
+    FLASK_APP=app flask results-snapshot &
+
+    # Start the outbox relay that delivers registration side effects
+    FLASK_APP=app flask outbox-relay &
+
+    # Start the application: Gunicorn with gevent workers (open live result
+    # streams wait as greenlets instead of holding a thread each), or the async
+    # variant on Hypercorn with APP_SERVER=asgi
+    export APP_SERVER=sync
+    if [ "$APP_SERVER" = "asgi" ]; then
+      # The async stack is only installed where the async variant runs
+      pip3 install quart aiomysql aioboto3 hypercorn
+      hypercorn --workers 3 --bind 0.0.0.0:80 asgi_app:app &
+    else
+      gunicorn --workers 3 --worker-class gevent --worker-connections 1000 --bind 0.0.0.0:80 app:app &
+    fi
 
     echo "Application started successfully."
   EOF
@@ -414,7 +444,8 @@ resource "aws_iam_policy" "lambda_ses_policy" {
       Effect   = "Allow",
       Action   = [
         "ses:SendEmail",
-        "ses:SendRawEmail"
+        "ses:SendRawEmail",
+        "ses:SendBulkTemplatedEmail"
       ],
       Resource = "*"
     }]
@@ -471,7 +502,8 @@ resource "aws_lambda_function" "welcome_email" {
 
   environment {
     variables = {
-      SENDER_EMAIL = var.sender_email
+      SENDER_EMAIL      = var.sender_email
+      SES_TEMPLATE_NAME = aws_ses_template.welcome_email.name
     }
   }
 
@@ -481,6 +513,14 @@ resource "aws_lambda_function" "welcome_email" {
   ]
 }
 
+## Template for batched welcome emails (SendBulkTemplatedEmail)
+resource "aws_ses_template" "welcome_email" {
+  name    = "welcome_email"
+  subject = "Welcome to Our Service!"
+  text    = "Hello,\n\nWelcome to our service. We are glad to have you!"
+  html    = "<html><head></head><body><h1>Hello!</h1><p>Welcome to our service. We are glad to have you!</p></body></html>"
+}
+
 ## New Lambda Function
 resource "aws_lambda_function" "csv_handler" {
   function_name = "csv_handler_function"
@@ -501,6 +541,26 @@ resource "aws_lambda_function" "csv_handler" {
   ]
 }
 
+## Nightly compaction of registration counter deltas into registration_data.csv
+resource "aws_cloudwatch_event_rule" "registration_compaction" {
+  name                = "registration_compaction"
+  schedule_expression = "cron(15 0 * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "registration_compaction" {
+  rule  = aws_cloudwatch_event_rule.registration_compaction.name
+  arn   = aws_lambda_function.csv_handler.arn
+  input = jsonencode({ action = "compact" })
+}
+
+resource "aws_lambda_permission" "registration_compaction" {
+  statement_id  = "AllowRegistrationCompaction"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.csv_handler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.registration_compaction.arn
+}
+
 # Outputs
 ## Output the Load Balancer DNS Name
 output "load_balancer_dns_name" {
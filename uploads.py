@@ -0,0 +1,136 @@
+import os
+import uuid
+import logging
+
+from boto3.s3.transfer import TransferConfig
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+# Lifetime of a presigned POST policy
+UPLOAD_URL_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES", 300))
+# Server-side fallback: multipart part size and parallel part uploads
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get("UPLOAD_MAX_CONCURRENCY", 4))
+UPLOAD_ACL = os.environ.get("UPLOAD_ACL", "public-read")
+
+# Allowed extensions and the content type an upload must declare
+CONTENT_TYPES = {
+    "txt": "text/plain",
+    "pdf": "application/pdf",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "csv": "text/csv",
+}
+
+transfer_config = TransferConfig(multipart_threshold=UPLOAD_PART_SIZE, multipart_chunksize=UPLOAD_PART_SIZE,
+                                 max_concurrency=UPLOAD_MAX_CONCURRENCY)
+
+
+class UploadError(ValueError):
+    pass
+
+
+# Statements and checks shared with the async app (asgi_app.py)
+INSERT_PENDING_SQL = """INSERT INTO uploads (user_id, object_key, filename, content_type)
+                        VALUES (%s, %s, %s, %s)"""
+UPLOAD_BY_KEY_SQL = "SELECT id, content_type, status FROM uploads WHERE object_key = %s AND user_id = %s"
+REJECT_UPLOAD_SQL = "UPDATE uploads SET status = 'rejected' WHERE id = %s"
+COMPLETE_UPLOAD_SQL = """UPDATE uploads SET status = 'complete', size = %s, etag = %s, completed_at = NOW()
+                         WHERE id = %s"""
+INSERT_COMPLETE_SQL = """INSERT INTO uploads (user_id, object_key, filename, content_type, status, size, etag,
+                                              completed_at)
+                         VALUES (%s, %s, %s, %s, 'complete', %s, %s, NOW())"""
+
+
+def check_size(size):
+    if size is not None and not 0 < size <= UPLOAD_MAX_BYTES:
+        raise UploadError(f"Files must be at most {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.")
+
+
+def presign_args(bucket, key, content_type):
+    return {
+        "Bucket": bucket,
+        "Key": key,
+        "Fields": {"Content-Type": content_type, "acl": UPLOAD_ACL},
+        "Conditions": [
+            {"Content-Type": content_type},
+            {"acl": UPLOAD_ACL},
+            ["content-length-range", 1, UPLOAD_MAX_BYTES],
+        ],
+        "ExpiresIn": UPLOAD_URL_EXPIRES,
+    }
+
+
+# Does the object S3 reports match what the upload promised
+def head_matches(upload, head):
+    return head.get("ContentType") == upload["content_type"] and head["ContentLength"] <= UPLOAD_MAX_BYTES
+
+
+def head_etag(head):
+    return head.get("ETag", "").strip('"')
+
+
+def content_type_for(filename):
+    if "." not in filename:
+        return None
+    return CONTENT_TYPES.get(filename.rsplit(".", 1)[1].lower())
+
+
+# A fresh key per upload under the user's prefix, so uploads never
+# overwrite each other and the completion callback can check ownership
+def object_key(user_id, filename):
+    name = secure_filename(filename)
+    content_type = content_type_for(name)
+    if not name or content_type is None:
+        raise UploadError("File type not allowed.")
+    return f"uploads/{user_id}/{uuid.uuid4().hex}/{name}", name, content_type
+
+
+def object_url(s3_client, bucket, key):
+    return f"{s3_client.meta.endpoint_url}/{bucket}/{key}"
+
+
+# Presigned POST for a browser upload straight to S3. The policy pins the
+# key, the content type, the ACL and the size range, so the browser cannot
+# upload anything else with it. The upload is recorded as pending.
+def presign_upload(s3_client, bucket, cursor, user_id, filename, size=None):
+    key, name, content_type = object_key(user_id, filename)
+    check_size(size)
+    post = s3_client.generate_presigned_post(**presign_args(bucket, key, content_type))
+    cursor.execute(INSERT_PENDING_SQL, (user_id, key, name, content_type))
+    return {"key": key, "url": post["url"], "fields": post["fields"]}
+
+
+# Completion callback: check that the object really landed, with the
+# promised type and size, and mark the upload complete
+def complete_upload(s3_client, bucket, cursor, user_id, key):
+    cursor.execute(UPLOAD_BY_KEY_SQL, (key, user_id))
+    upload = cursor.fetchone()
+    if upload is None:
+        raise UploadError("Unknown upload.")
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.ClientError as e:
+        logger.error(f"Error checking uploaded object {key}: {e}")
+        raise UploadError("The file has not been uploaded.")
+    if not head_matches(upload, head):
+        s3_client.delete_object(Bucket=bucket, Key=key)
+        cursor.execute(REJECT_UPLOAD_SQL, (upload["id"],))
+        raise UploadError("The uploaded file does not match the upload request.")
+    cursor.execute(COMPLETE_UPLOAD_SQL, (head["ContentLength"], head_etag(head), upload["id"]))
+    return key
+
+
+# Server-side path for clients without JavaScript: multipart upload with
+# parallel parts straight from the request stream
+def upload_stream(s3_client, bucket, cursor, user_id, file):
+    key, name, content_type = object_key(user_id, file.filename)
+    s3_client.upload_fileobj(file, bucket, key, ExtraArgs={"ACL": UPLOAD_ACL, "ContentType": content_type},
+                             Config=transfer_config)
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    cursor.execute(INSERT_COMPLETE_SQL, (user_id, key, name, content_type, head["ContentLength"], head_etag(head)))
+    return key
@@ -0,0 +1,164 @@
+import os
+import time
+import uuid
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import Counter
+
+from vote_counters import increment_option_votes
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind buffer for votes.
+#
+# Accepted votes are appended to a local SQLite database (WAL, synchronous
+# FULL) shared by every gunicorn worker on the instance, so a vote survives a
+# worker crash or restart as soon as append() returns. A flusher thread in
+# each worker claims batches of pending votes and writes them to MySQL in one
+# transaction: a multi-row INSERT into votes plus one aggregated
+# `votes = votes + N` increment per option.
+#
+# One vote per user is enforced twice: UNIQUE(poll_id, user_id) on the
+# buffer rejects a second click before it is flushed, and the MySQL UNIQUE
+# constraint is the final word at flush time. Only rows that MySQL actually
+# inserted are counted, so replaying a batch after a crash (or a stale claim
+# being picked up by another worker) never double counts.
+class VoteBuffer:
+    def __init__(self, path, pool_getter, flush_interval=0.5, batch_size=500,
+                 claim_timeout=60.0, on_flush=None):
+        self.path = path
+        self.pool_getter = pool_getter
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        self.on_flush = on_flush
+        self._pid = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS pending_votes (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                poll_id INTEGER NOT NULL,
+                                user_id INTEGER NOT NULL,
+                                option_id INTEGER NOT NULL,
+                                claimed_by TEXT,
+                                claimed_at REAL,
+                                UNIQUE(poll_id, user_id))''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # Durably record a vote. Returns False if this user already has a vote
+    # for the poll waiting in the buffer.
+    def append(self, poll_id, user_id, option_id):
+        try:
+            self._conn().execute(
+                "INSERT INTO pending_votes (poll_id, user_id, option_id) VALUES (?, ?, ?)",
+                (poll_id, user_id, option_id))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def has_pending(self, poll_id, user_id):
+        row = self._conn().execute(
+            "SELECT 1 FROM pending_votes WHERE poll_id = ? AND user_id = ?",
+            (poll_id, user_id)).fetchone()
+        return row is not None
+
+    def pending_count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM pending_votes").fetchone()[0]
+
+    # Start the flusher thread for this process (no-op if already running)
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="vote-buffer-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.flush_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Error flushing buffered votes: {e}")
+            self._stop.wait(self.flush_interval)
+        # Best effort final flush; anything left stays in the buffer
+        try:
+            self.flush_once()
+        except Exception as e:
+            logger.error(f"Error flushing buffered votes on shutdown: {e}")
+
+    def _claim(self):
+        conn = self._conn()
+        token = uuid.uuid4().hex
+        now = time.time()
+        conn.execute(
+            '''UPDATE pending_votes SET claimed_by = ?, claimed_at = ?
+               WHERE id IN (SELECT id FROM pending_votes
+                            WHERE claimed_by IS NULL OR claimed_at < ?
+                            ORDER BY id LIMIT ?)''',
+            (token, now, now - self.claim_timeout, self.batch_size))
+        rows = conn.execute(
+            "SELECT poll_id, user_id, option_id FROM pending_votes WHERE claimed_by = ? ORDER BY id",
+            (token,)).fetchall()
+        return token, rows
+
+    # Flush one batch to MySQL. Returns the number of buffered votes handled.
+    def flush_once(self):
+        token, rows = self._claim()
+        if not rows:
+            return 0
+
+        with self.pool_getter().connection() as db:
+            cursor = db.cursor()
+            placeholders = ", ".join(["(%s, %s, %s)"] * len(rows))
+            cursor.execute(
+                f"INSERT IGNORE INTO votes (poll_id, user_id, option_id) VALUES {placeholders}",
+                [value for row in rows for value in row])
+            if cursor.rowcount == len(rows):
+                inserted = rows
+            else:
+                # Some votes already exist (another instance, or a replayed
+                # batch): find out row by row which ones are new
+                db.rollback()
+                inserted = []
+                for row in rows:
+                    cursor.execute("INSERT IGNORE INTO votes (poll_id, user_id, option_id) VALUES (%s, %s, %s)", row)
+                    if cursor.rowcount == 1:
+                        inserted.append(row)
+
+            counts = Counter(option_id for _, _, option_id in inserted)
+            # Fixed lock order keeps concurrent flushers from deadlocking
+            for option_id in sorted(counts):
+                increment_option_votes(cursor, option_id, counts[option_id])
+            db.commit()
+
+        self._conn().execute("DELETE FROM pending_votes WHERE claimed_by = ?", (token,))
+        if len(inserted) != len(rows):
+            logger.info(f"Dropped {len(rows) - len(inserted)} duplicate buffered votes")
+        if self.on_flush is not None:
+            self.on_flush(inserted)
+        return len(rows)
@@ -0,0 +1,148 @@
+import os
+import random
+import logging
+import threading
+
+import pymysql
+
+from queries import CAST_VOTE_SQL, INSERT_VOTE_SQL
+
+logger = logging.getLogger(__name__)
+
+# Number of counter shards per option. 0 keeps the single-row
+# `UPDATE options SET votes = votes + 1` behaviour.
+VOTE_COUNTER_SHARDS = int(os.environ.get("VOTE_COUNTER_SHARDS", 0))
+VOTE_ROLLUP_INTERVAL = float(os.environ.get("VOTE_ROLLUP_INTERVAL", 5))
+
+# Current vote count of an option: the rolled-up value in options.votes plus
+# whatever is still sitting in the shards
+OPTION_VOTES_SQL = """options.votes + COALESCE((SELECT SUM(option_vote_shards.votes)
+                                     FROM option_vote_shards
+                                     WHERE option_vote_shards.option_id = options.id), 0)"""
+
+# Options of a poll with their current vote count
+OPTIONS_WITH_VOTES_SQL = f"""
+    SELECT options.id, options.poll_id, options.option_text,
+           {OPTION_VOTES_SQL} AS votes
+    FROM options
+    WHERE options.poll_id = %s
+    """
+
+# Add n votes to an option inside the caller's transaction. With sharding
+# enabled each call lands on a random shard row, so concurrent voters on the
+# same option rarely wait for the same InnoDB row lock.
+def increment_option_votes(cursor, option_id, n=1):
+    cursor.execute(*increment_votes_query(option_id, n))
+
+
+SHARD_INCREMENT_SQL = """INSERT INTO option_vote_shards (option_id, shard, votes) VALUES (%s, %s, %s)
+                          ON DUPLICATE KEY UPDATE votes = votes + VALUES(votes)"""
+INCREMENT_VOTES_SQL = "UPDATE options SET votes = votes + %s WHERE id = %s"
+
+
+def increment_votes_query(option_id, n=1):
+    if VOTE_COUNTER_SHARDS > 0:
+        return SHARD_INCREMENT_SQL, (option_id, random.randrange(VOTE_COUNTER_SHARDS), n)
+    return INCREMENT_VOTES_SQL, (n, option_id)
+
+
+# Counter increment that doubles as the check that the option is in the poll
+GUARDED_INCREMENT_SQL = "UPDATE options SET votes = votes + 1 WHERE id = %s AND poll_id = %s"
+
+
+# The statements of one vote, run in order in one transaction. The first is
+# guarded by the option/poll match and affects no row for an option outside
+# the poll; a second vote by the same user fails with an IntegrityError on
+# UNIQUE(poll_id, user_id).
+def cast_vote_queries(poll_id, user_id, option_id):
+    if VOTE_COUNTER_SHARDS > 0:
+        return [(CAST_VOTE_SQL, (user_id, option_id, poll_id)), increment_votes_query(option_id)]
+    # Counter first: the INSERT's foreign key check takes a shared lock on
+    # the option row, and concurrent voters upgrading it for the UPDATE
+    # would deadlock each other
+    return [(GUARDED_INCREMENT_SQL, (option_id, poll_id)), (INSERT_VOTE_SQL, (poll_id, user_id, option_id))]
+
+
+# Record a vote inside the caller's transaction. Returns False (nothing
+# written) if the option does not belong to the poll.
+def cast_vote(cursor, poll_id, user_id, option_id):
+    guard, *rest = cast_vote_queries(poll_id, user_id, option_id)
+    if not cursor.execute(*guard):
+        return False
+    for query in rest:
+        cursor.execute(*query)
+    return True
+
+
+# Deadlock (1213) and lock wait timeout (1205): the vote is rolled back and
+# can simply be cast again
+VOTE_RETRY_ERRORS = (1205, 1213)
+
+
+def is_vote_retryable(error):
+    return isinstance(error, pymysql.err.OperationalError) and bool(error.args) and error.args[0] in VOTE_RETRY_ERRORS
+
+
+# Options with shard counts still to fold in, and one option's shards
+ROLLUP_OPTIONS_SQL = "SELECT DISTINCT option_id FROM option_vote_shards WHERE votes <> 0 LIMIT %s"
+ROLLUP_SHARDS_SQL = "SELECT shard, votes FROM option_vote_shards WHERE option_id = %s AND votes <> 0 FOR UPDATE"
+
+
+# Fold shard counts into options.votes. Each option is moved in its own short
+# transaction so voters are only blocked for the duration of two updates.
+# Returns the number of votes moved.
+def rollup_vote_shards(db, limit=1000):
+    cursor = db.cursor()
+    cursor.execute(ROLLUP_OPTIONS_SQL, (limit,))
+    option_ids = [row["option_id"] for row in cursor.fetchall()]
+    moved = 0
+    for option_id in option_ids:
+        cursor.execute(ROLLUP_SHARDS_SQL, (option_id,))
+        shards = cursor.fetchall()
+        total = sum(row["votes"] for row in shards)
+        if total:
+            cursor.execute(INCREMENT_VOTES_SQL, (total, option_id))
+            # Subtract exactly what was moved, shard by shard
+            cursor.executemany("UPDATE option_vote_shards SET votes = votes - %s WHERE option_id = %s AND shard = %s",
+                               [(row["votes"], option_id, row["shard"]) for row in shards])
+        db.commit()
+        moved += total
+    return moved
+
+
+# Background rollup for one worker. MySQL's GET_LOCK makes sure only one
+# worker across the fleet rolls up at a time; the others just skip a round.
+class VoteRollup:
+    def __init__(self, pool_getter, interval=VOTE_ROLLUP_INTERVAL):
+        self.pool_getter = pool_getter
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if VOTE_COUNTER_SHARDS <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="vote-rollup", daemon=True).start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error rolling up vote shards: {e}")
+
+    def run_once(self):
+        with self.pool_getter().connection() as db:
+            cursor = db.cursor()
+            cursor.execute("SELECT GET_LOCK('vote_shard_rollup', 0) AS locked")
+            if not cursor.fetchone()["locked"]:
+                return 0
+            try:
+                return rollup_vote_shards(db)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('vote_shard_rollup')")
@@ -0,0 +1,43 @@
+import os
+import threading
+from collections import OrderedDict
+
+VOTED_CACHE_SIZE = int(os.environ.get("VOTED_CACHE_SIZE", 100000))
+
+
+# Per-worker negative cache of (poll_id, user_id) pairs that are known to
+# have voted, so repeat clicks are answered without a round trip to MySQL.
+# The app never withdraws a vote, so entries cannot go stale; the least
+# recently used pairs are dropped beyond max_entries.
+class VotedCache:
+    def __init__(self, max_entries=VOTED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def has_voted(self, poll_id, user_id):
+        key = (poll_id, user_id)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return True
+            self._stats["misses"] += 1
+            return False
+
+    def add(self, poll_id, user_id):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(poll_id, user_id)] = None
+            self._entries.move_to_end((poll_id, user_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        stats["max_entries"] = self.max_entries
+        return stats